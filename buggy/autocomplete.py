@@ -0,0 +1,66 @@
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+
+from .models import Bug, Counter, SetTitle, SetState
+from .enums import State
+
+User = get_user_model()
+
+COUNTER = 'autocomplete'
+
+
+def get_version():
+    """
+    A token that changes whenever the autocomplete data could have changed.
+
+    It's a counter in the database bumped along with the changes, so that
+    every process agrees on it whatever the cache backend, and getting it is a
+    single primary key lookup.
+    """
+    return str(Counter.get(COUNTER))
+
+
+def invalidate():
+    """
+    Gives the autocomplete data a new version when the current transaction
+    commits.
+    """
+    Counter.bump(COUNTER)
+
+
+def operations_committed(operations):
+    """
+    Invalidates the data if `operations` change the titles or open/closed
+    states of bugs, the only changes to bugs it depends on.
+    """
+    if any(isinstance(operation, (SetTitle, SetState)) for operation in operations):
+        invalidate()
+
+
+def build_data():
+    open_bugs = list(Bug.objects.exclude(state=State.CLOSED).only('id', 'title'))
+    Bug.preload_numbers(open_bugs)
+    return {
+        'userNames': [
+            user.get_short_name().lower() for user in User.objects.filter(is_active=True)
+        ],
+        'openBugs': [
+            {
+                'title': bug.title,
+                'number': bug.number,
+            } for bug in open_bugs
+        ],
+    }
+
+
+def get_data(version):
+    """
+    The autocomplete data for `version`, cached so that it is only built once
+    per version.
+    """
+    return cache.get_or_set(
+        'buggy:autocomplete:{}'.format(version),
+        build_data,
+        getattr(settings, 'BUGGY_AUTOCOMPLETE_CACHE_TIMEOUT', 60 * 60 * 24),
+    )
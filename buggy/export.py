@@ -0,0 +1,178 @@
+"""
+Exports bugs, and optionally their history, as NDJSON or CSV.
+
+Everything is a generator: bugs are read through a server-side cursor, their
+actions are looked up a chunk of bugs at a time, and the output is encoded
+(and compressed) as it's produced, so memory use doesn't depend on the number
+of bugs exported.
+"""
+import csv
+import io
+import itertools
+import json
+import zlib
+
+from django.core.serializers.json import DjangoJSONEncoder
+
+from .models import Action, Bug
+
+FORMATS = ['ndjson', 'csv']
+CONTENT_TYPES = {
+    'ndjson': 'application/x-ndjson',
+    'csv': 'text/csv',
+}
+
+BUG_FIELDS = [
+    'number', 'title', 'state', 'priority', 'project', 'created_by',
+    'assigned_to', 'created_at', 'modified_at',
+]
+ACTION_FIELDS = [
+    'bug', 'order', 'created_at', 'user', 'summary', 'comment', 'title',
+    'state', 'priority', 'assigned_to', 'project', 'attachments',
+]
+
+CHUNK_SIZE = 500
+
+
+def get_email(user):
+    return user.email if user else None
+
+
+def serialize_bug(bug):
+    return {
+        'number': bug.number,
+        'title': bug.title,
+        'state': bug.state.value,
+        'priority': bug.priority.value,
+        'project': bug.project.name,
+        'created_by': get_email(bug.created_by),
+        'assigned_to': get_email(bug.assigned_to),
+        'created_at': bug.created_at,
+        'modified_at': bug.modified_at,
+    }
+
+
+def serialize_action(bug, action):
+    """
+    The operations of an action, each field is None unless the action
+    changed it.
+    """
+    def get(relation, attribute):
+        operation = getattr(action, relation, None)
+        return getattr(operation, attribute) if operation else None
+
+    state = get('setstate', 'state')
+    priority = get('setpriority', 'priority')
+    project = get('setproject', 'project')
+    return {
+        'bug': bug.number,
+        'order': action.order,
+        'created_at': action.created_at,
+        'user': get_email(action.user),
+        'summary': action.description,
+        'comment': get('comment', 'comment'),
+        'title': get('settitle', 'title'),
+        'state': state.value if state else None,
+        'priority': priority.value if priority else None,
+        'assigned_to': get_email(get('setassignment', 'assigned_to')),
+        'project': project.name if project else None,
+        'attachments': [attachment.filename for attachment in action.attachments.all()],
+    }
+
+
+def iter_bugs(bugs, as_of=False):
+    """
+    Yields chunks of `bugs`, read with a server-side cursor.
+    """
+    rows = bugs.select_related(
+        'project', 'created_by', 'assigned_to',
+    ).defer('fulltext', 'search_vector').order_by('pk').iterator()
+    while True:
+        chunk = list(itertools.islice(rows, CHUNK_SIZE))
+        if not chunk:
+            return
+        if as_of:
+            Bug.apply_as_of(chunk)
+        yield chunk
+
+
+def get_actions(bugs):
+    """
+    Maps the ids of `bugs` to their actions, in order.
+    """
+    actions = {bug.pk: [] for bug in bugs}
+    for action in Action.objects.filter(
+        bug__in=[bug.pk for bug in bugs],
+    ).select_related(
+        'user', 'comment', 'settitle', 'setstate', 'setpriority',
+        'setassignment__assigned_to', 'setproject__project',
+    ).prefetch_related('attachments').order_by('bug', 'order'):
+        actions[action.bug_id].append(action)
+    return actions
+
+
+def export_records(bugs, history=False, as_of=False):
+    """
+    Yields a dict for each bug. With `history`, each has an 'actions' list
+    too.
+    """
+    for chunk in iter_bugs(bugs, as_of):
+        actions = get_actions(chunk) if history else {}
+        for bug in chunk:
+            record = serialize_bug(bug)
+            if history:
+                record['actions'] = [serialize_action(bug, action) for action in actions[bug.pk]]
+            yield record
+
+
+def encode_ndjson(records):
+    for record in records:
+        yield (json.dumps(record, cls=DjangoJSONEncoder) + '\n').encode('utf-8')
+
+
+def encode_csv(records, history=False):
+    """
+    One row per bug, or one per action with `history`.
+    """
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=ACTION_FIELDS if history else BUG_FIELDS)
+
+    def flush():
+        value = buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+        return value.encode('utf-8')
+
+    writer.writeheader()
+    yield flush()
+    for record in records:
+        if history:
+            for action in record['actions']:
+                action['attachments'] = ' '.join(action['attachments'])
+                writer.writerow(action)
+        else:
+            writer.writerow(record)
+        yield flush()
+
+
+def gzip_stream(chunks):
+    compressor = zlib.compressobj(wbits=zlib.MAX_WBITS | 16)
+    for chunk in chunks:
+        compressed = compressor.compress(chunk)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
+
+
+def export(bugs, format='ndjson', history=False, as_of=False, compress=False):
+    """
+    Yields the export of `bugs` as bytes.
+    """
+    records = export_records(bugs, history, as_of)
+    if format == 'csv':
+        chunks = encode_csv(records, history)
+    else:
+        chunks = encode_ndjson(records)
+    if compress:
+        chunks = gzip_stream(chunks)
+    return chunks
@@ -0,0 +1,113 @@
+"""
+The number of bugs matching the bug list's filters, and for each choice of
+the facet filters, how many bugs there would be with that choice.
+
+A facet's counts apply every filter but its own, so that choices that aren't
+checked get a count too. All of it comes from one query: the bugs matching
+the other filters are grouped by GROUPING SETS, one set per facet, and each
+facet's count leaves out its own condition with FILTER.
+"""
+import hashlib
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection
+from django.db.models import Max
+
+from .models import Action, Bug
+
+
+def get_signature(form):
+    """
+    Identifies the filters of `form` and the state of the bugs, which only
+    change through new actions.
+    """
+    latest = Action.objects.aggregate(latest=Max('pk'))['latest']
+    items = sorted(
+        (name, sorted(form.data.getlist(name)))
+        for name in form.fields if name in form.data
+    )
+    return hashlib.md5('{}:{!r}'.format(latest, items).encode('utf-8')).hexdigest()
+
+
+def count(form):
+    """
+    Returns {'total': count, <facet>: {value: count}} for the valid FilterForm
+    `form`, with the values of the facet's form field.
+    """
+    columns = {
+        name: form.get_prefix() + field
+        for name, field in form.FACET_FIELDS.items()
+    }
+    base = form.filter(Bug.objects.all(), facets=False).values(*columns.values())
+    base_sql, base_params = base.query.sql_with_params()
+
+    conditions = {}
+    condition_params = {}
+    for name, values in form.get_facet_values().items():
+        if values is None:
+            conditions[name] = 'true'
+            condition_params[name] = []
+        else:
+            conditions[name] = 'bugs.{} = ANY(%s)'.format(columns[name])
+            condition_params[name] = [[getattr(value, 'value', value) for value in values]]
+
+    names = sorted(columns)
+    selects = []
+    params = []
+    for name in names + ['total']:
+        others = [other for other in names if other != name]
+        selects.append('count(*) FILTER (WHERE {})'.format(
+            ' AND '.join(conditions[other] for other in others)
+        ))
+        for other in others:
+            params.extend(condition_params[other])
+    params.extend(base_params)
+
+    with connection.cursor() as cursor:
+        cursor.execute(
+            '''
+                SELECT {groupings}, {columns}, {selects}
+                FROM ({base}) bugs
+                GROUP BY GROUPING SETS ({sets}, ())
+            '''.format(
+                groupings=', '.join('GROUPING(bugs.{})'.format(columns[name]) for name in names),
+                columns=', '.join('bugs.{}'.format(columns[name]) for name in names),
+                selects=', '.join(selects),
+                base=base_sql,
+                sets=', '.join('(bugs.{})'.format(columns[name]) for name in names),
+            ),
+            params,
+        )
+        rows = cursor.fetchall()
+
+    counts = {name: {} for name in names}
+    counts['total'] = 0
+    for row in rows:
+        groupings = row[:len(names)]
+        values = row[len(names):2 * len(names)]
+        totals = row[2 * len(names):]
+        if all(groupings):
+            counts['total'] = totals[-1]
+            continue
+        i = groupings.index(0)
+        if values[i] is not None:
+            counts[names[i]][values[i]] = totals[i]
+
+    # The state choices are groups of states.
+    counts['state'] = {
+        choice: sum(counts['state'].get(state.value, 0) for state in form.get_states(choice))
+        for choice, label in form.fields['state'].choices
+    }
+    return counts
+
+
+def get_counts(form):
+    """
+    count(form), cached for a little while for the same filters.
+    """
+    return cache.get_or_set(
+        'buggy-facets:{}'.format(get_signature(form)),
+        lambda: count(form),
+        getattr(settings, 'BUGGY_FACET_CACHE_TIMEOUT', 60),
+    )
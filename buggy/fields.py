@@ -1,6 +1,8 @@
 from django import forms
 from django.utils.datastructures import MultiValueDict
 
+from . import uploads
+
 
 class MultipleFileInput(forms.FileInput):
     def build_attrs(self, *args, **kwargs):
@@ -25,3 +27,21 @@ class MultipleFileField(forms.FileField):
             return []
         else:
             return [super().to_python(data)]
+
+
+class DirectUploadField(forms.Field):
+    """
+    The tokens of files uploaded straight to storage, see buggy.uploads.
+    Cleans to a list of Uploads.
+    """
+    widget = forms.MultipleHiddenInput
+
+    def to_python(self, data):
+        if not data:
+            return []
+        if not uploads.is_enabled():
+            raise forms.ValidationError("Direct uploads aren't enabled.")
+        try:
+            return [uploads.load_upload(token) for token in data]
+        except uploads.UploadError as e:
+            raise forms.ValidationError(str(e))
@@ -1,12 +1,16 @@
+import datetime
 import functools
 import operator
 
 from django import forms
 from django.contrib.auth import get_user_model
+from django.contrib.postgres.search import SearchQuery, SearchRank
+from django.db.models import F
+from django.utils import timezone
 
-from .models import Project, PresetFilter
+from .models import Project, PresetFilter, SEARCH_CONFIG
 from .enums import State, Priority
-from .fields import MultipleFileField
+from .fields import MultipleFileField, DirectUploadField
 
 User = get_user_model()
 
@@ -37,6 +41,13 @@ class FilterForm(forms.Form):
         queryset=User.objects.filter(is_active=True),
     )
 
+    as_of = forms.DateField(
+        required=False,
+        label='As of',
+        widget=forms.DateInput(attrs={'type': 'date'}),
+        help_text='Filter and show bugs as they were at the end of this day.',
+    )
+
     priority = forms.TypedMultipleChoiceField(
         required=False,
         widget=UnwrappedCheckboxSelectMultiple,
@@ -66,37 +77,63 @@ class FilterForm(forms.Form):
         ])
         super().__init__(data=data, **kwargs)
 
-    def filter(self, qs):
+    def get_as_of(self):
+        if self.cleaned_data.get('as_of'):
+            return timezone.make_aware(
+                datetime.datetime.combine(self.cleaned_data['as_of'], datetime.time.max)
+            )
+        else:
+            return None
+
+    # The filters that facet counts are shown for, and the Bug field they
+    # filter on.
+    FACET_FIELDS = {
+        'projects': 'project_id',
+        'assigned_to': 'assigned_to_id',
+        'priority': 'priority',
+        'state': 'state',
+    }
+
+    def get_states(self, choice):
+        return [
+            state for state in State
+            if state.value == choice or state.value.startswith('{}-'.format(choice))
+        ]
+
+    def get_facet_values(self):
+        """
+        The values each facet is restricted to, or None if it isn't filtered.
+        """
         cd = self.cleaned_data
-        if cd['projects']:
-            qs = qs.filter(project__in=cd['projects'])
+        return {
+            'projects': [project.pk for project in cd['projects']] or None,
+            'assigned_to': [cd['assigned_to'].pk] if cd['assigned_to'] else None,
+            'priority': list(cd['priority']) or None,
+            'state': [state for choice in cd['state'] for state in self.get_states(choice)] or None,
+        }
+
+    def get_prefix(self):
+        # Filters on what the bugs were at the time instead of what they are.
+        return 'as_of_' if self.get_as_of() else ''
+
+    def filter(self, qs, facets=True):
+        """
+        Filters `qs`, without the facet filters if `facets` is false.
+        """
+        cd = self.cleaned_data
+        if self.get_as_of():
+            qs = qs.as_of(self.get_as_of())
+
         if cd['created_by']:
             qs = qs.filter(created_by=cd['created_by'])
-        if cd['assigned_to']:
-            qs = qs.filter(assigned_to=cd['assigned_to'])
-        if cd['priority']:
-            qs = qs.filter(priority__in=cd['priority'])
-        if cd['state']:
-            qs = qs.filter(state__in={
-                state_enum
-                for state_enum in State
-                for state in cd['state']
-                if state_enum.value == state or state_enum.value.startswith('{}-'.format(state))
-            })
+        if facets:
+            for name, values in self.get_facet_values().items():
+                if values is not None:
+                    qs = qs.filter(**{self.get_prefix() + self.FACET_FIELDS[name] + '__in': values})
         if cd['search']:
-            # We use extra here instead of the builtin __search filter because
-            # it's extremely inefficient when used with .annotate() (we need to
-            # annotate in order to set the 'english' config, to match the
-            # expression in our functional index).
-            # <https://code.djangoproject.com/ticket/28128>
-            qs = qs.extra(
-                where=[
-                    '''
-                        to_tsvector('english', COALESCE("buggy_bug"."fulltext", '')) @@
-                            plainto_tsquery('english', %s)
-                    '''
-                ],
-                params=[cd['search']]
+            query = SearchQuery(cd['search'], config=SEARCH_CONFIG)
+            qs = qs.filter(search_vector=query).annotate(
+                rank=SearchRank(F('search_vector'), query),
             )
         return qs
 
@@ -130,6 +167,9 @@ class EditForm(BugFormBase):
     attachments = MultipleFileField(
         required=False,
     )
+    uploads = DirectUploadField(
+        required=False,
+    )
 
 
 class CreateForm(EditForm):
@@ -140,7 +180,7 @@ class CreateForm(EditForm):
 class BulkActionForm(BugFormBase):
     def __init__(self, *args, **kwargs):
         bug_queryset = kwargs.pop('queryset')
-        self.bug_actions = kwargs.pop('bug_actions')
+        self.state_actions = kwargs.pop('state_actions')
         super().__init__(*args, **kwargs)
         self.fields['bugs'] = forms.ModelMultipleChoiceField(
             queryset=bug_queryset, required=True
@@ -148,9 +188,14 @@ class BulkActionForm(BugFormBase):
 
     def clean(self):
         super().clean()
+        if 'bugs' not in self.cleaned_data or 'action' not in self.cleaned_data:
+            return
+        # The allowed actions only depend on the state, so only the distinct
+        # states of the selected bugs need to be fetched.
+        states = self.cleaned_data['bugs'].order_by().values_list('state', flat=True).distinct()
         allowed_actions = functools.reduce(
             operator.and_,
-            (set(self.bug_actions[bug.number]) for bug in self.cleaned_data['bugs']),
+            (self.state_actions[state] for state in states),
         )
         if self.cleaned_data['action'] not in allowed_actions:
             raise forms.ValidationError("Invalid action for the selected bugs.")
@@ -0,0 +1,224 @@
+"""
+Imports bugs and their history, in the NDJSON format of buggy.export, without
+going through Action.commit.
+
+Each batch of bugs is loaded with one COPY per table: the actions and their
+operations as they are, and the bugs with placeholder columns that are then
+derived from the actions by buggy.projections, like the rebuild_projections
+command does. A bug without 'actions' gets a single action that creates it as
+it is.
+
+Comments are stored unrendered, ./manage.py rerender_comments renders them.
+Attachments aren't imported: the export only has their names.
+"""
+import io
+
+from django.contrib.auth import get_user_model
+from django.db import connection, transaction
+from django.utils.dateparse import parse_datetime
+
+from . import autocomplete, projections, verhoeff
+from .enums import State, Priority
+from .models import (
+    Bug, Action, Comment, SetTitle, SetState, SetPriority, SetAssignment, SetProject,
+    Project,
+)
+
+User = get_user_model()
+
+
+class InvalidImport(Exception):
+    pass
+
+
+def encode(value):
+    """
+    A value in COPY's text format.
+    """
+    if value is None:
+        return '\\N'
+    if isinstance(value, (list, tuple)):
+        return '{' + ','.join(str(i) for i in value) + '}'
+    return str(value).replace('\\', '\\\\').replace('\t', '\\t').replace('\n', '\\n').replace('\r', '\\r')
+
+
+def copy_rows(cursor, model, columns, rows):
+    if not rows:
+        return
+    buffer = io.StringIO()
+    for row in rows:
+        buffer.write('\t'.join(encode(value) for value in row))
+        buffer.write('\n')
+    buffer.seek(0)
+    cursor.copy_expert(
+        'COPY {} ({}) FROM STDIN'.format(model._meta.db_table, ', '.join(columns)),
+        buffer,
+    )
+
+
+def allocate_ids(cursor, model, count):
+    cursor.execute(
+        "SELECT nextval(pg_get_serial_sequence(%s, 'id')) FROM generate_series(1, %s)",
+        [model._meta.db_table, count],
+    )
+    return [id for id, in cursor.fetchall()]
+
+
+def parse_time(value):
+    when = parse_datetime(value)
+    if when is None:
+        raise InvalidImport("Invalid datetime: {}".format(value))
+    return when
+
+
+class Importer(object):
+    """
+    Imports batches of records. Users are looked up by email and projects by
+    name, once for the whole import.
+    """
+    def __init__(self, create_users=False, keep_numbers=False):
+        self.create_users = create_users
+        self.keep_numbers = keep_numbers
+        self.users = {}
+        self.projects = {}
+
+    def get_user_ids(self, emails):
+        missing = {email for email in emails if email and email not in self.users}
+        if missing:
+            for user in User.objects.filter(email__in=missing):
+                self.users[user.email] = user.pk
+            missing -= set(self.users)
+        if missing and self.create_users:
+            for email in sorted(missing):
+                user = User.objects.create_user(email=email, name=email.split('@')[0], is_active=False)
+                self.users[user.email] = user.pk
+        elif missing:
+            raise InvalidImport("Unknown users: {}".format(', '.join(sorted(missing))))
+
+    def get_project_id(self, name):
+        if name not in self.projects:
+            self.projects[name] = Project.objects.get_or_create(name=name)[0].pk
+        return self.projects[name]
+
+    def get_actions(self, record):
+        if record.get('actions'):
+            return record['actions']
+        # The bug as it is, created in one go.
+        return [{
+            'created_at': record['created_at'],
+            'user': record['created_by'],
+            'summary': '',
+            'comment': None,
+            'title': record['title'],
+            'state': record['state'],
+            'priority': record['priority'],
+            'assigned_to': record.get('assigned_to'),
+            'project': record['project'],
+        }]
+
+    def get_bug_ids(self, cursor, records):
+        if not self.keep_numbers:
+            return allocate_ids(cursor, Bug, len(records))
+        ids = []
+        for record in records:
+            if not verhoeff.validate_verhoeff(record['number']):
+                raise InvalidImport("Invalid bug number: {}".format(record['number']))
+            ids.append(int(record['number'][:-1]))
+        return ids
+
+    @transaction.atomic
+    def import_batch(self, records):
+        """
+        Imports `records`, returns the number of actions imported.
+        """
+        self.get_user_ids({
+            email
+            for record in records
+            for action in self.get_actions(record)
+            for email in [action['user'], action.get('assigned_to')]
+        })
+
+        with connection.cursor() as cursor:
+            bug_ids = self.get_bug_ids(cursor, records)
+            action_count = sum(len(self.get_actions(record)) for record in records)
+            action_ids = iter(allocate_ids(cursor, Action, action_count))
+
+            bugs = []
+            rows = {
+                model: []
+                for model in [Action, Comment, SetTitle, SetState, SetPriority, SetAssignment, SetProject]
+            }
+            for bug_id, record in zip(bug_ids, records):
+                actions = self.get_actions(record)
+                fulltext = ''
+                for order, action in enumerate(actions):
+                    action_id = next(action_ids)
+                    rows[Action].append([
+                        action_id, bug_id, self.users[action['user']],
+                        parse_time(action['created_at']), order, action.get('summary') or '',
+                    ])
+                    if action.get('comment') is not None:
+                        rows[Comment].append([action_id, action['comment'], '', [], [], ''])
+                        fulltext += ' ' + action['comment']
+                    if action.get('title') is not None:
+                        rows[SetTitle].append([action_id, action['title']])
+                    if action.get('state') is not None:
+                        rows[SetState].append([action_id, State(action['state']).value])
+                    if action.get('priority') is not None:
+                        rows[SetPriority].append([action_id, Priority(action['priority']).value])
+                    if action.get('assigned_to') is not None:
+                        rows[SetAssignment].append([action_id, self.users[action['assigned_to']]])
+                    if action.get('project') is not None:
+                        rows[SetProject].append([action_id, self.get_project_id(action['project'])])
+
+                # Everything but the timestamps and fulltext is derived from
+                # the actions once they're loaded.
+                bugs.append([
+                    bug_id, parse_time(actions[0]['created_at']), parse_time(actions[-1]['created_at']),
+                    record['title'], State(record['state']).value, Priority(record['priority']).value,
+                    self.get_project_id(record['project']), self.users[actions[0]['user']],
+                    fulltext, len(actions),
+                ])
+
+            copy_rows(cursor, Bug, [
+                'id', 'created_at', 'modified_at', 'title', 'state', 'priority',
+                'project_id', 'created_by_id', 'fulltext', 'next_action_order',
+            ], bugs)
+            copy_rows(cursor, Action, [
+                'id', 'bug_id', 'user_id', 'created_at', '"order"', 'summary',
+            ], rows.pop(Action))
+            copy_rows(cursor, Comment, [
+                'action_id', 'comment', 'rendered_html', 'mentioned_user_ids',
+                'mentioned_bug_ids', 'renderer_version',
+            ], rows.pop(Comment))
+            for model, model_rows in rows.items():
+                columns = [field.column for field in model._meta.concrete_fields]
+                copy_rows(cursor, model, columns, model_rows)
+
+            if self.keep_numbers:
+                cursor.execute(
+                    "SELECT setval(pg_get_serial_sequence(%s, 'id'), (SELECT max(id) FROM {}))".format(
+                        Bug._meta.db_table,
+                    ),
+                    [Bug._meta.db_table],
+                )
+
+        projections.rebuild(min(bug_ids), max(bug_ids))
+        autocomplete.invalidate()
+        return action_count
+
+
+def import_records(records, batch_size=1000, **kwargs):
+    """
+    Imports `records` in batches of `batch_size` bugs, each in its own
+    transaction. Yields the number of bugs and actions imported by each batch.
+    """
+    importer = Importer(**kwargs)
+    batch = []
+    for record in records:
+        batch.append(record)
+        if len(batch) == batch_size:
+            yield len(batch), importer.import_batch(batch)
+            batch = []
+    if batch:
+        yield len(batch), importer.import_batch(batch)
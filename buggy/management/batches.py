@@ -0,0 +1,51 @@
+import multiprocessing
+
+from django.db import connections
+
+
+def id_ranges(queryset, batch_size, field='pk'):
+    """
+    Splits `queryset` into (first, last) ranges of at most `batch_size`
+    distinct values of `field`, the primary key by default, seeking through
+    its index so that no more than one batch of ids is loaded at a time.
+    """
+    ids = queryset.order_by(field).values_list(field, flat=True).distinct()
+    last = None
+    while True:
+        batch = list((ids if last is None else ids.filter(**{field + '__gt': last}))[:batch_size])
+        if not batch:
+            return
+        yield batch[0], batch[-1]
+        last = batch[-1]
+
+
+def run_in_pool(func, tasks, workers):
+    """
+    Calls `func` with each of `tasks` in a pool of `workers` processes, and
+    yields the results as they come in.
+
+    Database connections can't be shared between processes, so they are closed
+    before forking and every worker opens its own. `func` must be a module-level
+    function so that it can be sent to the workers. `tasks` is consumed as the
+    workers need more, so a generator like id_ranges is never read at once.
+    """
+    if workers <= 1:
+        for task in tasks:
+            yield func(task)
+        return
+
+    connections.close_all()
+    with multiprocessing.Pool(workers) as pool:
+        yield from pool.imap_unordered(func, close_connections_after(tasks))
+
+
+def close_connections_after(tasks):
+    """
+    Yields from `tasks`, closing the database connections once it's done. The
+    pool reads its tasks in a thread of its own, which opens its own
+    connections if they come from queries.
+    """
+    try:
+        yield from tasks
+    finally:
+        connections.close_all()
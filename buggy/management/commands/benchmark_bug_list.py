@@ -0,0 +1,74 @@
+import timeit
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.template.loader import get_template
+from django.utils import timezone
+
+from buggy import verhoeff
+from buggy.enums import Priority, State
+from buggy.models import Bug, Project
+
+User = get_user_model()
+
+
+def build_bugs(rows):
+    # Unsaved, so that nothing but rendering is timed.
+    user = User(name='Benchmark User', email='benchmark@example.com')
+    project = Project(name='Benchmark')
+    now = timezone.now()
+    return [
+        Bug(
+            id=i, title='Bug {}'.format(i), state=State.NEW, priority=Priority.NORMAL,
+            project=project, created_by=user, assigned_to=user, modified_at=now,
+        )
+        for i in range(1, rows + 1)
+    ]
+
+
+class Command(BaseCommand):
+    help = (
+        "Times the rendering of the bug list and of bug numbers, without and "
+        "with the memoized Bug.number. Doesn't touch the database."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--rows', type=int, default=10000,
+            help="Number of bugs in the list (default: 10000).",
+        )
+        parser.add_argument(
+            '--repeat', type=int, default=5,
+            help="Number of runs to take the best time of.",
+        )
+
+    def time(self, label, func, repeat):
+        seconds = min(timeit.repeat(func, number=1, repeat=repeat))
+        self.stdout.write('{:<40} {:8.1f} ms'.format(label, seconds * 1000))
+
+    def handle(self, rows, repeat, **options):
+        template = get_template('buggy/_bug_list.html')
+        ids = list(range(1, rows + 1))
+
+        def render():
+            template.render({'bugs': build_bugs(rows)})
+
+        def render_preloaded():
+            bugs = build_bugs(rows)
+            Bug.preload_numbers(bugs)
+            template.render({'bugs': bugs})
+
+        original_number = Bug.__dict__['number']
+        self.stdout.write('{} rows, numpy {}'.format(
+            rows, 'available' if verhoeff.numpy is not None else 'not installed',
+        ))
+        self.time('generate_verhoeff, one at a time', lambda: [verhoeff.generate_verhoeff(i) for i in ids], repeat)
+        self.time('generate_verhoeff_many', lambda: verhoeff.generate_verhoeff_many(ids), repeat)
+        # What Bug.number used to be, recomputed on every access.
+        Bug.number = property(lambda bug: verhoeff.generate_verhoeff(bug.id))
+        try:
+            self.time('render, number not memoized', render, repeat)
+        finally:
+            Bug.number = original_number
+        self.time('render, number memoized', render, repeat)
+        self.time('render, numbers preloaded', render_preloaded, repeat)
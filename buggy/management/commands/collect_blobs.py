@@ -0,0 +1,57 @@
+import datetime
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+
+from buggy.models import Blob
+
+
+def collect_blobs(grace_period, batch_size):
+    """
+    Deletes up to `batch_size` blobs that no attachment has used for
+    `grace_period`, and their files. Returns the number deleted.
+    """
+    with transaction.atomic():
+        blobs = list(Blob.objects.filter(
+            ref_count=0,
+            last_used_at__lt=timezone.now() - grace_period,
+        ).order_by('pk').select_for_update(skip_locked=True)[:batch_size])
+        Blob.objects.filter(pk__in=[blob.pk for blob in blobs]).delete()
+        # Files are never shared, but a file another blob uses is kept all
+        # the same.
+        shared = set(Blob.objects.filter(
+            file__in=[blob.file.name for blob in blobs],
+        ).values_list('file', flat=True))
+        # The files go once nothing can roll back the deletion of the rows.
+        for blob in blobs:
+            if blob.file.name in shared:
+                continue
+            transaction.on_commit(lambda file=blob.file: file.delete(save=False))
+    return len(blobs)
+
+
+class Command(BaseCommand):
+    help = "Deletes the attachment blobs that are not used by any attachment anymore."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--grace-period', type=int,
+            default=getattr(settings, 'BUGGY_BLOB_GRACE_PERIOD', 24 * 60 * 60),
+            help="Seconds a blob must have been unused for (default: a day).",
+        )
+        parser.add_argument(
+            '--batch-size', type=int, default=1000,
+            help="Number of blobs deleted per transaction.",
+        )
+
+    def handle(self, grace_period, batch_size, **options):
+        grace_period = datetime.timedelta(seconds=grace_period)
+        total = 0
+        while True:
+            count = collect_blobs(grace_period, batch_size)
+            total += count
+            if count < batch_size:
+                break
+        self.stdout.write('Deleted {} blobs.'.format(total))
@@ -0,0 +1,65 @@
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+from django.http import QueryDict
+
+from buggy import export
+from buggy.forms import FilterForm
+from buggy.models import Bug
+
+
+class Command(BaseCommand):
+    help = (
+        "Exports the bugs matching the bug list's filters as NDJSON or CSV, "
+        "optionally with their history."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--format', choices=export.FORMATS, default='ndjson',
+            help="Output format (default: ndjson).",
+        )
+        parser.add_argument(
+            '--history', action='store_true',
+            help="Include the actions of each bug, one row per action in CSV.",
+        )
+        parser.add_argument(
+            '--gzip', action='store_true', dest='compress',
+            help="Compress the output with gzip.",
+        )
+        parser.add_argument(
+            '--filter', action='append', default=[], dest='filters', metavar='NAME=VALUE',
+            help="A bug list filter, like state=resolved or search=login. Can be repeated.",
+        )
+        parser.add_argument(
+            '--output', '-o',
+            help="File to write to (default: standard output).",
+        )
+
+    def handle(self, format, history, compress, filters, output, **options):
+        data = QueryDict(mutable=True)
+        for name_value in filters:
+            name, sep, value = name_value.partition('=')
+            if not sep:
+                raise CommandError("Filters must be NAME=VALUE: {}".format(name_value))
+            data.appendlist(name, value)
+        form = FilterForm(data)
+        if not form.is_valid():
+            raise CommandError("Invalid filters: {}".format(form.errors.as_text()))
+
+        chunks = export.export(
+            form.filter(Bug.objects.all()),
+            format=format,
+            history=history,
+            as_of=bool(form.get_as_of()),
+            compress=compress,
+        )
+        out = open(output, 'wb') if output else sys.stdout.buffer
+        try:
+            for chunk in chunks:
+                out.write(chunk)
+        finally:
+            if output:
+                out.close()
+            else:
+                out.flush()
@@ -0,0 +1,45 @@
+import multiprocessing
+import time
+
+from django.core.management.base import BaseCommand
+
+from buggy.models import Blob
+from buggy.management.batches import run_in_pool
+from buggy.thumbnails import process_blob
+
+
+class Command(BaseCommand):
+    help = "Generates the thumbnails and image dimensions of new attachments."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--workers', type=int, default=multiprocessing.cpu_count(),
+            help="Number of worker processes (default: number of CPUs).",
+        )
+        parser.add_argument(
+            '--batch-size', type=int, default=100,
+            help="Number of attachments processed between checks for new ones.",
+        )
+        parser.add_argument(
+            '--interval', type=float, default=5,
+            help="Seconds to wait for new attachments when there are none.",
+        )
+        parser.add_argument(
+            '--once', action='store_true',
+            help="Exit once there is nothing left to process instead of waiting.",
+        )
+
+    def handle(self, workers, batch_size, interval, once, **options):
+        while True:
+            pks = list(Blob.objects.filter(
+                processed_at__isnull=True,
+            ).order_by('attempts', 'pk').values_list('pk', flat=True)[:batch_size])
+            done = sum(run_in_pool(process_blob, pks, workers))
+            if done:
+                self.stdout.write('Processed {} attachments.'.format(done))
+            # The rest of the batch may be locked by another worker, or have
+            # failed.
+            if len(pks) < batch_size or not done:
+                if once:
+                    return
+                time.sleep(interval)
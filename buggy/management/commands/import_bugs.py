@@ -0,0 +1,65 @@
+import gzip
+import json
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from buggy.importer import InvalidImport, import_records
+
+
+def read_records(f):
+    for line in f:
+        if line.strip():
+            yield json.loads(line)
+
+
+class Command(BaseCommand):
+    help = (
+        "Imports bugs and their history from NDJSON, in the format of "
+        "export_bugs --history, with COPY."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'input', nargs='?',
+            help="File to read, gzipped if it ends in .gz (default: standard input).",
+        )
+        parser.add_argument(
+            '--batch-size', type=int, default=1000,
+            help="Number of bugs imported per transaction.",
+        )
+        parser.add_argument(
+            '--create-users', action='store_true',
+            help="Create inactive users for unknown emails instead of failing.",
+        )
+        parser.add_argument(
+            '--keep-numbers', action='store_true',
+            help="Give bugs the numbers they have in the input, which must be free.",
+        )
+
+    def handle(self, input, batch_size, create_users, keep_numbers, **options):
+        if input is None:
+            f = sys.stdin
+        elif input.endswith('.gz'):
+            f = gzip.open(input, 'rt', encoding='utf-8')
+        else:
+            f = open(input, encoding='utf-8')
+
+        bugs = actions = 0
+        try:
+            for bug_count, action_count in import_records(
+                read_records(f),
+                batch_size=batch_size,
+                create_users=create_users,
+                keep_numbers=keep_numbers,
+            ):
+                bugs += bug_count
+                actions += action_count
+                if options['verbosity'] >= 2:
+                    self.stdout.write('Imported {} bugs'.format(bugs))
+        except (InvalidImport, KeyError, ValueError) as e:
+            raise CommandError("Import failed after {} bugs: {!r}".format(bugs, e))
+        finally:
+            if input is not None:
+                f.close()
+        self.stdout.write('Imported {} bugs and {} actions.'.format(bugs, actions))
@@ -0,0 +1,33 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from buggy.webhook import process_pending_deliveries
+
+
+class Command(BaseCommand):
+    help = "Applies the pushes received by the git webhook."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, default=10,
+            help="Number of pushes processed between checks for new ones.",
+        )
+        parser.add_argument(
+            '--interval', type=float, default=5,
+            help="Seconds to wait for new pushes when there are none.",
+        )
+        parser.add_argument(
+            '--once', action='store_true',
+            help="Exit once there is nothing left to process instead of waiting.",
+        )
+
+    def handle(self, batch_size, interval, once, **options):
+        while True:
+            done, failed = process_pending_deliveries(batch_size)
+            if done or failed:
+                self.stdout.write('Processed {} pushes, {} failed.'.format(done, failed))
+            if done + failed < batch_size:
+                if once:
+                    return
+                time.sleep(interval)
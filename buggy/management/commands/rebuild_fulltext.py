@@ -0,0 +1,57 @@
+import multiprocessing
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+
+from buggy.models import Bug, Action, Comment
+from buggy.management.batches import id_ranges, run_in_pool
+
+
+def rebuild(id_range):
+    first, last = id_range
+    bugs = Bug.objects.filter(pk__gte=first, pk__lte=last)
+    with transaction.atomic(), connection.cursor() as cursor:
+        # Comments are the only text that ends up in fulltext now, titles are
+        # searched through the search vector.
+        cursor.execute(
+            '''
+                UPDATE {bug} SET fulltext = COALESCE((
+                  SELECT string_agg(' ' || {comment}.comment, '' ORDER BY {action}."order")
+                  FROM {action}
+                  JOIN {comment} ON {comment}.action_id = {action}.id
+                  WHERE {action}.bug_id = {bug}.id
+                ), '')
+                WHERE {bug}.id BETWEEN %s AND %s
+            '''.format(
+                bug=Bug._meta.db_table,
+                action=Action._meta.db_table,
+                comment=Comment._meta.db_table,
+            ),
+            [first, last],
+        )
+        return bugs.update_search_vectors()
+
+
+class Command(BaseCommand):
+    help = (
+        "Recomputes the fulltext and search vector of bugs from their comments, "
+        "dropping any old text that accumulated in them."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--workers', type=int, default=multiprocessing.cpu_count(),
+            help="Number of worker processes (default: number of CPUs).",
+        )
+        parser.add_argument(
+            '--batch-size', type=int, default=500,
+            help="Number of bugs each worker rebuilds per transaction.",
+        )
+
+    def handle(self, workers, batch_size, **options):
+        total = 0
+        for count in run_in_pool(rebuild, id_ranges(Bug.objects.all(), batch_size), workers):
+            total += count
+            if options['verbosity'] >= 2:
+                self.stdout.write('Rebuilt {} bugs'.format(total))
+        self.stdout.write('Rebuilt {} bugs.'.format(total))
@@ -0,0 +1,75 @@
+import multiprocessing
+
+from django.core.management.base import BaseCommand, CommandError
+
+from buggy import verhoeff
+from buggy.models import Action
+from buggy.projections import find_drift, rebuild
+from buggy.management.batches import id_ranges, run_in_pool
+
+
+def verify_range(id_range):
+    return find_drift(*id_range)
+
+
+def repair_range(id_range):
+    return rebuild(*id_range, only_drifted=True)
+
+
+def rebuild_range(id_range):
+    return rebuild(*id_range)
+
+
+class Command(BaseCommand):
+    help = (
+        "Re-derives the bug table from the action log, in batches of bug ids "
+        "that each get their own transaction."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--workers', type=int, default=multiprocessing.cpu_count(),
+            help="Number of worker processes (default: number of CPUs).",
+        )
+        parser.add_argument(
+            '--batch-size', type=int, default=1000,
+            help="Number of bugs each worker handles per transaction.",
+        )
+        mode = parser.add_mutually_exclusive_group()
+        mode.add_argument(
+            '--verify', action='store_true',
+            help="Only report the bugs that don't match their actions.",
+        )
+        mode.add_argument(
+            '--repair', action='store_true',
+            help="Only rewrite the bugs that don't match their actions.",
+        )
+
+    def handle(self, workers, batch_size, verify, repair, **options):
+        if batch_size < 1:
+            raise CommandError("--batch-size must be at least 1.")
+        if verify:
+            func = verify_range
+        elif repair:
+            func = repair_range
+        else:
+            func = rebuild_range
+
+        # Ranges of the bugs in the action log, which has the bugs missing from
+        # the bug table too.
+        ranges = id_ranges(Action.objects.all(), batch_size, field='bug')
+        ids = []
+        for batch in run_in_pool(func, ranges, workers):
+            ids.extend(batch)
+            if verify or (repair and options['verbosity'] >= 2):
+                for id in batch:
+                    self.stdout.write('#{}'.format(verhoeff.generate_verhoeff(id)))
+
+        if verify:
+            self.stdout.write('{} bugs have drifted.'.format(len(ids)))
+            if ids:
+                raise CommandError('The bug table does not match the action log.')
+        elif repair:
+            self.stdout.write('Repaired {} bugs.'.format(len(ids)))
+        else:
+            self.stdout.write('Rebuilt {} bugs.'.format(len(ids)))
@@ -0,0 +1,60 @@
+import multiprocessing
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from buggy.markdown import RENDERER_VERSION
+from buggy.models import Comment
+from buggy.management.batches import id_ranges, run_in_pool
+
+
+def get_queryset(everything):
+    if everything:
+        return Comment.objects.all()
+    else:
+        return Comment.objects.exclude(renderer_version=RENDERER_VERSION)
+
+
+def rerender(task):
+    (first, last), everything = task
+    comments = get_queryset(everything).filter(pk__gte=first, pk__lte=last)
+    with transaction.atomic():
+        count = 0
+        for comment in comments.select_for_update():
+            comment.render()
+            comment.save(update_fields=[
+                'rendered_html', 'mentioned_user_ids', 'mentioned_bug_ids', 'renderer_version',
+            ])
+            count += 1
+    return count
+
+
+class Command(BaseCommand):
+    help = (
+        "Re-renders the stored HTML of comments that were rendered by another "
+        "version of the markdown renderer."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--workers', type=int, default=multiprocessing.cpu_count(),
+            help="Number of worker processes (default: number of CPUs).",
+        )
+        parser.add_argument(
+            '--batch-size', type=int, default=500,
+            help="Number of comments each worker renders per transaction.",
+        )
+        parser.add_argument(
+            '--all', action='store_true', dest='everything',
+            help="Re-render every comment, not only the stale ones.",
+        )
+
+    def handle(self, workers, batch_size, everything, **options):
+        ranges = id_ranges(get_queryset(everything), batch_size)
+        tasks = [(id_range, everything) for id_range in ranges]
+        total = 0
+        for count in run_in_pool(rerender, tasks, workers):
+            total += count
+            if options['verbosity'] >= 2:
+                self.stdout.write('Rendered {} comments'.format(total))
+        self.stdout.write('Rendered {} comments.'.format(total))
@@ -0,0 +1,33 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from buggy.notifications import send_pending_notifications
+
+
+class Command(BaseCommand):
+    help = "Sends the notification emails waiting in the outbox."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, default=100,
+            help="Number of emails sent per transaction.",
+        )
+        parser.add_argument(
+            '--interval', type=float, default=5,
+            help="Seconds to wait for new notifications when the outbox is empty.",
+        )
+        parser.add_argument(
+            '--once', action='store_true',
+            help="Exit once there is nothing left to send instead of waiting.",
+        )
+
+    def handle(self, batch_size, interval, once, **options):
+        while True:
+            sent, failed = send_pending_notifications(batch_size)
+            if sent or failed:
+                self.stdout.write('Sent {} notifications, {} failed.'.format(sent, failed))
+            if sent + failed < batch_size:
+                if once:
+                    return
+                time.sleep(interval)
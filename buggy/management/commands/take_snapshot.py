@@ -0,0 +1,63 @@
+import datetime
+import multiprocessing
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from buggy.models import Bug, Snapshot
+from buggy.management.batches import id_ranges, run_in_pool
+
+# Actions get their created_at when they're built, a moment before they're
+# committed. Snapshots are taken a little in the past so that they don't miss
+# actions that were still being committed.
+DEFAULT_LAG = datetime.timedelta(minutes=5)
+
+
+def fill(task):
+    snapshot_id, (first, last) = task
+    snapshot = Snapshot.objects.get(pk=snapshot_id)
+    with transaction.atomic():
+        return snapshot.fill(Bug.objects.filter(pk__gte=first, pk__lte=last))
+
+
+class Command(BaseCommand):
+    help = (
+        "Stores the state of every bug at a point in time, so that looking up "
+        "past states only has to replay the actions since then."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--at',
+            help="When to take the snapshot, as an ISO 8601 datetime (default: a few minutes ago).",
+        )
+        parser.add_argument(
+            '--workers', type=int, default=multiprocessing.cpu_count(),
+            help="Number of worker processes (default: number of CPUs).",
+        )
+        parser.add_argument(
+            '--batch-size', type=int, default=1000,
+            help="Number of bugs each worker snapshots per transaction.",
+        )
+
+    def handle(self, at, workers, batch_size, **options):
+        if at is None:
+            taken_at = timezone.now() - DEFAULT_LAG
+        else:
+            taken_at = parse_datetime(at)
+            if taken_at is None:
+                raise CommandError("Invalid datetime: {}".format(at))
+            if timezone.is_naive(taken_at):
+                taken_at = timezone.make_aware(taken_at)
+        if Snapshot.objects.filter(taken_at=taken_at).exists():
+            raise CommandError("There already is a snapshot at {}.".format(taken_at))
+
+        snapshot = Snapshot.objects.create(taken_at=taken_at)
+        bugs = Bug.objects.filter(created_at__lte=taken_at)
+        tasks = [(snapshot.pk, id_range) for id_range in id_ranges(bugs, batch_size)]
+        total = sum(run_in_pool(fill, tasks, workers))
+        snapshot.is_complete = True
+        snapshot.save(update_fields=['is_complete'])
+        self.stdout.write('Took a snapshot of {} bugs at {}.'.format(total, taken_at.isoformat()))
@@ -1,6 +1,10 @@
+import re
+
 from django.contrib.auth import get_user_model
+from django.db.models.functions import Upper
 
 from markdown.inlinepatterns import Pattern
+from markdown.preprocessors import Preprocessor
 from markdown.extensions import Extension
 from markdown.util import etree
 import markdown
@@ -10,6 +14,35 @@ from buggy.models import Bug
 
 User = get_user_model()
 
+# Identifies the output of the renderer, stored with the HTML of comments.
+# Increment the first part whenever the rendering changes, so that stored HTML
+# is re-rendered (see the rerender_comments command).
+RENDERER_VERSION = '1:markdown-{}:bleach-{}'.format(markdown.version, bleach.__version__)
+
+
+# Looser than the inline patterns, so that everything they can match is
+# preloaded.
+MENTION_CANDIDATE_RE = re.compile(r'@([A-z]+)\b')
+BUG_NUMBER_CANDIDATE_RE = re.compile(r'#(\d+)\b')
+
+
+class ReferencePreloader(Preprocessor):
+    """
+    Resolves every @mention and #bugnumber in the source with one query each
+    before the inline patterns run, so that they don't need a query per match.
+    """
+    def __init__(self, *args, **kwargs):
+        self.extension = kwargs.pop('extension')
+        super().__init__(*args, **kwargs)
+
+    def run(self, lines):
+        text = '\n'.join(lines)
+        self.extension.preload(
+            names=MENTION_CANDIDATE_RE.findall(text),
+            numbers=BUG_NUMBER_CANDIDATE_RE.findall(text),
+        )
+        return lines
+
 
 class MentionPattern(Pattern):
     def __init__(self, *args, **kwargs):
@@ -17,9 +50,8 @@ class MentionPattern(Pattern):
         super().__init__(*args, **kwargs)
 
     def handleMatch(self, match):
-        try:
-            user = User.objects.filter(name__iexact=match.group(3)).get()
-        except User.DoesNotExist:
+        user = self.extension.get_user(match.group(3))
+        if user is None:
             return None
         else:
             self.extension.mentioned_users.add(user)
@@ -34,9 +66,8 @@ class BugNumberPattern(Pattern):
         super().__init__(*args, **kwargs)
 
     def handleMatch(self, match):
-        try:
-            bug = Bug.objects.get_by_number(match.group(3))
-        except Bug.DoesNotExist:
+        bug = self.extension.get_bug(match.group(3))
+        if bug is None:
             return None
         else:
             self.extension.mentioned_bugs.add(bug)
@@ -53,9 +84,50 @@ class BuggyExtension(Extension):
     def __init__(self, *args, **kwargs):
         self.mentioned_users = set()
         self.mentioned_bugs = set()
+        # Resolved references, None for the ones that don't exist.
+        self.users_by_name = {}
+        self.bugs_by_number = {}
         super().__init__(*args, **kwargs)
 
+    def preload(self, names, numbers):
+        names = {name.upper() for name in names} - set(self.users_by_name)
+        if names:
+            users = {}
+            for user in User.objects.annotate(upper_name=Upper('name')).filter(upper_name__in=names):
+                users.setdefault(user.upper_name, []).append(user)
+            for name in names:
+                matches = users.get(name, [])
+                # Ambiguous names are left for get_user to look up (and fail
+                # on) by themselves.
+                if len(matches) <= 1:
+                    self.users_by_name[name] = matches[0] if matches else None
+
+        numbers = set(numbers) - set(self.bugs_by_number)
+        if numbers:
+            bugs = Bug.objects.select_related('project').get_by_numbers(numbers)
+            for number in numbers:
+                self.bugs_by_number[number] = bugs.get(number)
+
+    def get_user(self, name):
+        if name.upper() not in self.users_by_name:
+            try:
+                user = User.objects.filter(name__iexact=name).get()
+            except User.DoesNotExist:
+                user = None
+            self.users_by_name[name.upper()] = user
+        return self.users_by_name[name.upper()]
+
+    def get_bug(self, number):
+        if number not in self.bugs_by_number:
+            try:
+                bug = Bug.objects.select_related('project').get_by_number(number)
+            except Bug.DoesNotExist:
+                bug = None
+            self.bugs_by_number[number] = bug
+        return self.bugs_by_number[number]
+
     def extendMarkdown(self, md, md_globals):
+        md.preprocessors.add('buggy_references', ReferencePreloader(md, extension=self), '_begin')
         md.inlinePatterns['mention'] = MentionPattern(r'(^|(?<=\s))@([A-z]+)\b', extension=self)
         md.inlinePatterns['bugnumber'] = BugNumberPattern(r'(^|(?<=\s))#(\d+)\b', extension=self)
 
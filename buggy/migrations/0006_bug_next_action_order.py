@@ -0,0 +1,31 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-18 18:14
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('buggy', '0005_add_bug_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='bug',
+            name='next_action_order',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.RunSQL(
+            """
+            UPDATE buggy_bug
+            SET next_action_order = COALESCE((
+              SELECT max("order") + 1
+              FROM buggy_action
+              WHERE buggy_action.bug_id = buggy_bug.id
+            ), 0);
+            """,
+            migrations.RunSQL.noop,
+        ),
+    ]
@@ -0,0 +1,36 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-18 18:14
+from __future__ import unicode_literals
+
+import django.contrib.postgres.fields
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('buggy', '0006_bug_next_action_order'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='comment',
+            name='mentioned_bug_ids',
+            field=django.contrib.postgres.fields.ArrayField(base_field=models.IntegerField(), default=list, editable=False, size=None),
+        ),
+        migrations.AddField(
+            model_name='comment',
+            name='mentioned_user_ids',
+            field=django.contrib.postgres.fields.ArrayField(base_field=models.IntegerField(), default=list, editable=False, size=None),
+        ),
+        migrations.AddField(
+            model_name='comment',
+            name='rendered_html',
+            field=models.TextField(default='', editable=False),
+        ),
+        migrations.AddField(
+            model_name='comment',
+            name='renderer_version',
+            field=models.CharField(default='', editable=False, max_length=100),
+        ),
+    ]
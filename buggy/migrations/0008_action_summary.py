@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-18 18:19
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('buggy', '0007_comment_render_cache'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='action',
+            name='summary',
+            field=models.TextField(default='', editable=False),
+        ),
+    ]
@@ -0,0 +1,44 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-18 18:21
+from __future__ import unicode_literals
+
+import django.contrib.postgres.indexes
+import django.contrib.postgres.search
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('buggy', '0008_action_summary'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='bug',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True),
+        ),
+        migrations.RunSQL(
+            """
+            UPDATE buggy_bug SET search_vector =
+              setweight(to_tsvector('english', COALESCE(title, '')), 'A') ||
+              setweight(to_tsvector('english', COALESCE(fulltext, '')), 'B');
+            """,
+            migrations.RunSQL.noop,
+        ),
+        migrations.AddIndex(
+            model_name='bug',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['search_vector'], name='buggy_bug_search__62c94e_gin'),
+        ),
+        migrations.RunSQL(
+            """
+            DROP INDEX buggy_bug_fulltext_index;
+            """,
+            """
+            CREATE INDEX buggy_bug_fulltext_index
+              ON buggy_bug
+              USING gin (to_tsvector('english', COALESCE(fulltext, '')));
+            """
+        ),
+    ]
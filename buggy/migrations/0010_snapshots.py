@@ -0,0 +1,49 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-18 18:24
+from __future__ import unicode_literals
+
+import buggy.enums
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import enumfields.fields
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('buggy', '0009_bug_search_vector'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BugSnapshot',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('title', models.CharField(max_length=100)),
+                ('state', enumfields.fields.EnumField(enum=buggy.enums.State, max_length=25)),
+                ('priority', enumfields.fields.EnumIntegerField(enum=buggy.enums.Priority)),
+                ('assigned_to', models.ForeignKey(null=True, on_delete=django.db.models.deletion.PROTECT, related_name='+', to=settings.AUTH_USER_MODEL)),
+                ('bug', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='buggy.Bug')),
+                ('project', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='+', to='buggy.Project')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='Snapshot',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('taken_at', models.DateTimeField(unique=True)),
+                ('is_complete', models.BooleanField(default=False)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='bugsnapshot',
+            name='snapshot',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='bugs', to='buggy.Snapshot'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='bugsnapshot',
+            unique_together=set([('snapshot', 'bug')]),
+        ),
+    ]
@@ -0,0 +1,46 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-18 18:28
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('buggy', '0011_notification_outbox'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProcessedCommit',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('commit_id', models.CharField(max_length=64)),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('bug', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='buggy.Bug')),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='processedcommit',
+            unique_together=set([('commit_id', 'bug')]),
+        ),
+        # Commits were recognized by their id appearing in a comment before.
+        # The comments the webhook left are enough to carry that over.
+        migrations.RunSQL(
+            """
+            INSERT INTO buggy_processedcommit (commit_id, bug_id, created_at)
+            SELECT commit.id, buggy_action.bug_id, min(buggy_action.created_at)
+            FROM buggy_comment
+            JOIN buggy_action ON buggy_action.id = buggy_comment.action_id
+            CROSS JOIN LATERAL
+              substring(buggy_comment.comment from 'the bug in commit `([0-9a-f]{7,64})`:') AS commit (id)
+            WHERE buggy_comment.comment LIKE '%the bug in commit `%'
+              AND commit.id IS NOT NULL
+            GROUP BY commit.id, buggy_action.bug_id;
+            """,
+            migrations.RunSQL.noop,
+        ),
+    ]
@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-18 19:02
+from __future__ import unicode_literals
+
+import hashlib
+import os.path
+
+import buggy.models
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+def move_attachments_to_blobs(apps, schema_editor):
+    """
+    Makes a blob of each attachment's file, left where it is. Attachments with
+    the same content share a blob, the copies are left on disk.
+    """
+    AddAttachment = apps.get_model('buggy', 'AddAttachment')
+    Blob = apps.get_model('buggy', 'Blob')
+
+    for attachment in AddAttachment.objects.order_by('pk').iterator():
+        digest = hashlib.sha256()
+        size = 0
+        storage = attachment.file.storage
+        if storage.exists(attachment.file.name):
+            with storage.open(attachment.file.name) as f:
+                for chunk in f.chunks():
+                    digest.update(chunk)
+                    size += len(chunk)
+        else:
+            # There's no content to address, the path keeps it apart from other
+            # missing files.
+            digest.update('missing:{}'.format(attachment.file.name).encode('utf-8'))
+        blob, _ = Blob.objects.get_or_create(
+            sha256=digest.hexdigest(),
+            defaults={'file': attachment.file.name, 'size': size},
+        )
+        Blob.objects.filter(pk=blob.pk).update(ref_count=models.F('ref_count') + 1)
+        AddAttachment.objects.filter(pk=attachment.pk).update(
+            blob=blob,
+            filename=os.path.basename(attachment.file.name),
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('buggy', '0013_webhook_delivery'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Blob',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('sha256', models.CharField(max_length=64, unique=True)),
+                ('file', models.FileField(max_length=255, upload_to=buggy.models.blob_upload_to)),
+                ('size', models.BigIntegerField()),
+                ('ref_count', models.PositiveIntegerField(default=0)),
+                ('last_used_at', models.DateTimeField(db_index=True, default=django.utils.timezone.now)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='addattachment',
+            name='blob',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.PROTECT, related_name='attachments', to='buggy.Blob'),
+        ),
+        migrations.AddField(
+            model_name='addattachment',
+            name='filename',
+            field=models.CharField(default='', max_length=255),
+            preserve_default=False,
+        ),
+        migrations.RunPython(move_attachments_to_blobs, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,25 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-18 19:02
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('buggy', '0014_attachment_blobs'),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name='addattachment',
+            name='file',
+        ),
+        migrations.AlterField(
+            model_name='addattachment',
+            name='blob',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='attachments', to='buggy.Blob'),
+        ),
+    ]
@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-18 18:39
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('buggy', '0016_blob_thumbnails'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='blob',
+            name='sha256',
+            field=models.CharField(max_length=64, null=True, unique=True),
+        ),
+    ]
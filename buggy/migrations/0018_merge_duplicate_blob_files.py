@@ -0,0 +1,33 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+def merge_duplicate_files(apps, schema_editor):
+    """
+    Reused upload tokens could create several blobs for the same object, their
+    attachments are moved to the first one.
+    """
+    Blob = apps.get_model('buggy', 'Blob')
+    AddAttachment = apps.get_model('buggy', 'AddAttachment')
+    duplicates = Blob.objects.values('file').annotate(
+        count=models.Count('pk'),
+    ).filter(count__gt=1).values_list('file', flat=True)
+    for name in duplicates:
+        first, *others = Blob.objects.filter(file=name).order_by('pk')
+        AddAttachment.objects.filter(blob__in=others).update(blob=first)
+        first.ref_count = AddAttachment.objects.filter(blob=first).count()
+        first.save(update_fields=['ref_count'])
+        Blob.objects.filter(pk__in=[blob.pk for blob in others]).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('buggy', '0017_blob_sha256_nullable'),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicate_files, migrations.RunPython.noop),
+    ]
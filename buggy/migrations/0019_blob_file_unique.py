@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import buggy.models
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('buggy', '0018_merge_duplicate_blob_files'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='blob',
+            name='file',
+            field=models.FileField(max_length=255, unique=True, upload_to=buggy.models.blob_upload_to),
+        ),
+    ]
@@ -0,0 +1,24 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('buggy', '0019_blob_file_unique'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='blob',
+            name='attempts',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='blob',
+            name='last_error',
+            field=models.TextField(blank=True),
+        ),
+    ]
@@ -1,11 +1,21 @@
+import collections
+import hashlib
 import itertools
 import os.path
 import uuid
 
-from django.db import models, transaction
+from django.db import models, transaction, connections, router, IntegrityError
+from django.db.models import OuterRef, Subquery
+from django.db.models.functions import Coalesce
+from django.db.models.signals import post_save, post_delete
 from django.conf import settings
-from django.contrib.postgres.fields import CICharField
+from django.dispatch import receiver
+from django.contrib.auth import get_user_model
+from django.contrib.postgres.fields import ArrayField, CICharField, JSONField
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import SearchVectorField, SearchVector
 from django.utils import timezone
+from django.utils.functional import cached_property
 from django import urls
 from django.utils.text import get_text_list
 from django.utils.translation import ungettext
@@ -28,6 +38,21 @@ class Project(models.Model):
         return self.name
 
 
+# (Bug field, operation relation, operation field) for the fields whose past
+# values can be looked up with BugQuerySet.as_of.
+AS_OF_FIELDS = [
+    ('title', 'settitle', 'title'),
+    ('state', 'setstate', 'state'),
+    ('priority', 'setpriority', 'priority'),
+    ('assigned_to', 'setassignment', 'assigned_to'),
+    ('project', 'setproject', 'project'),
+]
+
+# The text search configuration of Bug.search_vector, which queries against it
+# have to use too.
+SEARCH_CONFIG = 'english'
+
+
 class BugQuerySet(models.QuerySet):
     def get_by_number(self, number):
         if verhoeff.validate_verhoeff(number):
@@ -35,6 +60,151 @@ class BugQuerySet(models.QuerySet):
         else:
             raise Bug.DoesNotExist("Bug number checksum doesn't match.")
 
+    def get_by_numbers(self, numbers):
+        """
+        Looks up several bug numbers with one query. Returns a dict mapping the
+        numbers that were found to their bug.
+        """
+        numbers_by_pk = {}
+        for number in numbers:
+            if len(number) > 1 and verhoeff.validate_verhoeff(number):
+                numbers_by_pk.setdefault(int(number[:-1]), []).append(number)
+        bugs = self.in_bulk(list(numbers_by_pk))
+        return {
+            number: bugs[pk]
+            for pk, numbers in numbers_by_pk.items() if pk in bugs
+            for number in numbers
+        }
+
+    def as_of(self, when):
+        """
+        Leaves out the bugs created after `when`, and annotates the rest with
+        `as_of_<attname>` for each of AS_OF_FIELDS, the value it had at `when`.
+
+        Values are taken from the latest complete snapshot before `when`, and
+        the actions since then, so only those actions have to be read.
+        """
+        snapshot = Snapshot.objects.filter(
+            is_complete=True,
+            taken_at__lte=when,
+        ).order_by('-taken_at').first()
+        actions = Action.objects.filter(bug=OuterRef('pk'), created_at__lte=when)
+        if snapshot is not None:
+            actions = actions.filter(created_at__gt=snapshot.taken_at)
+
+        annotations = {}
+        for name, relation, column in AS_OF_FIELDS:
+            field = Bug._meta.get_field(name)
+            if field.is_relation:
+                # The annotation is the id, not the related object.
+                field = models.IntegerField()
+            value = Subquery(
+                actions.filter(**{relation + '__isnull': False}).order_by('-order').values(
+                    '{}__{}'.format(relation, column),
+                )[:1],
+                output_field=field,
+            )
+            if snapshot is not None:
+                value = Coalesce(
+                    value,
+                    Subquery(
+                        BugSnapshot.objects.filter(
+                            snapshot=snapshot,
+                            bug=OuterRef('pk'),
+                        ).values(name)[:1],
+                        output_field=field,
+                    ),
+                    output_field=field,
+                )
+            annotations['as_of_' + Bug._meta.get_field(name).attname] = value
+        return self.filter(created_at__lte=when).annotate(**annotations)
+
+    def update_search_vectors(self):
+        return self.update(
+            search_vector=(
+                SearchVector('title', weight='A', config=SEARCH_CONFIG) +
+                SearchVector('fulltext', weight='B', config=SEARCH_CONFIG)
+            ),
+        )
+
+    def update_projections(self, bugs, appended_text=None, batch_size=1000):
+        """
+        Saves several existing bugs with one `UPDATE ... FROM (VALUES ...)`
+        statement per batch instead of one UPDATE per bug.
+
+        The same statement advances each bug's action counter. Returns a dict
+        mapping bug ids to the action order that was reserved for them.
+
+        fulltext isn't saved from the bugs, so it never has to be loaded.
+        `appended_text` maps bug ids to text that is appended to it in the
+        database instead, and to the B weighted part of the search vector.
+        """
+        appended_text = appended_text or {}
+        bugs = list(bugs)
+        connection = connections[self.db]
+        qn = connection.ops.quote_name
+        meta = self.model._meta
+        counter = meta.get_field('next_action_order')
+        search_vector = meta.get_field('search_vector')
+        fulltext = meta.get_field('fulltext')
+        fields = [
+            field for field in meta.concrete_fields
+            if not field.primary_key and field not in (counter, search_vector, fulltext)
+        ]
+        columns = [meta.pk.column] + [field.column for field in fields] + ['appended_text']
+
+        orders = {}
+        with connection.cursor() as cursor:
+            for i in range(0, len(bugs), batch_size):
+                rows = []
+                params = []
+                for bug in bugs[i:i + batch_size]:
+                    rows.append('({})'.format(', '.join(['%s'] * len(columns))))
+                    params.append(bug.pk)
+                    params.extend(
+                        field.get_db_prep_save(field.pre_save(bug, False), connection)
+                        for field in fields
+                    )
+                    params.append(appended_text.get(bug.pk, ''))
+                # Incrementing the counter in the UPDATE makes concurrent writers
+                # wait on the row lock and then see each other's increment, so
+                # they can't reserve the same order.
+                cursor.execute(
+                    '''
+                        UPDATE {table} SET {assignments},
+                          {fulltext} = {table}.{fulltext} || v.appended_text,
+                          {search_vector} =
+                            setweight(to_tsvector(%s::regconfig, v.{title}), 'A') ||
+                            ts_filter(COALESCE({table}.{search_vector}, ''), '{{b}}') ||
+                            setweight(to_tsvector(%s::regconfig, v.appended_text), 'B'),
+                          {counter} = {table}.{counter} + 1
+                        FROM (VALUES {rows}) AS v ({columns})
+                        WHERE {table}.{pk} = v.{pk}
+                        RETURNING {table}.{pk}, {table}.{counter} - 1
+                    '''.format(
+                        table=qn(meta.db_table),
+                        pk=qn(meta.pk.column),
+                        counter=qn(counter.column),
+                        search_vector=qn(search_vector.column),
+                        title=qn(meta.get_field('title').column),
+                        fulltext=qn(fulltext.column),
+                        assignments=', '.join(
+                            '{column} = CAST(v.{column} AS {type})'.format(
+                                column=qn(field.column),
+                                type=field.db_type(connection),
+                            ) for field in fields
+                        ),
+                        rows=', '.join(rows),
+                        columns=', '.join(qn(column) for column in columns),
+                    ),
+                    [SEARCH_CONFIG, SEARCH_CONFIG] + params,
+                )
+                orders.update(cursor.fetchall())
+
+        for bug in bugs:
+            bug.next_action_order = orders[bug.pk] + 1
+        return orders
+
 
 class Bug(models.Model):
     created_at = models.DateTimeField(default=timezone.now)
@@ -56,25 +226,67 @@ class Bug(models.Model):
         related_name='+'
     )
     fulltext = models.TextField()
+    # The order of the next action on the bug, advanced by Action.commit.
+    next_action_order = models.PositiveIntegerField(default=0, editable=False)
+    # The title weighted above fulltext, kept up to date by Action.commit.
+    search_vector = SearchVectorField(null=True, editable=False)
 
     objects = BugQuerySet.as_manager()
 
+    class Meta:
+        indexes = [
+            GinIndex(fields=['search_vector']),
+        ]
+
     def __str__(self):
         return '#{} - {}'.format(self.number, self.title)
 
     @property
     def number(self):
-        return verhoeff.generate_verhoeff(self.id)
+        # Memoized along with the id it was computed for, the number is used
+        # several times per row of the bug list.
+        if self._number is None or self._number[0] != self.id:
+            self._number = (self.id, verhoeff.generate_verhoeff(self.id))
+        return self._number[1]
+
+    _number = None
+
+    @classmethod
+    def preload_numbers(cls, bugs):
+        """
+        Computes the numbers of `bugs` in one batch.
+        """
+        bugs = [bug for bug in bugs if bug.id is not None]
+        for bug, number in zip(bugs, verhoeff.generate_verhoeff_many(bug.id for bug in bugs)):
+            bug._number = (bug.id, number)
 
     def get_absolute_url(self):
         return urls.reverse('buggy:bug_detail', kwargs={'bug_number': self.number})
 
+    @classmethod
+    def apply_as_of(cls, bugs):
+        """
+        Replaces the current values of `bugs`, from BugQuerySet.as_of, with
+        their past ones so that they can be displayed like any bug.
+        """
+        related = []
+        for name, relation, column in AS_OF_FIELDS:
+            field = cls._meta.get_field(name)
+            for bug in bugs:
+                setattr(bug, field.attname, getattr(bug, 'as_of_' + field.attname))
+                if field.is_relation and hasattr(bug, field.get_cache_name()):
+                    delattr(bug, field.get_cache_name())
+            if field.is_relation:
+                related.append(name)
+        models.prefetch_related_objects(bugs, *related)
+        return bugs
+
     @property
     def actions_preloaded(self):
         return self.actions.select_related(
             'user', 'comment', 'setpriority', 'setassignment__assigned_to',
             'setstate', 'setproject', 'settitle',
-        ).prefetch_related('attachments')
+        ).prefetch_related('attachments__blob')
 
 
 class Action(models.Model):
@@ -82,6 +294,8 @@ class Action(models.Model):
     created_at = models.DateTimeField(default=timezone.now)
     bug = models.ForeignKey(Bug, related_name='actions', on_delete=models.CASCADE)
     order = models.PositiveIntegerField()
+    # The description of the action's operations, stored when it's committed.
+    summary = models.TextField(default='', editable=False)
 
     class Meta:
         unique_together = [
@@ -93,28 +307,45 @@ class Action(models.Model):
         super().__init__(*args, **kwargs)
         self.pending_operations = []
 
+    @classmethod
+    def get_operation_relations(cls):
+        """
+        The names of the one-to-one relations to operations, in model order.
+        Looked up once per class instead of on every access.
+        """
+        if '_operation_relations' not in cls.__dict__:
+            cls._operation_relations = [
+                rel_obj.name
+                for rel_obj in cls._meta.get_fields()
+                if rel_obj.one_to_one and rel_obj.target_field.name == 'action'
+            ]
+        return cls._operation_relations
+
     @property
     def operations(self):
         return itertools.chain(
             self.pending_operations,
             (
-                getattr(self, rel_obj.name)
-                for rel_obj in self._meta.get_fields()
-                if (
-                    rel_obj.one_to_one and
-                    rel_obj.target_field.name == 'action' and
-                    hasattr(self, rel_obj.name)
-                )
+                getattr(self, name)
+                for name in self.get_operation_relations()
+                if hasattr(self, name)
             ),
             self.attachments.all(),
         )
 
-    @property
-    def description(self):
-        descriptions = [i.description for i in self.operations if i.description]
+    @classmethod
+    def describe(cls, operations):
+        relations = cls.get_operation_relations()
+        descriptions = []
+        attachment_count = 0
+        for operation in operations:
+            if isinstance(operation, AddAttachment):
+                attachment_count += 1
+            elif operation.description:
+                descriptions.append((relations.index(operation._meta.model_name), operation.description))
+        descriptions = [description for index, description in sorted(descriptions)]
 
         # we want to group the description of all of the attachments together
-        attachment_count = len(self.attachments.all())
         if attachment_count:
             descriptions.append(
                 ungettext(
@@ -126,11 +357,24 @@ class Action(models.Model):
 
         return get_text_list(descriptions, 'and')
 
+    @staticmethod
+    def get_search_text(operations):
+        return ''.join(
+            ' ' + operation.search_text
+            for operation in operations if operation.search_text
+        )
+
+    @property
+    def description(self):
+        # Actions committed before summaries were stored don't have one.
+        return self.summary or self.describe(self.operations)
+
     @classmethod
     @transaction.atomic
     def build_bug(cls, user, title, project, priority, state):
         bug = Bug(
             created_by=user,
+            next_action_order=1,
         )
         action = cls(
             bug=bug,
@@ -145,12 +389,10 @@ class Action(models.Model):
 
     @classmethod
     def build(cls, user, bug):
+        # The order is reserved from the bug's counter when committing.
         return cls(
             user=user,
             bug=bug,
-            # Actions are prefetched by the detail view, so doing this in
-            # python instead of the database saves a query.
-            order=max(action.order for action in bug.actions.all()) + 1,
         )
 
     def set_title(self, title):
@@ -184,7 +426,34 @@ class Action(models.Model):
         return operation
 
     def add_attachment(self, file):
-        operation = AddAttachment(file=file)
+        operation = AddAttachment(
+            blob=Blob.store(file),
+            filename=os.path.basename(file.name),
+        )
+        self.pending_operations.append(operation)
+        return operation
+
+    def add_uploaded_attachment(self, upload):
+        """
+        Attaches a file the browser uploaded straight to storage, see
+        buggy.uploads. Its blob gets its hash from generate_thumbnails.
+
+        The same upload can be submitted again, with a double submit for
+        example, and then gets the blob it already has.
+        """
+        blob, created = Blob.objects.get_or_create(
+            file=upload.name,
+            defaults={'size': upload.size},
+        )
+        if not created:
+            # It may have been deduplicated already, and left unused for
+            # collect_blobs: it's processed again to move its new
+            # attachments too.
+            Blob.objects.filter(pk=blob.pk, sha256__isnull=True).update(
+                processed_at=None,
+                last_used_at=timezone.now(),
+            )
+        operation = AddAttachment(blob=blob, filename=upload.filename)
         self.pending_operations.append(operation)
         return operation
 
@@ -194,19 +463,99 @@ class Action(models.Model):
         # This is reset early because post_save signals on the action could get
         # duplicate operations otherwise.
         self.pending_operations = []
+        self.summary = self.describe(pending_operations)
+        search_text = self.get_search_text(pending_operations)
 
         for operation in pending_operations:
             operation.action = self
             operation.apply()
 
-        self.bug.save()
-        self.bug = self.bug
+        if self.bug.pk is None:
+            # A bug is created by its first action.
+            self.bug.created_at = self.created_at
+            self.bug.fulltext += search_text
+            self.bug.save()
+            self.bug = self.bug
+            Bug.objects.filter(pk=self.bug.pk).update_search_vectors()
+        else:
+            self.order = Bug.objects.update_projections(
+                [self.bug],
+                {self.bug.pk: search_text},
+            )[self.bug.pk]
         self.save()
 
         for operation in pending_operations:
             operation.action = self
             setattr(self, operation._meta.model_name, operation)
             operation.save(force_insert=True)
+        Blob.add_references(
+            operation.blob_id for operation in pending_operations
+            if isinstance(operation, AddAttachment)
+        )
+
+        from .notifications import enqueue_notifications
+        enqueue_notifications([(self, pending_operations)])
+        from .autocomplete import operations_committed
+        operations_committed(pending_operations)
+        Comment.rerender_linking([(self, pending_operations)])
+
+    @classmethod
+    @transaction.atomic
+    def commit_many(cls, actions):
+        """
+        Commits several actions on existing bugs with set-based queries: one
+        UPDATE for the bug projections, then one INSERT for the actions and one
+        for each kind of operation. A bug can only appear once.
+        """
+        actions = list(actions)
+        if len({action.bug.pk for action in actions}) != len(actions):
+            raise ValueError("Can't commit more than one action per bug at once.")
+
+        pending = []
+        search_text = {}
+        for action in actions:
+            pending_operations = action.pending_operations
+            action.pending_operations = []
+            action.summary = action.describe(pending_operations)
+            search_text[action.bug.pk] = action.get_search_text(pending_operations)
+            for operation in pending_operations:
+                operation.action = action
+                operation.apply()
+            pending.append(pending_operations)
+
+        orders = Bug.objects.update_projections((action.bug for action in actions), search_text)
+        for action in actions:
+            action.order = orders[action.bug.pk]
+        cls.objects.bulk_create(actions)
+
+        operations_by_model = {}
+        for action, pending_operations in zip(actions, pending):
+            for operation in pending_operations:
+                # Assigned again now that the action has a primary key.
+                operation.action = action
+                setattr(action, operation._meta.model_name, operation)
+                operations_by_model.setdefault(type(operation), []).append(operation)
+        for model, operations in operations_by_model.items():
+            model.objects.bulk_create(operations)
+        Blob.add_references(
+            operation.blob_id for operation in operations_by_model.get(AddAttachment, [])
+        )
+
+        from .notifications import enqueue_notifications
+        enqueue_notifications(zip(actions, pending))
+        from .autocomplete import operations_committed
+        operations_committed(itertools.chain.from_iterable(pending))
+        Comment.rerender_linking(zip(actions, pending))
+
+        # bulk_create doesn't send post_save, so it's sent here for receivers
+        # that expect one for every action.
+        using = router.db_for_write(cls)
+        for action in actions:
+            post_save.send(
+                sender=cls, instance=action, created=True,
+                update_fields=None, raw=False, using=using,
+            )
+        return actions
 
 
 class Operation(models.Model):
@@ -220,13 +569,36 @@ class Operation(models.Model):
     def description(self):
         return None
 
+    @property
+    def search_text(self):
+        """
+        Text that this operation adds to the bug's fulltext.
+        """
+        return None
+
 
 class Comment(Operation):
     action = models.OneToOneField(Action, primary_key=True, on_delete=models.CASCADE)
     comment = models.TextField()
 
+    # The output of compile(), stored when the comment is committed. It's only
+    # used if it was produced by the current version of the renderer.
+    rendered_html = models.TextField(default='', editable=False)
+    mentioned_user_ids = ArrayField(models.IntegerField(), default=list, editable=False)
+    mentioned_bug_ids = ArrayField(models.IntegerField(), default=list, editable=False)
+    renderer_version = models.CharField(max_length=100, default='', editable=False)
+
+    class Meta:
+        indexes = [
+            GinIndex(fields=['mentioned_bug_ids']),
+        ]
+
     def apply(self):
-        self.action.bug.fulltext += ' ' + self.comment
+        self.render()
+
+    @property
+    def search_text(self):
+        return self.comment
 
     def compile(self):
         from .markdown import BuggyExtension, safe_markdown
@@ -237,17 +609,62 @@ class Comment(Operation):
         ])
         return (html, extension.mentioned_users, extension.mentioned_bugs)
 
+    def render(self):
+        from .markdown import RENDERER_VERSION
+        html, mentioned_users, mentioned_bugs = self.compile()
+        self.rendered_html = html
+        self.mentioned_user_ids = sorted(user.pk for user in mentioned_users)
+        self.mentioned_bug_ids = sorted(bug.pk for bug in mentioned_bugs)
+        self.renderer_version = RENDERER_VERSION
+
+    @classmethod
+    def rerender_linking(cls, actions):
+        """
+        Renders again the comments that link to bugs whose title or project
+        `actions`, pairs of an action and its operations, changed. The links
+        show them.
+        """
+        bug_ids = {
+            action.bug_id
+            for action, operations in actions
+            if any(isinstance(operation, (SetTitle, SetProject)) for operation in operations)
+        }
+        if not bug_ids:
+            return
+        for comment in cls.objects.filter(
+            mentioned_bug_ids__overlap=sorted(bug_ids),
+        ).order_by('pk').select_for_update():
+            comment.render()
+            comment.save(update_fields=[
+                'rendered_html', 'mentioned_user_ids', 'mentioned_bug_ids', 'renderer_version',
+            ])
+
+    @property
+    def is_rendered(self):
+        from .markdown import RENDERER_VERSION
+        return self.renderer_version == RENDERER_VERSION
+
+    @cached_property
+    def compiled(self):
+        return self.compile()
+
     @property
     def html(self):
-        return self.compile()[0]
+        if self.is_rendered:
+            return self.rendered_html
+        return self.compiled[0]
 
     @property
     def mentioned_users(self):
-        return self.compile()[1]
+        if self.is_rendered:
+            return set(get_user_model().objects.filter(pk__in=self.mentioned_user_ids))
+        return self.compiled[1]
 
     @property
     def mentioned_bugs(self):
-        return self.compile()[2]
+        if self.is_rendered:
+            return set(Bug.objects.filter(pk__in=self.mentioned_bug_ids))
+        return self.compiled[2]
 
     @property
     def description(self):
@@ -260,17 +677,6 @@ class SetTitle(Operation):
 
     def apply(self):
         self.action.bug.title = self.title
-        self.action.bug.fulltext += ' ' + self.title
-
-    @property
-    def previous_title(self):
-        title = self.action.bug.title
-        for action in self.action.bug.actions.all():
-            if action == self.action:
-                break
-            if hasattr(action, 'settitle'):
-                title = action.settitle.title
-        return title
 
     @property
     def description(self):
@@ -322,24 +728,300 @@ class SetProject(Operation):
 
 
 def attachment_upload_to(instance, filename):
+    # Attachments are stored in blobs now, this is only referenced by old
+    # migrations.
     return 'attachments/{}/{}/{}'.format(instance.action.bug.number, uuid.uuid4(), filename)
 
 
+def blob_upload_to(instance, filename):
+    # The extension is kept so that the web server can guess the content type.
+    return 'blobs/{}/{}/{}{}'.format(
+        instance.sha256[:2],
+        instance.sha256[2:4],
+        instance.sha256,
+        os.path.splitext(filename)[1].lower(),
+    )
+
+
+class Blob(models.Model):
+    """
+    An uploaded file, stored once however many attachments have the same
+    content.
+
+    ref_count is the number of attachments that use the blob. Blobs nobody
+    uses anymore are deleted by the collect_blobs command once they've been
+    unused for a while, which leaves time for an upload to be committed.
+    """
+    # Null until generate_thumbnails hashes the files uploaded straight to
+    # storage.
+    sha256 = models.CharField(max_length=64, unique=True, null=True)
+    # Unique so that an object uploaded straight to storage only ever has one
+    # blob, whose file collect_blobs can delete.
+    file = models.FileField(upload_to=blob_upload_to, max_length=255, unique=True)
+    size = models.BigIntegerField()
+    ref_count = models.PositiveIntegerField(default=0)
+    last_used_at = models.DateTimeField(default=timezone.now, db_index=True)
+
+    # Filled in by the generate_thumbnails command, the dimensions and
+    # thumbnail stay empty for files that aren't images.
+    processed_at = models.DateTimeField(null=True, db_index=True)
+    width = models.PositiveIntegerField(null=True)
+    height = models.PositiveIntegerField(null=True)
+    thumbnail = models.FileField(blank=True, max_length=255)
+    thumbnail_width = models.PositiveIntegerField(null=True)
+    thumbnail_height = models.PositiveIntegerField(null=True)
+    # Failed attempts at processing the blob, which is given up on and left
+    # without a thumbnail after BUGGY_THUMBNAIL_MAX_ATTEMPTS.
+    attempts = models.PositiveIntegerField(default=0)
+    last_error = models.TextField(blank=True)
+
+    def __str__(self):
+        return self.sha256 or self.file.name
+
+    @classmethod
+    def store(cls, file):
+        """
+        Returns the blob with the content of `file`, saving it first if it's
+        new. The file is hashed as it's read, in chunks.
+        """
+        digest = hashlib.sha256()
+        size = 0
+        for chunk in file.chunks():
+            digest.update(chunk)
+            size += len(chunk)
+        sha256 = digest.hexdigest()
+
+        # Pushes back the collection of a blob that's about to be used again.
+        if cls.objects.filter(sha256=sha256).update(last_used_at=timezone.now()):
+            return cls.objects.get(sha256=sha256)
+
+        blob = cls(sha256=sha256, size=size)
+        file.seek(0)
+        blob.file.save(file.name, file, save=False)
+        try:
+            with transaction.atomic():
+                blob.save(force_insert=True)
+        except IntegrityError:
+            # The same content was uploaded concurrently, and the other copy
+            # won.
+            existing = cls.objects.get(sha256=sha256)
+            if blob.file.name != existing.file.name:
+                blob.file.delete(save=False)
+            return existing
+        return blob
+
+    @classmethod
+    def add_references(cls, blob_ids, delta=1):
+        """
+        Adds `delta` references to the blobs in `blob_ids`, once for each time
+        a blob appears.
+        """
+        by_count = {}
+        for blob_id, count in collections.Counter(blob_ids).items():
+            by_count.setdefault(count * delta, []).append(blob_id)
+        for change, ids in by_count.items():
+            cls.objects.filter(pk__in=ids).update(
+                ref_count=models.F('ref_count') + change,
+                last_used_at=timezone.now(),
+            )
+
+
 class AddAttachment(Operation):
     action = models.ForeignKey(Action, on_delete=models.CASCADE, related_name='attachments')
-    file = models.FileField(upload_to=attachment_upload_to, max_length=255)
+    blob = models.ForeignKey(Blob, related_name='attachments', on_delete=models.PROTECT)
+    filename = models.CharField(max_length=255)
+
+    @property
+    def file(self):
+        return self.blob.file
+
+    def get_absolute_url(self):
+        return urls.reverse('buggy:attachment', kwargs={'pk': self.pk, 'filename': self.filename})
+
+    def get_thumbnail_url(self):
+        return urls.reverse('buggy:attachment_thumbnail', kwargs={'pk': self.pk})
 
     @property
     def basename(self):
-        return os.path.basename(self.file.name)
+        return self.filename
 
     @property
     def extension(self):
-        return os.path.splitext(self.file.name)[1]
+        return os.path.splitext(self.filename)[1]
 
     @property
     def is_image(self):
-        return self.extension in {'.png', '.jpg', '.gif'}
+        return self.blob.width is not None
+
+
+@receiver(post_delete, sender=AddAttachment)
+def release_blob(sender, instance, **kwargs):
+    Blob.add_references([instance.blob_id], -1)
+
+
+@receiver(post_save, sender=settings.AUTH_USER_MODEL)
+def user_saved(sender, instance, update_fields=None, **kwargs):
+    # Logging in only saves last_login, which autocomplete doesn't show.
+    if update_fields is None or {'name', 'is_active'} & set(update_fields):
+        from .autocomplete import invalidate
+        invalidate()
+
+
+class Notification(models.Model):
+    """
+    An email about an action, in the outbox until the send_notifications
+    command delivers it.
+    """
+    ASSIGNED = 'assigned'
+    MENTIONED = 'mentioned'
+    KIND_CHOICES = [
+        (ASSIGNED, 'assigned'),
+        (MENTIONED, 'mentioned'),
+    ]
+
+    action = models.ForeignKey(Action, related_name='notifications', on_delete=models.CASCADE)
+    kind = models.CharField(max_length=20, choices=KIND_CHOICES)
+    recipient = models.ForeignKey(settings.AUTH_USER_MODEL, related_name='+', on_delete=models.CASCADE)
+    created_at = models.DateTimeField(default=timezone.now)
+    # None once delivery has been given up on.
+    next_attempt_at = models.DateTimeField(default=timezone.now, null=True)
+    attempts = models.PositiveIntegerField(default=0)
+    last_error = models.TextField(blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['next_attempt_at']),
+        ]
+
+    def __str__(self):
+        return '{} notification for {}'.format(self.kind, self.recipient)
+
+
+class ProcessedCommit(models.Model):
+    """
+    Records that the git webhook already handled a commit for a bug, so that
+    pushing the same commit again doesn't comment again.
+    """
+    commit_id = models.CharField(max_length=64)
+    bug = models.ForeignKey(Bug, related_name='+', on_delete=models.CASCADE)
+    created_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        unique_together = [
+            ('commit_id', 'bug'),
+        ]
+
+    def __str__(self):
+        return '{} on #{}'.format(self.commit_id, self.bug.number)
+
+
+class WebhookDelivery(models.Model):
+    """
+    A push received by the git webhook, waiting for the process_webhooks
+    command to apply it.
+    """
+    payload = JSONField()
+    received_at = models.DateTimeField(default=timezone.now)
+    # None once processing has been given up on.
+    next_attempt_at = models.DateTimeField(default=timezone.now, null=True)
+    attempts = models.PositiveIntegerField(default=0)
+    last_error = models.TextField(blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['next_attempt_at']),
+        ]
+
+    def __str__(self):
+        return 'Push received at {}'.format(self.received_at)
+
+
+class Snapshot(models.Model):
+    """
+    The values of AS_OF_FIELDS for every bug at `taken_at`, which
+    BugQuerySet.as_of starts from instead of the beginning of the log.
+    """
+    taken_at = models.DateTimeField(unique=True)
+    # Snapshots are filled in batches, they're only used once all are done.
+    is_complete = models.BooleanField(default=False)
+
+    def __str__(self):
+        return 'Snapshot at {}'.format(self.taken_at)
+
+    def fill(self, bugs):
+        """
+        Adds the snapshot rows of `bugs` (a Bug queryset), derived from the
+        previous complete snapshot. Returns the number of rows added.
+        """
+        connection = connections[router.db_for_write(BugSnapshot)]
+        qn = connection.ops.quote_name
+        fields = [BugSnapshot._meta.get_field(name) for name, relation, column in AS_OF_FIELDS]
+        values = bugs.as_of(self.taken_at).values(
+            'pk', *['as_of_' + field.attname for field in fields]
+        )
+        sql, params = values.query.sql_with_params()
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'INSERT INTO {table} (snapshot_id, bug_id, {columns}) SELECT %s, q.* FROM ({sql}) q'.format(
+                    table=qn(BugSnapshot._meta.db_table),
+                    columns=', '.join(qn(field.column) for field in fields),
+                    sql=sql,
+                ),
+                (self.pk,) + params,
+            )
+            return cursor.rowcount
+
+
+class BugSnapshot(models.Model):
+    snapshot = models.ForeignKey(Snapshot, related_name='bugs', on_delete=models.CASCADE)
+    bug = models.ForeignKey(Bug, related_name='+', on_delete=models.CASCADE)
+
+    title = models.CharField(max_length=100)
+    state = EnumField(State, max_length=25)
+    priority = EnumIntegerField(Priority)
+    project = models.ForeignKey(Project, on_delete=models.PROTECT, related_name='+')
+    assigned_to = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.PROTECT,
+        related_name='+',
+        null=True,
+    )
+
+    class Meta:
+        unique_together = [
+            ('snapshot', 'bug'),
+        ]
+
+
+class Counter(models.Model):
+    """
+    A number bumped in the same transaction as the changes it counts, so that
+    it can stand for them as a version, see buggy.autocomplete.
+    """
+    name = models.CharField(max_length=50, primary_key=True)
+    value = models.BigIntegerField(default=0)
+
+    def __str__(self):
+        return '{}: {}'.format(self.name, self.value)
+
+    @classmethod
+    def get(cls, name):
+        return cls.objects.filter(name=name).values_list('value', flat=True).first() or 0
+
+    @classmethod
+    def bump(cls, name):
+        """
+        Increments the counter `name`. Its row stays locked until the
+        transaction is done.
+        """
+        with connections[router.db_for_write(cls)].cursor() as cursor:
+            cursor.execute(
+                '''
+                    INSERT INTO {table} (name, value) VALUES (%s, 1)
+                    ON CONFLICT (name) DO UPDATE SET value = {table}.value + 1
+                '''.format(table=cls._meta.db_table),
+                [name],
+            )
 
 
 class PresetFilter(models.Model):
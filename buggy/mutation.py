@@ -1,12 +1,26 @@
 from django.core.exceptions import ValidationError
 from django import forms
+from django.conf import settings
+from django.db import transaction
+from django.db.models import prefetch_related_objects
 from django.utils.functional import cached_property, lazy
 
 from .forms import CreateForm, EditForm, BulkActionForm
-from .models import Action
+from .models import Action, Bug
 from .enums import State
 
 
+class BulkActionIncomplete(ValidationError):
+    """
+    A chunk of a bulk action failed after the previous ones were committed.
+    `actions` are the actions that were committed, out of `total` bugs.
+    """
+    def __init__(self, error, actions, total):
+        super().__init__(error.error_list)
+        self.actions = actions
+        self.total = total
+
+
 class BugMutator(object):
     def __init__(self, user, bug):
         self.bug = bug
@@ -15,6 +29,28 @@ class BugMutator(object):
     def get_actions(self):
         raise NotImplementedError
 
+    @classmethod
+    def get_state_actions(cls, state):
+        raise NotImplementedError
+
+    @classmethod
+    def get_transition_table(cls):
+        """
+        Maps every state to the set of action ids allowed from it.
+
+        Which actions are allowed only depends on the state of the bug, so the
+        table is compiled once per mutator class and checking thousands of bugs
+        is a dictionary lookup per state.
+        """
+        if '_transition_table' not in cls.__dict__:
+            cls._transition_table = {
+                state: frozenset(
+                    action for action, label in cls.action_choices(cls.get_state_actions(state))
+                )
+                for state in State
+            }
+        return cls._transition_table
+
     def get_form_class(self):
         raise NotImplementedError
 
@@ -29,6 +65,11 @@ class BugMutator(object):
     def process_action(self, data):
         raise NotImplementedError
 
+    @classmethod
+    @transaction.atomic
+    def process_bulk_action(cls, user, bugs, data):
+        return [cls(user, bug).process_action(data) for bug in bugs]
+
     @classmethod
     def action_choices(cls, actions):
         for action in actions:
@@ -125,6 +166,12 @@ class BuggyBugMutator(BugMutator):
         'help_text': "You would like to make someone responsible for the bug.",
     }
 
+    CREATE = {
+        'action': 'create',
+        'label': 'Create',
+        'help_text': "Create a bug.",
+    }
+
     RESOLVED_STATES = {
         State.RESOLVED_FIXED,
         State.RESOLVED_UNREPRODUCIBLE,
@@ -168,30 +215,38 @@ class BuggyBugMutator(BugMutator):
         verified['help_text'] = lazy(
             lambda: self.VERIFIED['help_text'] + self.resolver_assign_text()
         )
+        with_assign_text = {
+            action['action']: action for action in [resolved, reopened, verified]
+        }
 
         if self.bug:
             state = self.bug.state
         else:
             state = None
 
+        return [
+            with_assign_text.get(action['action'], action)
+            for action in self.get_state_actions(state)
+        ]
+
+    @classmethod
+    def get_state_actions(cls, state):
         if state == State.NEW:
-            return [self.COMMENT, resolved, self.ENTRUSTED]
+            return [cls.COMMENT, cls.RESOLVED, cls.ENTRUSTED]
         elif state == State.ENTRUSTED:
-            return [self.COMMENT, resolved]
-        elif state in self.RESOLVED_STATES:
-            return [self.COMMENT, verified, reopened, self.LIVE, self.CLOSED]
+            return [cls.COMMENT, cls.RESOLVED]
+        elif state in cls.RESOLVED_STATES:
+            return [cls.COMMENT, cls.VERIFIED, cls.REOPENED, cls.LIVE, cls.CLOSED]
         elif state == State.REOPENED:
-            return [self.COMMENT, resolved, self.ENTRUSTED]
+            return [cls.COMMENT, cls.RESOLVED, cls.ENTRUSTED]
         elif state == State.LIVE:
-            return [self.COMMENT, reopened, self.CLOSED]
+            return [cls.COMMENT, cls.REOPENED, cls.CLOSED]
         elif state == State.CLOSED:
-            return [self.COMMENT, reopened]
+            return [cls.COMMENT, cls.REOPENED]
         elif state == State.VERIFIED:
-            return [self.COMMENT, reopened, self.LIVE, self.CLOSED]
+            return [cls.COMMENT, cls.REOPENED, cls.LIVE, cls.CLOSED]
         elif state is None:
-            return [
-                {'action': 'create', 'label': 'Create', 'help_text': "Create a bug."},
-            ]
+            return [cls.CREATE]
         else:
             assert False, 'Unknown state %s' % state
 
@@ -219,10 +274,75 @@ class BuggyBugMutator(BugMutator):
             return ''
 
     def process_action(self, data):
+        self.validate_action(data)
+        action = self.build_action(data)
+        action.commit()
+        return action
+
+    @classmethod
+    def process_bulk_action(cls, user, bugs, data, chunk_size=None):
+        """
+        Performs the same action on many bugs.
+
+        The bugs are locked and committed in chunks of `chunk_size` (the
+        BUGGY_BULK_ACTION_CHUNK_SIZE setting by default), each in its own
+        transaction, so that a large bulk action doesn't hold locks on every bug
+        until it's done. The action is validated and built for all of the bugs
+        before the first chunk is committed, so it isn't left half done because
+        of a bug it wouldn't change.
+
+        Each chunk is validated again once its bugs are locked, since they can
+        change in the meantime. If a chunk fails then, BulkActionIncomplete is
+        raised with the actions of the chunks that were committed.
+        """
+        if chunk_size is None:
+            chunk_size = getattr(settings, 'BUGGY_BULK_ACTION_CHUNK_SIZE', 200)
+
+        bugs = list(bugs)
+        for mutator in cls.get_bulk_mutators(user, bugs):
+            mutator.validate_action(data)
+            mutator.build_action(data)
+
+        actions = []
+        for i in range(0, len(bugs), chunk_size):
+            try:
+                with transaction.atomic():
+                    actions.extend(cls.process_bulk_chunk(
+                        user, [bug.pk for bug in bugs[i:i + chunk_size]], data,
+                    ))
+            except ValidationError as e:
+                if not actions:
+                    raise
+                raise BulkActionIncomplete(e, actions, len(bugs))
+        return actions
+
+    @classmethod
+    def get_bulk_mutators(cls, user, bugs):
+        prefetch_related_objects(bugs, 'created_by', 'assigned_to')
+        resolvers = cls.get_latest_resolvers([bug.pk for bug in bugs])
+        for bug in bugs:
+            mutator = cls(user, bug)
+            mutator.latest_resolver = resolvers.get(bug.pk)
+            yield mutator
+
+    @classmethod
+    def process_bulk_chunk(cls, user, bug_ids, data):
+        # Locked without select_related, Postgres can't lock the nullable side
+        # of an outer join.
+        bugs = list(Bug.objects.select_for_update().filter(
+            pk__in=bug_ids,
+        ).order_by('pk').defer('fulltext', 'search_vector'))
+        actions = []
+        for mutator in cls.get_bulk_mutators(user, bugs):
+            mutator.validate_action(data)
+            actions.append(mutator.build_action(data))
+        return Action.commit_many(actions)
+
+    def validate_action(self, data):
         errors = []
 
         if data['action'] == State.ENTRUSTED.value \
-                and not (self.bug.assigned_to or data['assign_to']):
+                and not (self.bug.assigned_to_id or data['assign_to']):
             errors.append('You must assign the bug to entrust it.')
 
         if data['action'] == State.REOPENED.value and not data['comment']:
@@ -231,11 +351,10 @@ class BuggyBugMutator(BugMutator):
         if errors:
             raise ValidationError(errors)
 
+    def build_action(self, data):
         action = self.perform_mutations(data)
         if not any(action.operations):
             raise ValidationError('Do something at least')
-        else:
-            action.commit()
         return action
 
     def perform_mutations(self, data):
@@ -278,9 +397,23 @@ class BuggyBugMutator(BugMutator):
 
         for attachment in data.get('attachments', []):
             action.add_attachment(attachment)
+        for upload in data.get('uploads', []):
+            action.add_uploaded_attachment(upload)
 
         return action
 
+    @classmethod
+    def get_latest_resolvers(cls, bug_ids):
+        """
+        Maps bug ids to the user who last resolved them, like latest_resolver
+        does for one bug.
+        """
+        actions = Action.objects.filter(
+            bug__in=bug_ids,
+            setstate__state__in=cls.RESOLVED_STATES,
+        ).order_by('bug', '-order').distinct('bug').select_related('user')
+        return {action.bug_id: action.user for action in actions}
+
     @cached_property
     def latest_resolver(self):
         for action in reversed(self.bug.actions.select_related('setstate', 'user')):
@@ -1,23 +1,186 @@
+import datetime
+import logging
+
 import ogmios
 
+from django.conf import settings
+from django.core.mail import get_connection
+from django.db import transaction
+from django.db.models import prefetch_related_objects
+from django.utils import timezone
+
+from .models import Action, Notification, Comment, SetAssignment
+from .timeline import annotate_previous_titles
+from .utils import get_backoff
+
+logger = logging.getLogger(__name__)
+
+TEMPLATES = {
+    Notification.ASSIGNED: 'buggy/mail/bug_assigned.md',
+    Notification.MENTIONED: 'buggy/mail/bug_mention.md',
+}
+DIGEST_TEMPLATE = 'buggy/mail/digest.md'
+
+
+def get_digest_window():
+    """
+    How long notifications wait to be sent together with the ones that follow
+    them for the same user, or None to send each one as soon as possible.
+    """
+    seconds = getattr(settings, 'BUGGY_NOTIFICATION_DIGEST_WINDOW', None)
+    return datetime.timedelta(seconds=seconds) if seconds else None
 
-def send_notifications(action):
+
+def get_recipients(action, operations):
+    """
+    Yields (kind, user id) for each notification `action` triggers, given the
+    operations it was committed with.
+    """
     # Prevents notification users of their on actions and notifying about the
     # same action twice.
-    blacklist = {action.user}
-
-    if hasattr(action, 'setassignment') and action.setassignment.assigned_to not in blacklist:
-        blacklist.add(action.setassignment.assigned_to)
-        ogmios.send_email('buggy/mail/bug_assigned.md', {
-            'bug': action.bug,
-            'action': action,
-            'assigned_to': action.setassignment.assigned_to,
-        })
-
-    if hasattr(action, 'comment'):
-        for mention in action.comment.mentioned_users - blacklist:
-            ogmios.send_email('buggy/mail/bug_mention.md', {
-                'bug': action.bug,
-                'action': action,
-                'to': mention,
-            })
+    blacklist = {action.user_id}
+
+    for operation in operations:
+        if isinstance(operation, SetAssignment) and operation.assigned_to_id not in blacklist:
+            blacklist.add(operation.assigned_to_id)
+            yield Notification.ASSIGNED, operation.assigned_to_id
+
+    for operation in operations:
+        if isinstance(operation, Comment):
+            for user_id in operation.mentioned_user_ids:
+                if user_id not in blacklist:
+                    blacklist.add(user_id)
+                    yield Notification.MENTIONED, user_id
+
+
+def enqueue_notifications(actions):
+    """
+    Adds the notifications for `actions`, pairs of an action and the
+    operations it was committed with, to the outbox. This is called in the
+    transaction that commits them, so that they're saved or lost together.
+    """
+    next_attempt_at = timezone.now()
+    if get_digest_window():
+        next_attempt_at += get_digest_window()
+    Notification.objects.bulk_create(
+        Notification(
+            action=action,
+            kind=kind,
+            recipient_id=recipient_id,
+            next_attempt_at=next_attempt_at,
+        )
+        for action, operations in actions
+        for kind, recipient_id in get_recipients(action, operations)
+    )
+
+
+def build_message(notifications):
+    """
+    The email for `notifications`, which all have the same recipient. Several
+    notifications are sent as one digest.
+    """
+    recipient = notifications[0].recipient
+    if len(notifications) > 1:
+        return ogmios.EmailSender(DIGEST_TEMPLATE, {
+            'to': recipient,
+            'notifications': notifications,
+        }).build_message()
+
+    action = notifications[0].action
+    context = {
+        'bug': action.bug,
+        'action': action,
+    }
+    if notifications[0].kind == Notification.ASSIGNED:
+        context['assigned_to'] = recipient
+    else:
+        context['to'] = recipient
+    return ogmios.EmailSender(TEMPLATES[notifications[0].kind], context).build_message()
+
+
+def lock_pending_notifications(batch_size):
+    """
+    Locks and returns a batch of the notifications that are due. With digests
+    on, the other pending notifications of their recipients come along too.
+    """
+    pending = Notification.objects.filter(
+        next_attempt_at__isnull=False,
+    ).order_by('next_attempt_at').select_for_update(skip_locked=True)
+    # Only the outbox rows are locked, selecting related rows in the same query
+    # would lock bugs for the time it takes to send the emails.
+    notifications = list(pending.filter(next_attempt_at__lte=timezone.now())[:batch_size])
+    if notifications and get_digest_window():
+        notifications.extend(pending.filter(
+            recipient__in={notification.recipient_id for notification in notifications},
+        ).exclude(
+            pk__in=[notification.pk for notification in notifications],
+        ))
+
+    prefetch_related_objects(notifications, 'recipient')
+    actions = Action.objects.select_related(
+        'user', 'bug__project', 'comment', 'settitle',
+    ).in_bulk({notification.action_id for notification in notifications})
+    annotate_previous_titles(list(actions.values()))
+    for notification in notifications:
+        notification.action = actions[notification.action_id]
+    return notifications
+
+
+def retry_later(notifications, error):
+    max_attempts = getattr(settings, 'BUGGY_NOTIFICATION_MAX_ATTEMPTS', 10)
+    for notification in notifications:
+        notification.attempts += 1
+        notification.last_error = repr(error)
+        if notification.attempts >= max_attempts:
+            notification.next_attempt_at = None
+        else:
+            notification.next_attempt_at = timezone.now() + get_backoff(
+                notification.attempts,
+                getattr(settings, 'BUGGY_NOTIFICATION_RETRY_DELAY', 60),
+            )
+        notification.save(update_fields=['attempts', 'last_error', 'next_attempt_at'])
+
+
+def send_pending_notifications(batch_size=100):
+    """
+    Sends a batch of the notifications that are due, over one mail server
+    connection. Returns the number of notifications sent and failed.
+
+    The batch is locked with SKIP LOCKED so that several workers can run at
+    once, and notifications are only deleted in the transaction that sent them.
+    A worker dying after sending means the email is sent again, never lost.
+    """
+    sent = failed = 0
+    with transaction.atomic():
+        notifications = lock_pending_notifications(batch_size)
+        if not notifications:
+            return sent, failed
+
+        if get_digest_window():
+            by_recipient = {}
+            for notification in notifications:
+                by_recipient.setdefault(notification.recipient_id, []).append(notification)
+            groups = list(by_recipient.values())
+        else:
+            groups = [[notification] for notification in notifications]
+
+        with get_connection() as connection:
+            for group in groups:
+                try:
+                    connection.send_messages([build_message(group)])
+                except Exception as e:
+                    logger.exception('Failed to send notifications %s', [n.pk for n in group])
+                    retry_later(group, e)
+                    failed += len(group)
+                    # Start over with a new connection in case this one broke.
+                    # It's opened here, a connection that send_messages has to
+                    # open is closed again after each message.
+                    connection.close()
+                    try:
+                        connection.open()
+                    except Exception:
+                        logger.exception('Failed to reconnect to the mail server')
+                else:
+                    Notification.objects.filter(pk__in=[n.pk for n in group]).delete()
+                    sent += len(group)
+    return sent, failed
@@ -0,0 +1,123 @@
+import base64
+import binascii
+import datetime
+import json
+
+from django.core.exceptions import FieldDoesNotExist, ValidationError
+from django.db.models import Q
+
+
+class InvalidCursor(Exception):
+    pass
+
+
+class KeysetPaginator(object):
+    """
+    Paginates a queryset by seeking past the last row of the previous page
+    instead of using OFFSET, so every page costs the same as the first one no
+    matter how deep it is.
+
+    Rows are ordered by `order_field` and then by primary key, in the same
+    direction, so the position of a row is always unique. The cursor for the
+    next page is an opaque token encoding the sort value and primary key of the
+    last row of the current page.
+    """
+
+    def __init__(self, queryset, order_field, desc=False, page_size=100):
+        self.queryset = queryset
+        self.order_field = order_field
+        self.desc = desc
+        self.page_size = page_size
+
+    @property
+    def field(self):
+        """
+        The model field (or annotation output field) the queryset is sorted by,
+        used to turn decoded cursor values back into python values.
+        """
+        name, *path = self.order_field.split('__')
+        if name in self.queryset.query.annotations:
+            return self.queryset.query.annotations[name].output_field
+        model = self.queryset.model
+        field = model._meta.get_field(name)
+        for name in path:
+            field = field.related_model._meta.get_field(name)
+        return field
+
+    def get_value(self, obj):
+        value = obj
+        for name in self.order_field.split('__'):
+            value = getattr(value, name)
+            if value is None:
+                break
+        return value
+
+    def get_ordering(self):
+        prefix = '-' if self.desc else ''
+        ordering = [prefix + self.order_field]
+        if self.order_field not in ('pk', 'id'):
+            ordering.append(prefix + 'pk')
+        return ordering
+
+    def encode_cursor(self, obj):
+        value = self.get_value(obj)
+        if isinstance(value, datetime.datetime):
+            value = value.isoformat()
+        elif value is not None:
+            value = self.field.get_prep_value(value)
+        data = json.dumps([value, obj.pk], separators=(',', ':'))
+        return base64.urlsafe_b64encode(data.encode('utf-8')).decode('ascii').rstrip('=')
+
+    def decode_cursor(self, cursor):
+        try:
+            data = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+            value, pk = json.loads(data.decode('utf-8'))
+            if value is not None:
+                value = self.field.to_python(value)
+            pk = self.queryset.model._meta.pk.to_python(pk)
+        except (binascii.Error, UnicodeDecodeError, ValueError, TypeError,
+                ValidationError, FieldDoesNotExist):
+            raise InvalidCursor(cursor)
+        return value, pk
+
+    def seek(self, queryset, value, pk):
+        """
+        Restricts `queryset` to the rows that sort after (`value`, `pk`).
+
+        PostgreSQL sorts NULLs last in ascending order and first in descending
+        order, so NULL sort values need their own conditions.
+        """
+        field = self.order_field
+        after = 'lt' if self.desc else 'gt'
+        pk_after = Q(**{'pk__' + after: pk})
+        if field in ('pk', 'id'):
+            return queryset.filter(pk_after)
+
+        if value is None:
+            condition = Q(**{field + '__isnull': True}) & pk_after
+            if self.desc:
+                condition |= Q(**{field + '__isnull': False})
+        else:
+            condition = (
+                Q(**{field + '__' + after: value}) |
+                Q(**{field: value}) & pk_after
+            )
+            if not self.desc:
+                condition |= Q(**{field + '__isnull': True})
+        return queryset.filter(condition)
+
+    def get_page(self, cursor=None):
+        """
+        Returns the list of objects on the page after `cursor` and the cursor
+        of the next page, which is None on the last page.
+        """
+        queryset = self.queryset.order_by(*self.get_ordering())
+        if cursor:
+            queryset = self.seek(queryset, *self.decode_cursor(cursor))
+
+        object_list = list(queryset[:self.page_size + 1])
+        if len(object_list) > self.page_size:
+            del object_list[self.page_size:]
+            return object_list, self.encode_cursor(object_list[-1])
+        else:
+            return object_list, None
@@ -0,0 +1,168 @@
+"""
+Re-derives the Bug projection from the action log.
+
+Bug is only a cache of the result of applying a bug's actions in order, this
+computes the same columns in SQL so that it can be checked and repaired without
+going through Python. The timestamps and fulltext are left out: the timestamps
+are taken when the action is saved rather than from the log, and fulltext is
+rebuilt by the rebuild_fulltext command.
+
+Bugs are derived from the action log alone, so that missing rows of the bug
+table are found and inserted again too. Those get their timestamps from their
+first and last actions, and their fulltext from their comments.
+"""
+from django.db import connection, transaction
+
+from . import autocomplete
+from .models import Bug, Action, Comment, SetTitle, SetState, SetPriority, SetAssignment, SetProject
+
+COLUMNS = [
+    'id', 'title', 'state', 'priority', 'assigned_to_id', 'created_by_id',
+    'project_id', 'next_action_order',
+]
+
+
+def latest(model, column):
+    """
+    A lateral subquery for the value of `column` set by the bug's last
+    operation of type `model`.
+    """
+    return '''
+        LEFT JOIN LATERAL (
+          SELECT {operation}.{column}
+          FROM {action}
+          JOIN {operation} ON {operation}.action_id = {action}.id
+          WHERE {action}.bug_id = bug.id
+          ORDER BY {action}."order" DESC
+          LIMIT 1
+        ) {operation} ON true
+    '''.format(
+        operation=model._meta.db_table,
+        action=Action._meta.db_table,
+        column=column,
+    )
+
+
+DERIVED_BUGS_SQL = '''
+    SELECT bug.id,
+      {settitle}.title,
+      {setstate}.state,
+      {setpriority}.priority,
+      {setassignment}.assigned_to_id,
+      (SELECT user_id FROM {action}
+       WHERE {action}.bug_id = bug.id
+       ORDER BY "order" ASC LIMIT 1) AS created_by_id,
+      {setproject}.project_id,
+      (SELECT COALESCE(max("order") + 1, 0) FROM {action}
+       WHERE {action}.bug_id = bug.id) AS next_action_order
+    FROM (
+      SELECT DISTINCT bug_id AS id FROM {action}
+      WHERE bug_id BETWEEN %(first)s AND %(last)s
+    ) bug
+    {joins}
+'''.format(
+    action=Action._meta.db_table,
+    settitle=SetTitle._meta.db_table,
+    setstate=SetState._meta.db_table,
+    setpriority=SetPriority._meta.db_table,
+    setassignment=SetAssignment._meta.db_table,
+    setproject=SetProject._meta.db_table,
+    joins=''.join([
+        latest(SetTitle, 'title'),
+        latest(SetState, 'state'),
+        latest(SetPriority, 'priority'),
+        latest(SetAssignment, 'assigned_to_id'),
+        latest(SetProject, 'project_id'),
+    ]),
+)
+
+DRIFTED_BUGS_SQL = '''
+    {derived}
+    EXCEPT
+    SELECT {columns} FROM {bug}
+    WHERE id BETWEEN %(first)s AND %(last)s
+'''.format(
+    derived=DERIVED_BUGS_SQL,
+    columns=', '.join(COLUMNS),
+    bug=Bug._meta.db_table,
+)
+
+
+def find_drift(first, last):
+    """
+    Returns the ids of the bugs between `first` and `last` whose stored
+    projection doesn't match their action log.
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(
+            'SELECT id FROM ({}) drifted ORDER BY id'.format(DRIFTED_BUGS_SQL),
+            {'first': first, 'last': last},
+        )
+        return [id for id, in cursor.fetchall()]
+
+
+def get_bug_ids(first, last):
+    """
+    The ids of the bugs between `first` and `last` that have actions, whether
+    or not they're in the bug table.
+    """
+    return list(Action.objects.filter(
+        bug__gte=first, bug__lte=last,
+    ).order_by('bug').values_list('bug', flat=True).distinct())
+
+
+@transaction.atomic
+def rebuild(first, last, only_drifted=False):
+    """
+    Rewrites the projection of the bugs between `first` and `last` from their
+    action log, or only of the ones that drifted, inserting the ones that are
+    missing. Returns the rewritten ids.
+    """
+    ids = find_drift(first, last) if only_drifted else get_bug_ids(first, last)
+    if not ids:
+        return []
+    # Once the rows are locked, no action can be committed on them until this
+    # transaction is done, so the log can't change under the upsert.
+    list(Bug.objects.filter(pk__in=ids).select_for_update().order_by('pk').values_list('pk'))
+
+    with connection.cursor() as cursor:
+        cursor.execute(
+            '''
+                INSERT INTO {bug} ({columns}, created_at, modified_at, fulltext)
+                SELECT derived.*,
+                  COALESCE(existing.created_at, times.created_at),
+                  COALESCE(existing.modified_at, times.modified_at),
+                  COALESCE(existing.fulltext, comments.fulltext)
+                FROM ({derived}) derived
+                LEFT JOIN {bug} existing ON existing.id = derived.id
+                -- Only looked up for the bugs that are missing.
+                LEFT JOIN LATERAL (
+                  SELECT min(created_at) AS created_at, max(created_at) AS modified_at
+                  FROM {action}
+                  WHERE {action}.bug_id = derived.id AND existing.id IS NULL
+                ) times ON true
+                LEFT JOIN LATERAL (
+                  SELECT COALESCE(string_agg(' ' || {comment}.comment, '' ORDER BY {action}."order"), '') AS fulltext
+                  FROM {action}
+                  JOIN {comment} ON {comment}.action_id = {action}.id
+                  WHERE {action}.bug_id = derived.id AND existing.id IS NULL
+                ) comments ON true
+                WHERE derived.id = ANY(%(ids)s)
+                ON CONFLICT (id) DO UPDATE SET {assignments}
+                RETURNING {bug}.id
+            '''.format(
+                bug=Bug._meta.db_table,
+                action=Action._meta.db_table,
+                comment=Comment._meta.db_table,
+                derived=DERIVED_BUGS_SQL,
+                columns=', '.join(COLUMNS),
+                assignments=', '.join(
+                    '{0} = EXCLUDED.{0}'.format(column) for column in COLUMNS[1:]
+                ),
+            ),
+            {'first': first, 'last': last, 'ids': ids},
+        )
+        rebuilt = sorted(id for id, in cursor.fetchall())
+    Bug.objects.filter(pk__in=rebuilt).update_search_vectors()
+    autocomplete.invalidate()
+    return rebuilt
@@ -0,0 +1,160 @@
+"""
+Serves stored files from views that check access first.
+
+The transfer is handed to the front-end server when BUGGY_SENDFILE is set:
+
+    # nginx, with an internal location that aliases MEDIA_ROOT:
+    #   location /protected/ { internal; alias /srv/buggy/media/; }
+    BUGGY_SENDFILE = 'x-accel-redirect'
+    BUGGY_SENDFILE_PREFIX = '/protected/'
+
+    # Apache with mod_xsendfile, given the absolute path of the file.
+    BUGGY_SENDFILE = 'x-sendfile'
+
+Otherwise files are streamed from Python, with support for Range and
+conditional requests. Files in storages that have no local path, like S3, are
+redirected to instead.
+"""
+import mimetypes
+import re
+from urllib.parse import quote
+
+from django.conf import settings
+from django.http import HttpResponse, HttpResponseRedirect, StreamingHttpResponse
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import quote_etag
+
+RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+CHUNK_SIZE = 64 * 1024
+
+# The types files can be shown inline as. The type is guessed from the name
+# the file was uploaded with, so anything that could run scripts, like HTML or
+# SVG, is always downloaded whatever the content.
+INLINE_CONTENT_TYPES = {
+    'image/bmp', 'image/gif', 'image/jpeg', 'image/png', 'image/tiff',
+    'image/webp', 'image/x-icon', 'image/vnd.microsoft.icon',
+}
+
+
+class RangeNotSatisfiable(Exception):
+    pass
+
+
+def parse_range(header, size):
+    """
+    The (first, last) bytes of a Range header for a file of `size` bytes, or
+    None for the whole file. Only single ranges are supported, the whole file
+    is sent for anything else.
+    """
+    match = RANGE_RE.match(header.strip()) if header else None
+    if not match or match.groups() == ('', ''):
+        return None
+    first, last = match.groups()
+    if not first:
+        # The last `last` bytes.
+        first, last = max(size - int(last), 0), size - 1
+    else:
+        first = int(first)
+        last = min(int(last), size - 1) if last else size - 1
+    if first > last:
+        raise RangeNotSatisfiable
+    return first, last
+
+
+def read_range(f, first, last):
+    try:
+        f.seek(first)
+        remaining = last - first + 1
+        while remaining > 0:
+            chunk = f.read(min(CHUNK_SIZE, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+    finally:
+        f.close()
+
+
+def get_content_disposition(filename, as_attachment):
+    return "{}; filename=\"{}\"; filename*=UTF-8''{}".format(
+        'attachment' if as_attachment else 'inline',
+        filename.encode('ascii', 'replace').decode('ascii').replace('"', ''),
+        quote(filename),
+    )
+
+
+def get_content_type(filename, as_attachment):
+    """
+    The (content type, as_attachment) a file named `filename` is served with.
+    """
+    content_type, encoding = mimetypes.guess_type(filename)
+    if not as_attachment and content_type not in INLINE_CONTENT_TYPES:
+        return 'application/octet-stream', True
+    return content_type or 'application/octet-stream', as_attachment
+
+
+def get_local_path(field_file):
+    try:
+        return field_file.storage.path(field_file.name)
+    except NotImplementedError:
+        return None
+
+
+def serve_file(request, field_file, filename, etag, as_attachment=True):
+    """
+    A response with the content of `field_file`. `etag` must change whenever
+    the content does.
+    """
+    path = get_local_path(field_file)
+    if path is None:
+        return HttpResponseRedirect(field_file.url)
+
+    etag = quote_etag(etag)
+    response = get_conditional_response(request, etag=etag)
+    if response is None:
+        method = getattr(settings, 'BUGGY_SENDFILE', None)
+        if method == 'x-accel-redirect':
+            response = HttpResponse()
+            response['X-Accel-Redirect'] = quote(
+                getattr(settings, 'BUGGY_SENDFILE_PREFIX', '/protected/') + field_file.name
+            )
+        elif method == 'x-sendfile':
+            response = HttpResponse()
+            response['X-Sendfile'] = path
+        else:
+            response = stream_file(request, field_file, etag)
+        content_type, as_attachment = get_content_type(filename, as_attachment)
+        # The front-end server would guess from the stored name instead.
+        response['Content-Type'] = content_type
+        response['Content-Disposition'] = get_content_disposition(filename, as_attachment)
+        response['X-Content-Type-Options'] = 'nosniff'
+
+    response['ETag'] = etag
+    # The content behind a URL never changes, only whether it can be seen.
+    patch_cache_control(response, private=True, max_age=60 * 60 * 24 * 365)
+    return response
+
+
+def stream_file(request, field_file, etag):
+    size = field_file.size
+    byte_range = None
+    # A Range is only honored if the client's copy is still the current one.
+    if request.META.get('HTTP_IF_RANGE', etag) == etag:
+        try:
+            byte_range = parse_range(request.META.get('HTTP_RANGE'), size)
+        except RangeNotSatisfiable:
+            response = HttpResponse(status=416)
+            response['Content-Range'] = 'bytes */{}'.format(size)
+            return response
+
+    f = field_file.storage.open(field_file.name, 'rb')
+    if byte_range is None:
+        response = StreamingHttpResponse(read_range(f, 0, size - 1))
+        response['Content-Length'] = size
+    else:
+        first, last = byte_range
+        response = StreamingHttpResponse(read_range(f, first, last), status=206)
+        response['Content-Length'] = last - first + 1
+        response['Content-Range'] = 'bytes {}-{}/{}'.format(first, last, size)
+    response['Accept-Ranges'] = 'bytes'
+    return response
@@ -2,7 +2,10 @@ jQuery(function($) {
   var buggyData = {};
 
   function parseBuggyData() {
-    ["previewMarkdownUrl", "openBugs", "userNames", "bugActions", "harvestPlatformConfig"].map(function(key) {
+    [
+      "previewMarkdownUrl", "autocompleteUrl", "directUploadUrl", "stateActions", "facetCounts",
+      "harvestPlatformConfig"
+    ].map(function(key) {
       buggyData[key] = JSON.parse($("#buggyData-" + key).text() || null);
     });
     window._harvestPlatformConfig = buggyData.harvestPlatformConfig;
@@ -25,28 +28,34 @@ jQuery(function($) {
     return false;
   });
 
-  $('textarea[name="comment"]').atwho({
-    at: '@',
-    data: buggyData.userNames,
-  }).atwho({
-    at: '#',
-    data: buggyData.openBugs,
-    displayTpl: '<li data-value="#${number}">#${number} <small>${title}</small></li>',
-    insertTpl: '#${number}',
-    searchKey: 'number',
-    callbacks: {
-      // We don't want to match at the beginning of the line, because that will
-      // be a markdown header instead of a bug mention.
-      matcher: function(flag, subtext) {
-        var regexp = /^.*\S.*[ \t\f\v]#(\d*)$/gim;
-        var match = regexp.exec(subtext);
-        if (match)
-          return match[1];
-        else
-          return null;
+  function setUpAutocomplete(data) {
+    $('textarea[name="comment"]').atwho({
+      at: '@',
+      data: data.userNames,
+    }).atwho({
+      at: '#',
+      data: data.openBugs,
+      displayTpl: '<li data-value="#${number}">#${number} <small>${title}</small></li>',
+      insertTpl: '#${number}',
+      searchKey: 'number',
+      callbacks: {
+        // We don't want to match at the beginning of the line, because that will
+        // be a markdown header instead of a bug mention.
+        matcher: function(flag, subtext) {
+          var regexp = /^.*\S.*[ \t\f\v]#(\d*)$/gim;
+          var match = regexp.exec(subtext);
+          if (match)
+            return match[1];
+          else
+            return null;
+        }
       }
-    }
-  });
+    });
+  }
+
+  if (buggyData.autocompleteUrl) {
+    $.getJSON(buggyData.autocompleteUrl, setUpAutocomplete);
+  }
 
 
   // Only allow one request to preview markdown to the server at a time, but
@@ -84,6 +93,62 @@ jQuery(function($) {
     return false;
   });
 
+  // When direct uploads are on, attachments are sent straight to storage
+  // before the form is submitted, and the form only carries their tokens.
+  function directUpload(file) {
+    return $.ajax({
+      url: buggyData.directUploadUrl,
+      method: 'POST',
+      data: {filename: file.name},
+      headers: {'X-CSRFToken': $('[name="csrfmiddlewaretoken"]').val()}
+    }).then(function(upload) {
+      var formData = new FormData();
+      $.each(upload.fields, function(key, value) {
+        formData.append(key, value);
+      });
+      formData.append('file', file);
+      return $.ajax({
+        url: upload.url,
+        method: 'POST',
+        data: formData,
+        processData: false,
+        contentType: false
+      }).then(function() {
+        return upload.token;
+      });
+    });
+  }
+
+  $('.bugForm button[type="submit"]').click(function() {
+    $(this.form).data('submitter', this);
+  });
+
+  $('.bugForm').on('submit', function(event) {
+    var form = this;
+    var $input = $(form).find('input[name="attachments"]');
+    if (!buggyData.directUploadUrl || !$input.length || !$input[0].files.length)
+      return;
+
+    event.preventDefault();
+    $(form).addClass('uploading');
+    var files = $.makeArray($input[0].files);
+    $.when.apply($, files.map(directUpload)).then(function() {
+      $.each(arguments, function(i, token) {
+        $('<input type="hidden" name="uploads">').val(token).appendTo(form);
+      });
+      // Submitting from script leaves out the button that was clicked.
+      var submitter = $(form).data('submitter');
+      if (submitter && submitter.name)
+        $('<input type="hidden">').attr('name', submitter.name).val(submitter.value).appendTo(form);
+      $input.val('');
+      form.submit();
+    }, function() {
+      $(form).removeClass('uploading');
+      $(form).off('click', 'button[type="submit"]');
+      alert('The attachments could not be uploaded, please try again.');
+    });
+  });
+
   // Pjax
   var pjaxRequestPending = false;
   var pjaxRequestCanceled = false;
@@ -109,8 +174,10 @@ jQuery(function($) {
   });
 
   $(document).on('pjax:end', function() {
+    syncSelectedBugs();
     setActiveBulkActions();
     parseBuggyData();
+    showFacetCounts();
     $('.subActions').hide();
     $('.actions > button, .actions .open').show();
   });
@@ -129,6 +196,8 @@ jQuery(function($) {
   });
 
   $(document).on('submit', 'form[data-pjax]', function(event) {
+    // Other filters may not match the selected bugs anymore.
+    selectedBugs = {};
     $.pjax.submit(event, '#pjax-container');
   });
   $('form[data-pjax] :input:not(#id_search)').on('change', pjaxSubmit);
@@ -159,16 +228,33 @@ jQuery(function($) {
     }
   }
 
+  // The states of the selected bugs by id. The selection is kept while
+  // paging, the bugs selected on other pages are submitted as hidden inputs.
+  var selectedBugs = {};
+
+  function syncSelectedBugs() {
+    var onPage = [];
+    $('input[name=bugs]:checkbox').each(function() {
+      var checked = this.value in selectedBugs;
+      onPage.push(this.value);
+      $(this).prop('checked', checked);
+      $(this).closest('tr').toggleClass('checked', checked);
+    });
+    var $elsewhere = $('#selected-elsewhere').empty();
+    $.each(selectedBugs, function(id) {
+      if (onPage.indexOf(id) < 0)
+        $elsewhere.append($('<input type="hidden" name="bugs">').val(id));
+    });
+  }
+
   function setActiveBulkActions() {
-    var bugNumbers = $('input[name=bugs]:checked').closest('tr').map(function(i, x) {
-      return $(x).data('number');
-    }).get();
-    $('.offCanvasForm').toggleClass('active', bugNumbers.length > 0);
-    $('#selected-count').text(bugCountDescription(bugNumbers.length));
+    var bugStates = $.map(selectedBugs, function(state) { return state; });
+    $('.offCanvasForm').toggleClass('active', bugStates.length > 0);
+    $('#selected-count').text(bugCountDescription(bugStates.length));
     $('#check_all_bugs').prop(
-      'checked', $('input[name=bugs]:checked').length === $('input[name=bugs]').length
+      'checked', $('input[name=bugs]:checkbox:checked').length === $('input[name=bugs]:checkbox').length
     );
-    var actionLists = bugNumbers.map(function(x) { return buggyData.bugActions[x]; });
+    var actionLists = bugStates.map(function(x) { return buggyData.stateActions[x]; });
     var allowedActions = intersection(actionLists);
     $('.offCanvasForm button[name=action]').each(function(i, e) {
       $(e).prop('disabled', allowedActions.indexOf(e.value) < 0);
@@ -179,16 +265,52 @@ jQuery(function($) {
     });
   }
 
+  function selectBugs($checkboxes, checked) {
+    $checkboxes.each(function() {
+      if (checked)
+        selectedBugs[this.value] = $(this).closest('tr').data('state');
+      else
+        delete selectedBugs[this.value];
+    });
+    syncSelectedBugs();
+    setActiveBulkActions();
+  }
+
   $(document).on('change', '#check_all_bugs', function() {
-    $('input[name=bugs]').prop('checked', $(this).prop('checked'));
+    selectBugs($('input[name=bugs]:checkbox'), $(this).prop('checked'));
   });
-  $(document).on('change', 'input[name=bugs], #check_all_bugs', setActiveBulkActions);
-
-  $(document).on('change', 'input[name=bugs]', function() {
-    $(this).closest('tr').toggleClass('checked', $(this).prop('checked'));
+  $(document).on('change', 'input[name=bugs]:checkbox', function() {
+    selectBugs($(this), $(this).prop('checked'));
   });
 
-  setActiveBulkActions();
+  selectBugs($('input[name=bugs]:checkbox:checked'), true);
+
+  // Shows how many bugs each filter choice would match next to it.
+  function showFacetCounts() {
+    var counts = buggyData.facetCounts || {};
+    $('.bugFilterGroup .facetCount').remove();
+    $.each(['state', 'priority'], function(i, name) {
+      $('.bugFilterGroup input[name="' + name + '"]').each(function() {
+        var count = (counts[name] || {})[this.value] || 0;
+        $('label[for="' + this.id + '"]').append(
+          $('<span class="facetCount">').text(' (' + count + ')')
+        );
+      });
+    });
+    $.each(['projects', 'assigned_to'], function(i, name) {
+      $('.bugFilterGroup select[name="' + name + '"] option').each(function() {
+        var $option = $(this);
+        if (!$option.val())
+          return;
+        if (!$option.data('label'))
+          $option.data('label', $option.text());
+        var count = (counts[name] || {})[$option.val()] || 0;
+        $option.text($option.data('label') + ' (' + count + ')');
+      });
+    });
+    $('select[name="projects"]').trigger('change.select2');
+  }
+  showFacetCounts();
 
   // prevent double submissions
   $('form').on('submit', function() {
@@ -1,7 +1,24 @@
+import datetime
+import io
+import json
+
 import pytest
+from PIL import Image
 from django.contrib.auth import get_user_model
+from django.contrib.postgres.search import SearchQuery
+from django.core import mail
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.mail.backends import locmem
+from django.core.management import call_command, CommandError
+from django.db import connection, transaction
+from django.utils import timezone
 
-from buggy.models import Bug, Comment
+from buggy import export, thumbnails, uploads, verhoeff
+from buggy import notifications as notifications_module
+from buggy.projections import find_drift
+from buggy.models import Action, Blob, Bug, BugSnapshot, Comment, Notification
+from buggy.enums import Priority, State
+from buggy.timeline import build_timeline, annotate_action
 from .fixtures import bug, user, project
 
 User = get_user_model()
@@ -12,6 +29,27 @@ def test_get_by_number(bug):
     assert retrieved_bug == bug
 
 
+def test_verhoeff_many():
+    numbers = [0, 1, 9, 10, 99, 100, 1234, 987654321, 10 ** 20 + 7]
+    generated = verhoeff.generate_verhoeff_many(numbers)
+    assert generated == [verhoeff.generate_verhoeff(n) for n in numbers]
+
+    candidates = generated + ['0', '01', '00', '1234', '99999999999999999999999']
+    assert verhoeff.validate_verhoeff_many(candidates) == [
+        verhoeff.validate_verhoeff(n) for n in candidates
+    ]
+
+
+def test_bug_number_memoized():
+    bugs = [Bug(id=i) for i in range(1, 4)]
+    Bug.preload_numbers(bugs)
+    assert [bug.number for bug in bugs] == [verhoeff.generate_verhoeff(i) for i in range(1, 4)]
+
+    bug = bugs[0]
+    bug.id = 42
+    assert bug.number == verhoeff.generate_verhoeff(42)
+
+
 @pytest.mark.django_db
 def test_mention_rendering():
     User.objects.create_user(
@@ -68,3 +106,510 @@ def test_bug_number_link(bug):
 def test_mentioned_bugs(bug):
     comment = Comment(comment='bug #{}'.format(bug.number))
     assert comment.mentioned_bugs == {bug}
+
+
+def test_comment_rendered_on_commit(user, bug, django_assert_num_queries):
+    mentioned = User.objects.create_user(
+        email='mentioned@example.com',
+        name='Mentioned',
+    )
+    action = Action.build(bug=bug, user=user)
+    action.add_comment('@mentioned see #{}'.format(bug.number))
+    action.commit()
+
+    comment = Comment.objects.get(pk=action.pk)
+    assert comment.is_rendered
+    assert comment.mentioned_user_ids == [mentioned.pk]
+    assert comment.mentioned_bug_ids == [bug.pk]
+    with django_assert_num_queries(0):
+        html = comment.html
+    assert html == comment.compile()[0]
+    assert comment.mentioned_users == {mentioned}
+    assert comment.mentioned_bugs == {bug}
+
+
+def test_rerender_comments(user, bug):
+    action = Action.build(bug=bug, user=user)
+    action.add_comment('**hello**')
+    action.commit()
+    Comment.objects.update(rendered_html='stale', renderer_version='0')
+
+    call_command('rerender_comments', workers=1, stdout=io.StringIO())
+
+    comment = Comment.objects.get(pk=action.pk)
+    assert comment.is_rendered
+    assert comment.html == '<p><strong>hello</strong></p>'
+
+
+def test_bug_link_follows_renames(bug, user, project):
+    other = Action.build_bug(
+        user=user, title='Other', project=project,
+        priority=Priority.NORMAL, state=State.NEW,
+    )
+    other.add_comment('see #{}'.format(bug.number))
+    other.commit()
+    assert 'title="Project - title"' in other.comment.html
+
+    action = Action.build(bug=bug, user=user)
+    action.set_title('Renamed')
+    action.commit()
+    comment = Comment.objects.get(pk=other.comment.pk)
+    assert comment.is_rendered
+    assert 'title="Project - Renamed"' in comment.rendered_html
+
+
+def test_references_resolved_in_bulk(bug, django_assert_num_queries):
+    for name in ['Alice', 'Bob']:
+        User.objects.create_user(email='{}@example.com'.format(name), name=name)
+
+    comment = Comment(comment='@alice @bob @nobody #{0} #{0} #12 #111111111111111\n\n* @Alice'.format(bug.number))
+    with django_assert_num_queries(2):
+        html = comment.html
+    assert html.count('class="mention"') == 3
+    assert html.count('class="bugLink"') == 2
+    assert comment.mentioned_bugs == {bug}
+
+
+def test_timeline(bug, user, django_assert_num_queries):
+    for title in ['Second', 'Third']:
+        action = Action.build(bug=bug, user=user)
+        action.set_title(title)
+        action.commit()
+    action = Action.build(bug=bug, user=user)
+    action.add_comment('No title change')
+    action.commit()
+
+    with django_assert_num_queries(2):
+        timeline = build_timeline(bug.actions_preloaded)
+    assert [action.previous_title for action in timeline] == [None, 'title', 'Second', 'Third']
+    assert timeline[1].previous_state == bug.state
+
+    action = annotate_action(Action.objects.get(bug=bug, order=2))
+    assert action.previous_title == 'Second'
+    assert action.previous_state == bug.state
+    assert action.previous_assigned_to is None
+
+
+def test_action_summary(bug, user, django_assert_num_queries):
+    action = Action.build(bug=bug, user=user)
+    action.add_comment('Hello')
+    action.set_title('New title')
+    description = action.description
+    action.commit()
+    assert action.summary == description == 'commented on the bug and changed the title'
+
+    action = Action.objects.get(pk=action.pk)
+    with django_assert_num_queries(0):
+        assert action.description == description
+
+    Action.objects.filter(pk=action.pk).update(summary='')
+    action = Action.objects.get(pk=action.pk)
+    assert action.description == description
+
+
+def test_fulltext_appended_in_database(bug, user):
+    bug = Bug.objects.defer('fulltext').get(pk=bug.pk)
+    action = Action.build(bug=bug, user=user)
+    action.add_comment('first comment')
+    action.set_title('Renamed')
+    action.commit()
+    assert 'fulltext' in bug.get_deferred_fields()
+
+    bug = Bug.objects.get(pk=bug.pk)
+    assert bug.fulltext.endswith(' first comment')
+    assert Bug.objects.filter(search_vector=SearchQuery('comment'), title='Renamed').exists()
+    # The old title is dropped from the search vector.
+    assert not Bug.objects.filter(search_vector=SearchQuery('title')).exists()
+
+
+def test_rebuild_fulltext(bug, user):
+    for text in ['one', 'two']:
+        action = Action.build(bug=bug, user=user)
+        action.add_comment(text)
+        action.commit()
+    Bug.objects.filter(pk=bug.pk).update(fulltext='stale title', search_vector=None)
+
+    out = io.StringIO()
+    call_command('rebuild_fulltext', workers=1, stdout=out)
+    assert out.getvalue() == 'Rebuilt 1 bugs.\n'
+    bug.refresh_from_db()
+    assert bug.fulltext == ' one two'
+    assert Bug.objects.filter(search_vector=SearchQuery('two')).exists()
+
+
+def test_rebuild_projections(bug, user):
+    action = Action.build(bug=bug, user=user)
+    action.set_title('Renamed')
+    action.commit()
+    Bug.objects.filter(pk=bug.pk).update(title='Drifted', next_action_order=10)
+
+    out = io.StringIO()
+    with pytest.raises(CommandError):
+        call_command('rebuild_projections', verify=True, workers=1, stdout=out)
+    assert out.getvalue() == '#{}\n1 bugs have drifted.\n'.format(bug.number)
+
+    out = io.StringIO()
+    call_command('rebuild_projections', repair=True, workers=1, stdout=out)
+    assert out.getvalue() == 'Repaired 1 bugs.\n'
+    bug.refresh_from_db()
+    assert bug.title == 'Renamed'
+    assert bug.next_action_order == 2
+
+    call_command('rebuild_projections', verify=True, workers=1, stdout=io.StringIO())
+    out = io.StringIO()
+    call_command('rebuild_projections', workers=1, stdout=out)
+    assert out.getvalue() == 'Rebuilt 1 bugs.\n'
+
+    # A missing row is derived again from the action log.
+    action = Action.build(bug=bug, user=user)
+    action.add_comment('Still here')
+    action.commit()
+    bug.refresh_from_db()
+    with connection.cursor() as cursor:
+        cursor.execute("SET session_replication_role = replica")
+        cursor.execute("DELETE FROM buggy_bug WHERE id = %s", [bug.pk])
+        cursor.execute("SET session_replication_role = DEFAULT")
+    assert find_drift(bug.pk, bug.pk) == [bug.pk]
+    out = io.StringIO()
+    call_command('rebuild_projections', repair=True, workers=1, stdout=out)
+    assert out.getvalue() == 'Repaired 1 bugs.\n'
+    restored = Bug.objects.get(pk=bug.pk)
+    for field in ['title', 'state', 'priority', 'project', 'created_by', 'next_action_order', 'created_at']:
+        assert getattr(restored, field) == getattr(bug, field)
+    assert restored.modified_at == action.created_at
+    assert restored.fulltext == ' Still here'
+    assert Bug.objects.filter(search_vector=SearchQuery('still')).exists()
+
+
+def test_as_of(bug, user):
+    start = bug.created_at
+
+    def change(days, **changes):
+        action = Action.build(bug=Bug.objects.get(pk=bug.pk), user=user)
+        action.created_at = start + datetime.timedelta(days=days)
+        if 'title' in changes:
+            action.set_title(changes['title'])
+        if 'state' in changes:
+            action.set_state(changes['state'])
+        action.commit()
+
+    def as_of(days):
+        return Bug.objects.as_of(start + datetime.timedelta(days=days)).get(pk=bug.pk)
+
+    change(1, title='Second', state=State.ENTRUSTED)
+    change(3, title='Third')
+
+    assert as_of(0).as_of_title == 'title'
+    assert as_of(0).as_of_state == State.NEW
+    assert as_of(0).as_of_assigned_to_id is None
+    assert as_of(2).as_of_title == 'Second'
+    assert as_of(2).as_of_state == State.ENTRUSTED
+    assert as_of(4).as_of_title == 'Third'
+    assert not Bug.objects.as_of(start - datetime.timedelta(days=1)).exists()
+
+    out = io.StringIO()
+    call_command('take_snapshot', at=(start + datetime.timedelta(days=2)).isoformat(), workers=1, stdout=out)
+    assert out.getvalue().startswith('Took a snapshot of 1 bugs')
+    snapshot = BugSnapshot.objects.get(bug=bug)
+    assert snapshot.title == 'Second'
+    assert snapshot.state == State.ENTRUSTED
+
+    # Values that didn't change since the snapshot come from it.
+    BugSnapshot.objects.filter(pk=snapshot.pk).update(state=State.REOPENED)
+    assert as_of(4).as_of_title == 'Third'
+    assert as_of(4).as_of_state == State.REOPENED
+    assert as_of(1).as_of_state == State.ENTRUSTED
+
+    bug = Bug.apply_as_of([as_of(2)])[0]
+    assert bug.title == 'Second'
+    assert bug.project.name == 'Project'
+
+
+def test_notification_outbox(bug, user, monkeypatch):
+    assignee = User.objects.create_user(email='assignee@example.com', name='Assignee')
+    action = Action.build(bug=bug, user=user)
+    action.set_assignment(assignee)
+    action.add_comment('@assignee @test and @mentioned')
+    action.commit()
+    # Assigning and mentioning someone only notifies them once, and nobody is
+    # notified of their own actions.
+    assert list(Notification.objects.values_list('kind', 'recipient')) == [
+        (Notification.ASSIGNED, assignee.pk),
+    ]
+    assert mail.outbox == []
+
+    def fail(self, messages):
+        raise ConnectionRefusedError()
+
+    monkeypatch.setattr(locmem.EmailBackend, 'send_messages', fail)
+    out = io.StringIO()
+    call_command('send_notifications', once=True, stdout=out)
+    assert out.getvalue() == 'Sent 0 notifications, 1 failed.\n'
+    notification = Notification.objects.get()
+    assert notification.attempts == 1
+    assert notification.next_attempt_at > timezone.now()
+    assert 'ConnectionRefusedError' in notification.last_error
+
+    monkeypatch.undo()
+    Notification.objects.update(next_attempt_at=timezone.now())
+    out = io.StringIO()
+    call_command('send_notifications', once=True, stdout=out)
+    assert out.getvalue() == 'Sent 1 notifications, 0 failed.\n'
+    assert not Notification.objects.exists()
+    [email] = mail.outbox
+    assert email.to == ['assignee@example.com']
+    assert 'assigned the bug to Assignee' in email.body
+
+
+def test_notification_previous_titles(user, project, django_assert_num_queries):
+    assignee = User.objects.create_user(email='assignee@example.com', name='Assignee')
+    for i in range(3):
+        action = Action.build_bug(
+            user=user, title='Bug {}'.format(i), project=project,
+            priority=Priority.NORMAL, state=State.NEW,
+        )
+        action.commit()
+        action = Action.build(bug=action.bug, user=user)
+        action.set_title('Renamed {}'.format(i))
+        action.set_assignment(assignee)
+        action.commit()
+
+    with transaction.atomic(), django_assert_num_queries(4):
+        # The outbox, the recipients, the actions and the previous titles.
+        notifications = notifications_module.lock_pending_notifications(10)
+    assert sorted(n.action.previous_title for n in notifications) == ['Bug 0', 'Bug 1', 'Bug 2']
+
+
+def test_notification_reconnects_once(bug, user, monkeypatch):
+    for i in range(3):
+        assignee = User.objects.create_user(email='{}@example.com'.format(i), name=str(i))
+        action = Action.build(bug=Bug.objects.get(pk=bug.pk), user=user)
+        action.set_assignment(assignee)
+        action.commit()
+    opened = []
+    monkeypatch.setattr(locmem.EmailBackend, 'open', lambda self: opened.append(self))
+    send_messages = locmem.EmailBackend.send_messages
+
+    def fail_first(self, messages):
+        if not opened[1:]:
+            raise ConnectionResetError()
+        return send_messages(self, messages)
+    monkeypatch.setattr(locmem.EmailBackend, 'send_messages', fail_first)
+
+    assert notifications_module.send_pending_notifications() == (2, 1)
+    # Once for the batch, and once after the failure.
+    assert len(opened) == 2
+
+
+def test_notification_digest(user, project, settings, monkeypatch):
+    settings.BUGGY_NOTIFICATION_DIGEST_WINDOW = 60
+    assignee = User.objects.create_user(email='assignee@example.com', name='Assignee')
+    bugs = []
+    for i in range(3):
+        action = Action.build_bug(
+            user=user, title='Bug {}'.format(i), project=project,
+            priority=Priority.NORMAL, state=State.NEW,
+        )
+        action.set_assignment(assignee)
+        action.commit()
+        bugs.append(action.bug)
+
+    # Nothing is due before the window is over.
+    call_command('send_notifications', once=True, stdout=io.StringIO())
+    assert mail.outbox == []
+
+    connections = []
+
+    def get_connection(*args, **kwargs):
+        connections.append(mail.get_connection(*args, **kwargs))
+        return connections[-1]
+
+    monkeypatch.setattr('buggy.notifications.get_connection', get_connection)
+    Notification.objects.filter(action__bug=bugs[0]).update(next_attempt_at=timezone.now())
+    out = io.StringIO()
+    call_command('send_notifications', once=True, stdout=out)
+    assert out.getvalue() == 'Sent 3 notifications, 0 failed.\n'
+    assert len(connections) == 1
+    [email] = mail.outbox
+    assert email.to == ['assignee@example.com']
+    for bug in bugs:
+        assert bug.number in email.body
+
+
+def test_attachment_deduplication(bug, user, project, settings, tmpdir):
+    settings.MEDIA_ROOT = str(tmpdir)
+    other = Action.build_bug(
+        user=user, title='Other', project=project,
+        priority=Priority.NORMAL, state=State.NEW,
+    )
+    other.add_attachment(SimpleUploadedFile('first.png', b'screenshot'))
+    other.commit()
+
+    actions = []
+    for b in [bug, other.bug]:
+        action = Action.build(bug=b, user=user)
+        action.add_attachment(SimpleUploadedFile('again.PNG', b'screenshot'))
+        actions.append(action)
+    Action.commit_many(actions)
+
+    blob = Blob.objects.get()
+    assert blob.ref_count == 3
+    assert blob.file.name.endswith('.png')
+    assert len(tmpdir.join('blobs').listdir()) == 1
+    assert [a.basename for a in bug.actions.last().attachments.all()] == ['again.PNG']
+
+    # Unused blobs are only collected after the grace period.
+    bug.delete()
+    other.bug.delete()
+    assert Blob.objects.get().ref_count == 0
+    call_command('collect_blobs', stdout=io.StringIO())
+    assert Blob.objects.exists()
+    out = io.StringIO()
+    call_command('collect_blobs', grace_period=-1, stdout=out)
+    assert out.getvalue() == 'Deleted 1 blobs.\n'
+    assert not Blob.objects.exists()
+
+
+def test_generate_thumbnails(bug, user, settings, tmpdir):
+    settings.MEDIA_ROOT = str(tmpdir)
+    image = io.BytesIO()
+    Image.new('RGB', (400, 200)).save(image, 'PNG')
+    action = Action.build(bug=bug, user=user)
+    action.add_attachment(SimpleUploadedFile('screenshot.png', image.getvalue()))
+    action.add_attachment(SimpleUploadedFile('notes.png', b'not an image'))
+    action.commit()
+    screenshot, notes = action.attachments.order_by('filename').reverse()
+    assert screenshot.blob.processed_at is None
+
+    out = io.StringIO()
+    call_command('generate_thumbnails', once=True, workers=1, stdout=out)
+    assert out.getvalue() == 'Processed 2 attachments.\n'
+
+    screenshot.blob.refresh_from_db()
+    assert screenshot.is_image
+    assert (screenshot.blob.width, screenshot.blob.height) == (400, 200)
+    assert (screenshot.blob.thumbnail_width, screenshot.blob.thumbnail_height) == (100, 50)
+    assert screenshot.blob.thumbnail.storage.exists(screenshot.blob.thumbnail.name)
+    notes.blob.refresh_from_db()
+    assert not notes.is_image
+    assert notes.blob.processed_at is not None
+
+
+def test_failed_thumbnail_doesnt_block_others(bug, user, settings, tmpdir, monkeypatch):
+    settings.MEDIA_ROOT = str(tmpdir)
+    settings.BUGGY_THUMBNAIL_MAX_ATTEMPTS = 2
+    images = []
+    for color in ['red', 'blue']:
+        image = io.BytesIO()
+        Image.new('RGB', (400, 200), color).save(image, 'PNG')
+        images.append(image.getvalue())
+    action = Action.build(bug=bug, user=user)
+    action.add_attachment(SimpleUploadedFile('bad.png', images[0]))
+    action.add_attachment(SimpleUploadedFile('good.png', images[1]))
+    action.commit()
+    bad = action.attachments.get(filename='bad.png').blob
+    good = action.attachments.get(filename='good.png').blob
+
+    get_thumbnail = thumbnails.get_thumbnail
+
+    def fail_on_bad(file, geometry):
+        if file.name == bad.file.name:
+            raise AttributeError('ANTIALIAS')
+        return get_thumbnail(file, geometry)
+    monkeypatch.setattr(thumbnails, 'get_thumbnail', fail_on_bad)
+
+    out = io.StringIO()
+    call_command('generate_thumbnails', once=True, workers=1, stdout=out)
+    assert out.getvalue() == 'Processed 1 attachments.\n'
+    good.refresh_from_db()
+    assert good.thumbnail
+    bad.refresh_from_db()
+    assert bad.processed_at is None
+    assert bad.attempts == 1
+    assert 'ANTIALIAS' in bad.last_error
+
+    # Given up on after too many attempts.
+    call_command('generate_thumbnails', once=True, workers=1, stdout=io.StringIO())
+    bad.refresh_from_db()
+    assert bad.attempts == 2
+    assert bad.processed_at is not None
+    assert not action.attachments.get(filename='bad.png').is_image
+
+
+def test_uploaded_attachment_deduplication(bug, user, settings, tmpdir):
+    settings.MEDIA_ROOT = str(tmpdir)
+    action = Action.build(bug=bug, user=user)
+    action.add_attachment(SimpleUploadedFile('log.txt', b'log'))
+    action.commit()
+    existing = Blob.objects.get()
+
+    Blob.file.field.storage.save('uploads/1/again.txt', io.BytesIO(b'log'))
+    action = Action.build(bug=bug, user=user)
+    action.add_uploaded_attachment(uploads.Upload('uploads/1/again.txt', 'again.txt', 3))
+    action.commit()
+    call_command('generate_thumbnails', once=True, workers=1, stdout=io.StringIO())
+
+    attachment = action.attachments.get()
+    assert attachment.filename == 'again.txt'
+    assert attachment.blob == existing
+    assert Blob.objects.get(pk=existing.pk).ref_count == 2
+    duplicate = Blob.objects.get(file='uploads/1/again.txt')
+    assert duplicate.ref_count == 0
+    assert duplicate.sha256 is None
+
+    # Submitting the same upload again reuses its blob.
+    action = Action.build(bug=bug, user=user)
+    action.add_uploaded_attachment(uploads.Upload('uploads/1/again.txt', 'again.txt', 3))
+    action.commit()
+    assert Blob.objects.get(file='uploads/1/again.txt').ref_count == 1
+    call_command('generate_thumbnails', once=True, workers=1, stdout=io.StringIO())
+    assert action.attachments.get().blob == existing
+    assert Blob.objects.get(pk=existing.pk).ref_count == 3
+
+    call_command('collect_blobs', grace_period=-1, stdout=io.StringIO())
+    assert list(Blob.objects.all()) == [existing]
+    assert existing.file.storage.exists(existing.file.name)
+
+
+def test_import_bugs(bug, user, tmpdir):
+    action = Action.build(bug=bug, user=user)
+    action.add_comment('Imported\tcomment\\n')
+    action.set_assignment(user)
+    action.set_state(State.ENTRUSTED)
+    action.commit()
+
+    path = tmpdir.join('bugs.ndjson')
+    with path.open('wb') as f:
+        for chunk in export.export(Bug.objects.all(), history=True):
+            f.write(chunk)
+        f.write(json.dumps({
+            'number': '0', 'title': 'Without history', 'state': 'new', 'priority': 2,
+            'project': 'Other project', 'created_by': 'someone@example.com',
+            'assigned_to': None, 'created_at': '2017-01-01T00:00:00Z',
+        }).encode('utf-8') + b'\n')
+
+    with pytest.raises(CommandError):
+        call_command('import_bugs', str(path), stdout=io.StringIO())
+    assert Bug.objects.count() == 1
+
+    out = io.StringIO()
+    call_command('import_bugs', str(path), create_users=True, stdout=out)
+    assert out.getvalue() == 'Imported 2 bugs and 3 actions.\n'
+
+    imported = Bug.objects.exclude(pk=bug.pk).get(title='title')
+    for field in ['state', 'priority', 'project', 'assigned_to', 'created_by', 'next_action_order']:
+        assert getattr(imported, field) == getattr(bug, field)
+    # The export has millisecond precision.
+    assert abs(imported.created_at - bug.created_at) < datetime.timedelta(milliseconds=1)
+    assert imported.fulltext == ' Imported\tcomment\\n'
+    assert Bug.objects.filter(search_vector=SearchQuery('comment')).count() == 2
+    assert [a.description for a in imported.actions.order_by('order')] == [
+        a.description for a in bug.actions.order_by('order')
+    ]
+    assert imported.actions.last().comment.html == bug.actions.last().comment.html
+
+    other = Bug.objects.get(title='Without history')
+    assert other.created_by.email == 'someone@example.com'
+    assert not other.created_by.is_active
+    assert other.project.name == 'Other project'
+    assert find_drift(0, 10 ** 9) == []
@@ -1,5 +1,11 @@
+import pytest
+from django.core.exceptions import ValidationError
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
 from buggy.models import Action, Bug
 from buggy.enums import Priority, State
+from buggy.mutation import BuggyBugMutator, BulkActionIncomplete
 from .fixtures import user, project, bug
 
 
@@ -50,3 +56,132 @@ def test_operations(user, bug):
 
     action.refresh_from_db()
     assert list(action.operations) == [op1, op2]
+
+
+def test_transition_table(user, bug):
+    table = BuggyBugMutator.get_transition_table()
+    assert table is BuggyBugMutator.get_transition_table()
+
+    for state in State:
+        bug.state = state
+        mutator = BuggyBugMutator(user, bug)
+        actions = {action for action, label in mutator.action_choices(mutator.get_actions())}
+        assert table[state] == actions
+
+
+def make_bugs(user, project, count):
+    bugs = []
+    for i in range(count):
+        action = Action.build_bug(
+            user=user,
+            title='bug {}'.format(i),
+            project=project,
+            priority=Priority.NORMAL,
+            state=State.NEW,
+        )
+        action.commit()
+        bugs.append(action.bug)
+    return bugs
+
+
+def test_bulk_action(user, project):
+    bugs = make_bugs(user, project, 3)
+    data = {
+        'action': State.RESOLVED_FIXED.value,
+        'comment': 'all done',
+        'assign_to': None,
+        'priority': Priority.URGENT,
+    }
+    actions = BuggyBugMutator.process_bulk_action(user, bugs, data, chunk_size=2)
+    assert len(actions) == 3
+
+    for bug in bugs:
+        bug.refresh_from_db()
+        assert bug.state == State.RESOLVED_FIXED
+        assert bug.priority == Priority.URGENT
+        assert bug.assigned_to == user
+        assert 'all done' in bug.fulltext
+
+        action = bug.actions.last()
+        assert action.order == 1
+        assert action.comment.comment == 'all done'
+        assert action.setassignment.assigned_to == user
+
+
+def test_bulk_action_checked_before_committing(user, project):
+    bugs = make_bugs(user, project, 3)
+    bugs[2].priority = Priority.URGENT
+    bugs[2].save()
+    data = {
+        'action': 'comment',
+        'comment': '',
+        'assign_to': None,
+        'priority': Priority.URGENT,
+    }
+    with pytest.raises(ValidationError):
+        BuggyBugMutator.process_bulk_action(user, bugs, data, chunk_size=2)
+    for bug in bugs[:2]:
+        bug.refresh_from_db()
+        assert bug.priority != Priority.URGENT
+        assert bug.actions.count() == 1
+
+
+def test_bulk_action_later_chunk_fails(user, project, monkeypatch):
+    bugs = make_bugs(user, project, 3)
+    data = {
+        'action': 'comment',
+        'comment': '',
+        'assign_to': None,
+        'priority': Priority.URGENT,
+    }
+    process_bulk_chunk = BuggyBugMutator.process_bulk_chunk
+
+    def change_last_bug(user, bug_ids, data):
+        actions = process_bulk_chunk(user, bug_ids, data)
+        # Changed by someone else while the first chunk was committed.
+        Bug.objects.filter(pk=bugs[2].pk).update(priority=Priority.URGENT)
+        return actions
+    monkeypatch.setattr(BuggyBugMutator, 'process_bulk_chunk', change_last_bug)
+
+    with pytest.raises(BulkActionIncomplete) as excinfo:
+        BuggyBugMutator.process_bulk_action(user, bugs, data, chunk_size=2)
+    assert len(excinfo.value.actions) == 2
+    assert excinfo.value.total == 3
+    assert excinfo.value.messages == ['Do something at least']
+    for bug in bugs[:2]:
+        bug.refresh_from_db()
+        assert bug.priority == Priority.URGENT
+    assert bugs[2].actions.count() == 1
+
+
+def test_bulk_action_queries_dont_grow_with_bugs(user, project):
+    data = {
+        'action': 'comment',
+        'comment': 'hello',
+        'assign_to': None,
+        'priority': Priority.NORMAL,
+    }
+    query_counts = []
+    for count in [2, 4]:
+        bugs = make_bugs(user, project, count)
+        with CaptureQueriesContext(connection) as queries:
+            BuggyBugMutator.process_bulk_action(user, bugs, data)
+        query_counts.append(len(queries))
+    assert query_counts[0] == query_counts[1]
+
+
+def test_action_order_counter(user, bug):
+    # Two copies of the bug loaded before either commits, as concurrent
+    # requests would.
+    first = Bug.objects.get(pk=bug.pk)
+    second = Bug.objects.get(pk=bug.pk)
+
+    for copy, expected_order in [(first, 1), (second, 2), (first, 3)]:
+        action = Action.build(bug=copy, user=user)
+        action.add_comment('hello')
+        action.commit()
+        assert action.order == expected_order
+
+    bug.refresh_from_db()
+    assert bug.next_action_order == 4
+    assert list(bug.actions.values_list('order', flat=True)) == [0, 1, 2, 3]
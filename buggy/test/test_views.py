@@ -1,9 +1,23 @@
+import csv
+import datetime
+import gzip
+import io
 import json
 
+import pytest
+
+from django.core import signing
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
 from django.urls import reverse
+from django.utils import timezone
 
-from buggy.webhook import get_bugs_from_commit_message, process_commit, validate_signature
-from buggy.enums import State
+from buggy.webhook import get_bugs_from_commit_message, process_commit, process_commits, validate_signature
+from buggy.models import Action, Bug, BugQuerySet, ProcessedCommit, WebhookDelivery
+from buggy.enums import Priority, State
+from buggy.mutation import BuggyBugMutator
+from buggy.views import BugListView
+from buggy import uploads
 
 from .fixtures import bug, project, user
 
@@ -41,6 +55,66 @@ def test_mention(bug):
     # don't do duplicate comments (pushes from other branches)
     process_commit(commit)
     assert len(bug.actions.all()) == 2
+    assert ProcessedCommit.objects.filter(commit_id=commit['id'], bug=bug).count() == 1
+
+
+def test_replayed_push_is_cheap(bug, django_assert_num_queries):
+    commit = {
+        "author": {
+            "email": bug.created_by.email,
+        },
+        "id": "dfe96070ea1f472fb3aa35f8a64ede598cb970e0",
+        "message": "this is related to #{}".format(bug.number),
+    }
+    process_commit(commit)
+    # The author, the bugs and the processed commits.
+    with django_assert_num_queries(3):
+        process_commit(commit)
+
+
+def test_push_processed_in_bulk(bug, user, project, django_assert_num_queries, monkeypatch):
+    other = Action.build_bug(
+        user=user, title='Other', project=project,
+        priority=Priority.NORMAL, state=State.NEW,
+    )
+    other.commit()
+    commits = [
+        {
+            "author": {"email": email},
+            "id": "{:040x}".format(i),
+            "message": "fixes #{} and #{}".format(bug.number, other.bug.number),
+        }
+        for i, email in enumerate([user.email, 'unknown@example.com', user.email])
+    ]
+    # Changed after the push was loaded, which it mustn't undo.
+    get_by_numbers = BugQuerySet.get_by_numbers
+
+    def get_by_numbers_then_rename(self, numbers):
+        bugs = get_by_numbers(self, numbers)
+        Bug.objects.filter(pk=other.bug.pk).update(title='Renamed')
+        return bugs
+    monkeypatch.setattr(BugQuerySet, 'get_by_numbers', get_by_numbers_then_rename)
+    process_commits(commits)
+    monkeypatch.undo()
+    assert Bug.objects.get(pk=other.bug.pk).title == 'Renamed'
+    assert bug.actions.count() == 3
+    assert other.bug.actions.count() == 3
+    assert bug.actions.last().comment.comment.startswith('Test User fixed the bug in commit')
+
+    # The authors, the bugs and the processed commits.
+    with django_assert_num_queries(3):
+        process_commits(commits)
+
+
+def test_failed_delivery_is_retried(bug, settings):
+    settings.GIT_COMMIT_WEBHOOK_SECRET = None
+    WebhookDelivery.objects.create(payload={'commits': [{'id': 'no author'}]})
+    out = io.StringIO()
+    call_command('process_webhooks', once=True, stdout=out)
+    assert out.getvalue() == 'Processed 0 pushes, 1 failed.\n'
+    delivery = WebhookDelivery.objects.get()
+    assert delivery.attempts == 1
+    assert 'KeyError' in delivery.last_error
 
 
 def test_resolve(bug):
@@ -93,12 +167,350 @@ def test_view(client, bug, settings):
         ],
     }), content_type='application/json')
 
-    assert response.status_code == 201
+    assert response.status_code == 202
+    assert bug.actions.count() == 1
+
+    call_command('process_webhooks', once=True, stdout=io.StringIO())
+    assert not WebhookDelivery.objects.exists()
     action = bug.actions.last()
     assert message in action.comment.comment
     assert action.setstate.state == State.RESOLVED_FIXED
 
+    # Only pushes are queued.
+    url = reverse('buggy:git_commit_webhook')
+    response = client.post(url, json.dumps({'zen': 'Hello'}), content_type='application/json',
+                           HTTP_X_GITHUB_EVENT='ping')
+    assert response.status_code == 204
+    response = client.post(url, json.dumps({'zen': 'Hello'}), content_type='application/json')
+    assert response.status_code == 400
+    assert not WebhookDelivery.objects.exists()
+
 
 def test_signature():
     assert validate_signature(b'secret', b'body', 'sha1=a18991ff7e4513a1c2d2ee51e3a8e99ca891d9cd')
     assert not validate_signature(b'secret', b'no', 'sha1=a18991ff7e4513a1c2d2ee51e3a8e99ca891d9cd')
+
+
+def test_bug_list_pagination(client, user, project, monkeypatch):
+    for title in ['b', 'a', 'c', 'a', 'b']:
+        Action.build_bug(
+            user=user,
+            title=title,
+            project=project,
+            priority=Priority.NORMAL,
+            state=State.NEW,
+        ).commit()
+
+    monkeypatch.setattr(BugListView, 'page_size', 2)
+    client.force_login(user)
+
+    for params, expected in [
+        ({'sort': 'bug'}, ['a', 'a', 'b', 'b', 'c']),
+        ({'sort': 'bug', 'desc': 'True'}, ['c', 'b', 'b', 'a', 'a']),
+        ({'sort': 'assigned_to'}, ['b', 'a', 'c', 'a', 'b']),
+        ({'sort': 'assigned_to', 'desc': 'True'}, ['b', 'a', 'c', 'a', 'b'][::-1]),
+    ]:
+        titles = []
+        pages = 0
+        response = client.get(reverse('buggy:bug_list'), params)
+        while True:
+            pages += 1
+            titles.extend(bug.title for bug in response.context['bugs'])
+            assert response.context['bug_count'] == 5
+            next_page = response.context['page_links']['next']
+            if not next_page:
+                break
+            response = client.get(reverse('buggy:bug_list') + next_page)
+        assert titles == expected
+        assert pages == 3
+
+
+def test_bulk_action(client, user, bug):
+    client.force_login(user)
+    url = reverse('buggy:bug_list')
+
+    # new bugs can't be closed directly
+    client.post(url, {'bugs': [bug.id], 'action': State.CLOSED.value, 'priority': Priority.NORMAL.value})
+    bug.refresh_from_db()
+    assert bug.state == State.NEW
+
+    client.post(url, {'bugs': [bug.id], 'action': State.RESOLVED_FIXED.value, 'priority': Priority.NORMAL.value})
+    bug.refresh_from_db()
+    assert bug.state == State.RESOLVED_FIXED
+    assert bug.priority == Priority.NORMAL
+
+
+def test_bulk_action_across_pages(client, user, project, monkeypatch):
+    for title in ['a', 'b', 'c']:
+        Action.build_bug(
+            user=user, title=title, project=project,
+            priority=Priority.NORMAL, state=State.NEW,
+        ).commit()
+    monkeypatch.setattr(BugListView, 'page_size', 2)
+    client.force_login(user)
+    url = reverse('buggy:bug_list')
+    first_page = client.get(url, {'sort': 'bug'})
+    selected = [bug.id for bug in first_page.context['bugs']]
+    second_page = url + first_page.context['page_links']['next']
+    selected += [bug.id for bug in client.get(second_page).context['bugs']]
+
+    # Posted from the second page, with the selection from the first one.
+    client.post(second_page, {
+        'bugs': selected, 'action': State.RESOLVED_FIXED.value, 'priority': Priority.NORMAL.value,
+    })
+    assert set(Bug.objects.values_list('state', flat=True)) == {State.RESOLVED_FIXED}
+
+
+def test_bulk_action_partly_applied(client, user, project, settings, monkeypatch):
+    bugs = []
+    for title in ['a', 'b']:
+        action = Action.build_bug(
+            user=user, title=title, project=project,
+            priority=Priority.NORMAL, state=State.NEW,
+        )
+        action.commit()
+        bugs.append(action.bug)
+    settings.BUGGY_BULK_ACTION_CHUNK_SIZE = 1
+    process_bulk_chunk = BuggyBugMutator.process_bulk_chunk
+
+    def change_last_bug(user, bug_ids, data):
+        actions = process_bulk_chunk(user, bug_ids, data)
+        # The other bug is changed by someone else in the meantime.
+        Bug.objects.exclude(pk__in=bug_ids).update(priority=Priority.URGENT)
+        return actions
+    monkeypatch.setattr(BuggyBugMutator, 'process_bulk_chunk', change_last_bug)
+
+    client.force_login(user)
+    response = client.post(reverse('buggy:bug_list'), {
+        'bugs': [bug.id for bug in bugs], 'action': 'comment', 'priority': Priority.URGENT.value,
+    }, follow=True)
+    assert [str(message) for message in response.context['messages']] == [
+        'Applied to 1 of 2 bugs.',
+        'Bulk Action Failed: Do something at least',
+    ]
+
+
+def test_autocomplete_data(client, user, bug, django_assert_num_queries):
+    client.force_login(user)
+    url = reverse('buggy:autocomplete')
+    client.get(url)
+    with django_assert_num_queries(3):
+        # The session, the user and the version.
+        client.get(url, HTTP_IF_NONE_MATCH='"outdated"')
+
+    response = client.get(reverse('buggy:bug_detail', kwargs={'bug_number': bug.number}))
+    assert b'buggyData-openBugs' not in response.content
+    url = response.context['buggy_autocomplete_url']
+
+    response = client.get(url)
+    assert response.status_code == 200
+    assert 'max-age' in response['Cache-Control']
+    assert json.loads(response.content.decode('utf-8'))['openBugs'] == [
+        {'title': bug.title, 'number': bug.number},
+    ]
+
+    response = client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+    assert response.status_code == 304
+
+    etag = response['ETag']
+    action = Action.build(bug=bug, user=user)
+    action.set_title('Renamed')
+    action.commit()
+    response = client.get(url, HTTP_IF_NONE_MATCH=etag)
+    assert response.status_code == 200
+    assert 'no-cache' in response['Cache-Control']
+    assert json.loads(response.content.decode('utf-8'))['openBugs'][0]['title'] == 'Renamed'
+
+    etag = response['ETag']
+    user.name = 'Someone'
+    user.save()
+    response = client.get(url, HTTP_IF_NONE_MATCH=etag)
+    assert response.status_code == 200
+    assert 'someone' in json.loads(response.content.decode('utf-8'))['userNames']
+
+
+def test_bug_list_search(client, user, project):
+    client.force_login(user)
+    for title in ['Broken login page', 'Typo on the about page']:
+        Action.build_bug(
+            user=user, title=title, project=project,
+            priority=Priority.NORMAL, state=State.NEW,
+        ).commit()
+    action = Action.build(bug=Bug.objects.get(title='Broken login page'), user=user)
+    action.add_comment('The typo fix broke this.')
+    action.commit()
+
+    url = reverse('buggy:bug_list')
+    response = client.get(url, {'search': 'typo'})
+    assert [bug.title for bug in response.context['bugs']] == ['Broken login page', 'Typo on the about page']
+    response = client.get(url, {'search': 'typo', 'sort': 'relevance'})
+    assert [bug.title for bug in response.context['bugs']] == ['Typo on the about page', 'Broken login page']
+    # There's nothing to rank without a search.
+    response = client.get(url, {'sort': 'relevance'})
+    assert response.context['sort_by'] == 'modified'
+
+
+def test_bug_list_as_of(client, user, bug):
+    client.force_login(user)
+    action = Action.build(bug=bug, user=user)
+    action.created_at = bug.created_at + datetime.timedelta(days=2)
+    action.set_state(State.CLOSED)
+    action.set_title('Closed later')
+    action.commit()
+
+    url = reverse('buggy:bug_list')
+    response = client.get(url)
+    assert list(response.context['bugs']) == []
+
+    response = client.get(url, {'as_of': timezone.localtime(bug.created_at).date().isoformat()})
+    [listed] = response.context['bugs']
+    assert listed.title == 'title'
+    assert listed.state == State.NEW
+    assert b'Closed later' not in response.content
+
+
+def test_direct_upload(client, user, bug, settings):
+    pytest.importorskip('boto3')
+    client.force_login(user)
+    url = reverse('buggy:direct_upload')
+    assert client.post(url, {'filename': 'dump.log'}).status_code == 404
+
+    settings.BUGGY_DIRECT_UPLOADS = {
+        'bucket': 'buggy',
+        'location': 'media',
+        'client': {
+            'endpoint_url': 'http://localhost:9000',
+            'region_name': 'us-east-1',
+            'aws_access_key_id': 'key',
+            'aws_secret_access_key': 'secret',
+        },
+    }
+    response = client.get(reverse('buggy:bug_detail', kwargs={'bug_number': bug.number}))
+    assert response.context['buggy_direct_upload_url'] == url
+
+    upload = json.loads(client.post(url, {'filename': '../dump file.log'}).content.decode('utf-8'))
+    assert upload['url'] == 'http://localhost:9000/buggy'
+    key = upload['fields']['key']
+    assert key.startswith('media/uploads/') and key.endswith('/dump_file.log')
+    data = signing.loads(upload['token'], salt=uploads.SIGNING_SALT)
+    assert 'media/' + data['name'] == key
+
+    response = client.post(reverse('buggy:bug_detail', kwargs={'bug_number': bug.number}), {
+        'uploads': [upload['token'] + 'tampered'],
+        'comment': 'Attached',
+        'action': 'comment',
+        'priority': bug.priority.value,
+    })
+    assert response.status_code == 200
+    assert response.context['form'].errors['uploads'] == ['The upload is invalid or expired.']
+
+
+def test_attachment_view(client, user, bug, settings, tmpdir):
+    settings.MEDIA_ROOT = str(tmpdir)
+    action = Action.build(bug=bug, user=user)
+    action.add_attachment(SimpleUploadedFile('crash log.txt', b'0123456789'))
+    action.commit()
+    attachment = action.attachments.get()
+    url = attachment.get_absolute_url()
+
+    assert client.get(url).status_code == 302
+    client.force_login(user)
+    response = client.get(url)
+    assert b''.join(response.streaming_content) == b'0123456789'
+    assert response['Content-Type'] == 'text/plain'
+    assert response['Content-Disposition'].startswith('attachment; filename="crash log.txt"')
+
+    response = client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+    assert response.status_code == 304
+
+    response = client.get(url, HTTP_RANGE='bytes=2-4')
+    assert response.status_code == 206
+    assert response['Content-Range'] == 'bytes 2-4/10'
+    assert b''.join(response.streaming_content) == b'234'
+    response = client.get(url, HTTP_RANGE='bytes=-3')
+    assert b''.join(response.streaming_content) == b'789'
+    response = client.get(url, HTTP_RANGE='bytes=2-4', HTTP_IF_RANGE='"outdated"')
+    assert response.status_code == 200
+    response = client.get(url, HTTP_RANGE='bytes=10-')
+    assert response.status_code == 416
+
+    settings.BUGGY_SENDFILE = 'x-accel-redirect'
+    response = client.get(url)
+    assert response['X-Accel-Redirect'] == '/protected/' + attachment.blob.file.name
+    assert response.content == b''
+
+    # Images are shown inline, but only as image types.
+    attachment.blob.width = attachment.blob.height = 1
+    attachment.blob.save()
+    response = client.get(url)
+    assert response['Content-Type'] == 'application/octet-stream'
+    assert response['Content-Disposition'].startswith('attachment;')
+    attachment.filename = 'screenshot.png'
+    attachment.save()
+    response = client.get(attachment.get_absolute_url())
+    assert response['Content-Type'] == 'image/png'
+    assert response['Content-Disposition'].startswith('inline;')
+
+
+def test_export(client, user, bug, project, tmpdir):
+    Action.build_bug(
+        user=user, title='Low', project=project,
+        priority=Priority.HOLD, state=State.NEW,
+    ).commit()
+    action = Action.build(bug=bug, user=user)
+    action.add_comment('A comment')
+    action.set_state(State.RESOLVED_FIXED)
+    action.commit()
+    client.force_login(user)
+    url = reverse('buggy:export')
+
+    response = client.get(url, {'priority': Priority.URGENT.value, 'state': 'resolved', 'history': '1'})
+    [record] = [json.loads(line) for line in b''.join(response.streaming_content).splitlines()]
+    assert record['number'] == bug.number
+    assert record['state'] == State.RESOLVED_FIXED.value
+    assert [a['comment'] for a in record['actions']] == [None, 'A comment']
+    assert record['actions'][1]['state'] == State.RESOLVED_FIXED.value
+
+    response = client.get(url, {'format': 'csv', 'state': 'new'}, HTTP_ACCEPT_ENCODING='gzip')
+    assert response['Content-Encoding'] == 'gzip'
+    content = gzip.decompress(b''.join(response.streaming_content)).decode('utf-8')
+    assert [row['title'] for row in csv.DictReader(io.StringIO(content))] == ['Low']
+
+    assert client.get(url, {'format': 'xml'}).status_code == 400
+
+    output = str(tmpdir.join('actions.csv.gz'))
+    call_command(
+        'export_bugs', format='csv', history=True, compress=True,
+        filters=['state=resolved'], output=output,
+    )
+    with gzip.open(output, 'rt') as f:
+        rows = list(csv.DictReader(f))
+    assert [(row['bug'], row['order']) for row in rows] == [(bug.number, '0'), (bug.number, '1')]
+
+
+def test_bug_list_facet_counts(client, user, project):
+    for title, priority, state in [
+        ('a', Priority.URGENT, State.NEW),
+        ('b', Priority.NORMAL, State.NEW),
+        ('c', Priority.NORMAL, State.RESOLVED_FIXED),
+        ('d', Priority.NORMAL, State.RESOLVED_DUPLICATE),
+    ]:
+        Action.build_bug(
+            user=user, title=title, project=project,
+            priority=priority, state=state,
+        ).commit()
+    client.force_login(user)
+
+    response = client.get(reverse('buggy:bug_list'), {'state': 'new'})
+    counts = response.context['facet_counts']
+    assert response.context['bug_count'] == 2
+    # Other states count as if they were checked.
+    assert counts['state']['new'] == 2
+    assert counts['state']['resolved'] == 2
+    assert counts['state']['closed'] == 0
+    assert counts['priority'] == {Priority.URGENT.value: 1, Priority.NORMAL.value: 1}
+    assert counts['projects'] == {project.pk: 2}
+
+    response = client.get(reverse('buggy:bug_list'), {'state': 'resolved', 'priority': Priority.URGENT.value})
+    assert response.context['bug_count'] == 0
+    assert response.context['facet_counts']['priority'] == {Priority.URGENT.value: 0, Priority.NORMAL.value: 2}
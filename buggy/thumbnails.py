@@ -0,0 +1,127 @@
+"""
+Image metadata and thumbnails of attachment blobs, generated by the
+generate_thumbnails command rather than while a bug is viewed. Blobs uploaded
+straight to storage are hashed and deduplicated then too.
+"""
+import hashlib
+import logging
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from django.utils import timezone
+from PIL import Image
+from sorl.thumbnail import get_thumbnail
+
+from .models import AddAttachment, Blob
+
+logger = logging.getLogger(__name__)
+
+THUMBNAIL_FIELDS = ['width', 'height', 'thumbnail', 'thumbnail_width', 'thumbnail_height']
+
+
+def get_thumbnail_geometry():
+    return getattr(settings, 'BUGGY_THUMBNAIL_GEOMETRY', '100x100')
+
+
+def generate_thumbnail(blob):
+    """
+    Fills in the dimensions and thumbnail of `blob`, or leaves them empty if
+    it isn't an image.
+    """
+    # Errors reading the file aren't caught, the blob is then tried again.
+    with blob.file.storage.open(blob.file.name) as f:
+        try:
+            with Image.open(f) as image:
+                blob.width, blob.height = image.size
+                image.verify()
+        except Exception:
+            # Pillow raises all sorts of errors for files it can't decode.
+            logger.info("Blob %s isn't an image", blob.pk, exc_info=True)
+            blob.width = blob.height = None
+            blob.thumbnail = ''
+            blob.thumbnail_width = blob.thumbnail_height = None
+            blob.processed_at = timezone.now()
+            return
+
+    thumbnail = get_thumbnail(blob.file, get_thumbnail_geometry())
+    blob.thumbnail = thumbnail.name
+    blob.thumbnail_width = thumbnail.width
+    blob.thumbnail_height = thumbnail.height
+    blob.processed_at = timezone.now()
+
+
+def deduplicate(blob):
+    """
+    Hashes a blob that was uploaded straight to storage. If the same content
+    was already stored, the blob's attachments are moved to the existing blob,
+    and it's left for collect_blobs with the existing blob's thumbnail.
+    """
+    digest = hashlib.sha256()
+    with blob.file.storage.open(blob.file.name) as f:
+        for chunk in f.chunks():
+            digest.update(chunk)
+    existing = Blob.objects.filter(
+        sha256=digest.hexdigest(),
+    ).select_for_update().first()
+    if existing is None:
+        blob.sha256 = digest.hexdigest()
+        return False
+
+    moved = AddAttachment.objects.filter(blob=blob).update(blob=existing)
+    if moved:
+        Blob.add_references([existing.pk], moved)
+        Blob.add_references([blob.pk], -moved)
+    for field in THUMBNAIL_FIELDS:
+        setattr(blob, field, getattr(existing, field))
+    blob.processed_at = timezone.now()
+    return True
+
+
+def record_failure(pk, error):
+    """
+    Counts a failed attempt at processing the blob `pk`, and gives up on it
+    after BUGGY_THUMBNAIL_MAX_ATTEMPTS so that it doesn't keep coming back.
+    """
+    max_attempts = getattr(settings, 'BUGGY_THUMBNAIL_MAX_ATTEMPTS', 3)
+    with transaction.atomic():
+        Blob.objects.filter(pk=pk).update(attempts=F('attempts') + 1, last_error=repr(error))
+        Blob.objects.filter(
+            pk=pk,
+            processed_at__isnull=True,
+            attempts__gte=max_attempts,
+        ).update(
+            processed_at=timezone.now(),
+            width=None, height=None,
+            thumbnail='', thumbnail_width=None, thumbnail_height=None,
+        )
+
+
+def process_blob(pk):
+    """
+    Generates the thumbnail of the blob `pk` unless it was already done. Returns
+    whether the blob was processed.
+
+    Errors are recorded on the blob rather than raised, so that one file that
+    can't be processed doesn't stop the others.
+    """
+    try:
+        with transaction.atomic():
+            blob = Blob.objects.filter(
+                pk=pk,
+                processed_at__isnull=True,
+            ).select_for_update(skip_locked=True).first()
+            if blob is None:
+                return False
+            if blob.sha256 is not None or not deduplicate(blob):
+                generate_thumbnail(blob)
+            blob.save(update_fields=['sha256', 'processed_at'] + THUMBNAIL_FIELDS)
+            return True
+    except IntegrityError:
+        # The same content was uploaded twice and hashed concurrently, the
+        # blob is deduplicated next time.
+        return False
+    except Exception as e:
+        logger.exception("Failed to process blob %s", pk)
+        record_failure(pk, e)
+        return False
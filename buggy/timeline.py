@@ -0,0 +1,69 @@
+from django.db.models import OuterRef, Subquery
+
+from .models import Action, SetTitle
+
+# (name, operation relation, operation field) for each field of the bug whose
+# previous value is tracked.
+TIMELINE_FIELDS = [
+    ('title', 'settitle', 'title'),
+    ('state', 'setstate', 'state'),
+    ('assigned_to', 'setassignment', 'assigned_to'),
+    ('priority', 'setpriority', 'priority'),
+]
+
+
+def build_timeline(actions):
+    """
+    Sets `previous_title`, `previous_state`, `previous_assigned_to` and
+    `previous_priority` on each action to the value the bug had before it,
+    in one pass. `actions` must be all of a bug's actions, in order, with their
+    operations preloaded (see Bug.actions_preloaded).
+    """
+    current = {name: None for name, relation, field in TIMELINE_FIELDS}
+    timeline = []
+    for action in actions:
+        for name, relation, field in TIMELINE_FIELDS:
+            setattr(action, 'previous_' + name, current[name])
+            operation = getattr(action, relation, None)
+            if operation is not None:
+                current[name] = getattr(operation, field)
+        timeline.append(action)
+    return timeline
+
+
+def annotate_action(action):
+    """
+    Sets the same attributes as build_timeline on a single action, looking up
+    the latest earlier change of each field instead of reading the history.
+    """
+    earlier = type(action).objects.filter(
+        bug=action.bug_id,
+        order__lt=action.order,
+    ).order_by('-order').select_related(
+        'settitle', 'setstate', 'setassignment__assigned_to', 'setpriority',
+    )
+    for name, relation, field in TIMELINE_FIELDS:
+        previous = earlier.filter(**{relation + '__isnull': False}).first()
+        if previous is None:
+            setattr(action, 'previous_' + name, None)
+        else:
+            setattr(action, 'previous_' + name, getattr(getattr(previous, relation), field))
+    return action
+
+
+def annotate_previous_titles(actions):
+    """
+    Sets `previous_title` on `actions`, from any bugs, with one query for the
+    ones that changed the title. The others don't show it.
+    """
+    changed = [action.pk for action in actions if hasattr(action, 'settitle')]
+    previous = SetTitle.objects.filter(
+        action__bug=OuterRef('bug'),
+        action__order__lt=OuterRef('order'),
+    ).order_by('-action__order').values('title')[:1]
+    titles = dict(Action.objects.filter(pk__in=changed).annotate(
+        previous_title=Subquery(previous),
+    ).values_list('pk', 'previous_title')) if changed else {}
+    for action in actions:
+        action.previous_title = titles.get(action.pk)
+    return actions
@@ -0,0 +1,106 @@
+"""
+Attachments uploaded by the browser straight to S3-compatible storage.
+
+The browser asks for a presigned POST, sends the file to the bucket, and
+submits the bug form with the signed token it was given instead of the file.
+Only the object's name ends up in the database.
+
+This is turned on with the BUGGY_DIRECT_UPLOADS setting, and needs boto3. The
+bucket must be the one the default storage uses, so that the uploaded objects
+can be served like any other file:
+
+    BUGGY_DIRECT_UPLOADS = {
+        'bucket': 'buggy',
+        # Where the default storage keeps its files in the bucket.
+        'location': 'media',
+        # Passed to boto3.client, for credentials or a custom endpoint.
+        'client': {'endpoint_url': 'http://localhost:9000'},
+        'max_size': 2 * 1024 ** 3,
+        'expires': 60 * 60,
+    }
+"""
+import collections
+import posixpath
+import uuid
+
+from django.conf import settings
+from django.core import signing
+from django.core.exceptions import ImproperlyConfigured
+from django.utils.text import get_valid_filename
+
+try:
+    import boto3
+    from botocore.exceptions import ClientError
+except ImportError:  # pragma: no cover
+    boto3 = None
+
+SIGNING_SALT = 'buggy.uploads'
+
+Upload = collections.namedtuple('Upload', ['name', 'filename', 'size'])
+
+
+class UploadError(Exception):
+    pass
+
+
+def get_config():
+    config = getattr(settings, 'BUGGY_DIRECT_UPLOADS', None)
+    if config is None:
+        return None
+    return dict({
+        'location': '',
+        'client': {},
+        'max_size': 2 * 1024 ** 3,
+        'expires': 60 * 60,
+    }, **config)
+
+
+def is_enabled():
+    return get_config() is not None
+
+
+def get_client():
+    if boto3 is None:
+        raise ImproperlyConfigured("BUGGY_DIRECT_UPLOADS needs boto3 to be installed.")
+    return boto3.client('s3', **get_config()['client'])
+
+
+def get_key(name):
+    return posixpath.join(get_config()['location'], name)
+
+
+def create_upload(filename):
+    """
+    A presigned POST for uploading `filename` to a new object, and the token
+    to submit with the bug form once it's done.
+    """
+    config = get_config()
+    filename = get_valid_filename(posixpath.basename(filename)) or 'file'
+    name = 'uploads/{}/{}'.format(uuid.uuid4(), filename)
+    post = get_client().generate_presigned_post(
+        Bucket=config['bucket'],
+        Key=get_key(name),
+        Conditions=[['content-length-range', 1, config['max_size']]],
+        ExpiresIn=config['expires'],
+    )
+    return {
+        'url': post['url'],
+        'fields': post['fields'],
+        'token': signing.dumps({'name': name, 'filename': filename}, salt=SIGNING_SALT),
+    }
+
+
+def load_upload(token):
+    """
+    The Upload that `token` was given for. Raises UploadError if the token
+    isn't valid or the object wasn't uploaded.
+    """
+    try:
+        data = signing.loads(token, salt=SIGNING_SALT, max_age=get_config()['expires'] * 2)
+    except signing.BadSignature:
+        raise UploadError("The upload is invalid or expired.")
+    try:
+        head = get_client().head_object(Bucket=get_config()['bucket'], Key=get_key(data['name']))
+    except ClientError:
+        raise UploadError("The upload of {} didn't finish.".format(data['filename']))
+    return Upload(data['name'], data['filename'], head['ContentLength'])
@@ -14,6 +14,13 @@ urlpatterns = [
     url(r'^markdown-preview/$',
         csrf_exempt(views.MarkdownPreviewView.as_view()),
         name='markdown_preview'),
+    url(r'^export/$', views.ExportView.as_view(), name='export'),
+    url(r'^autocomplete/$', views.AutocompleteDataView.as_view(), name='autocomplete'),
+    url(r'^direct-upload/$', views.DirectUploadView.as_view(), name='direct_upload'),
+    url(r'^attachments/(?P<pk>\d+)/thumbnail/$',
+        views.AttachmentView.as_view(thumbnail=True),
+        name='attachment_thumbnail'),
+    url(r'^attachments/(?P<pk>\d+)/(?P<filename>[^/]+)$', views.AttachmentView.as_view(), name='attachment'),
     url(r'^git-commit-webhook/$',
         csrf_exempt(views.GitCommitWebhookView.as_view()),
         name='git_commit_webhook')
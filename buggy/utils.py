@@ -1,6 +1,16 @@
+import datetime
+
 from django.views.generic import TemplateView
 
 
+def get_backoff(attempts, base):
+    """
+    How long to wait before trying again after `attempts` failed attempts,
+    doubling from `base` seconds up to a day.
+    """
+    return datetime.timedelta(seconds=min(base * 2 ** (attempts - 1), 60 * 60 * 24))
+
+
 class GetFormView(TemplateView):
     form_class = None
 
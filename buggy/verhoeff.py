@@ -49,3 +49,82 @@ def generate_verhoeff(number):
 def validate_verhoeff(number):
     """Validate Verhoeff checksummed number (checksum is last digit)"""
     return checksum(number) == 0
+
+
+# The batch functions below fold the d and p tables into one lookup per digit:
+# verhoeff_table_dp[i][c][digit] == verhoeff_table_d[c][verhoeff_table_p[i][digit]]
+verhoeff_table_dp = tuple(
+    tuple(
+        tuple(verhoeff_table_d[c][verhoeff_table_p[i][digit]] for digit in range(10))
+        for c in range(10)
+    )
+    for i in range(8)
+)
+
+try:
+    import numpy
+except ImportError:  # pragma: no cover
+    numpy = None
+else:
+    _numpy_table_dp = numpy.array(verhoeff_table_dp, dtype=numpy.int8)
+    _numpy_table_inv = numpy.array(verhoeff_table_inv, dtype=numpy.int8)
+
+# Numbers with more digits than this don't fit in an int64, and are left to the
+# pure python implementation.
+NUMPY_MAX_DIGITS = 18
+
+
+def _fold(digits, offset):
+    c = 0
+    for i, digit in enumerate(reversed(digits)):
+        c = verhoeff_table_dp[(i + offset) % 8][c][ord(digit) - 48]
+    return c
+
+
+def _numpy_fold(numbers, offset):
+    numbers = numpy.array(numbers, dtype=numpy.int64)
+    c = numpy.zeros(len(numbers), dtype=numpy.int8)
+    remaining = numbers.copy()
+    for i in range(max(len(str(numbers.max())), 1)):
+        digits = remaining % 10
+        # Leading zeros aren't neutral, so shorter numbers stop changing once
+        # their digits run out.
+        present = (remaining > 0) | (i == 0)
+        c = numpy.where(present, _numpy_table_dp[(i + offset) % 8][c, digits], c)
+        remaining //= 10
+    return c
+
+
+def _use_numpy(numbers):
+    return (
+        numpy is not None and
+        len(numbers) > 1 and
+        all(0 <= n < 10 ** NUMPY_MAX_DIGITS for n in numbers)
+    )
+
+
+def generate_verhoeff_many(numbers):
+    """
+    generate_verhoeff for each of `numbers`, which must be non-negative
+    integers. Vectorized with NumPy when it's installed.
+    """
+    numbers = list(numbers)
+    if _use_numpy(numbers):
+        check_digits = _numpy_table_inv[_numpy_fold(numbers, 1)].tolist()
+    else:
+        check_digits = [verhoeff_table_inv[_fold(str(n), 1)] for n in numbers]
+    return ['%s%s' % (n, digit) for n, digit in zip(numbers, check_digits)]
+
+
+def validate_verhoeff_many(numbers):
+    """
+    validate_verhoeff for each of `numbers`, which must be strings of digits.
+    Vectorized with NumPy when it's installed.
+    """
+    numbers = list(numbers)
+    if all(len(n) <= NUMPY_MAX_DIGITS for n in numbers):
+        as_ints = [int(n) for n in numbers]
+        # int() drops leading zeros, which would change the result.
+        if all(str(i) == n for i, n in zip(as_ints, numbers)) and _use_numpy(as_ints):
+            return (_numpy_fold(as_ints, 0) == 0).tolist()
+    return [_fold(n, 0) == 0 for n in numbers]
@@ -3,23 +3,27 @@ import json
 from django.contrib import messages
 from django.contrib.auth.mixins import LoginRequiredMixin
 from django.views.generic import ListView, FormView, View
-from django.http import Http404, HttpResponseRedirect, HttpResponse, HttpResponseForbidden
-from django.shortcuts import redirect
+from django.http import (
+    Http404, HttpResponseRedirect, HttpResponse, HttpResponseBadRequest, HttpResponseForbidden,
+    JsonResponse, StreamingHttpResponse,
+)
+from django.shortcuts import get_object_or_404, redirect
 from django.db.models import Prefetch
 from django.db import transaction
 from django.utils.functional import cached_property
 from django.core.exceptions import ValidationError
-from django.contrib.auth import get_user_model
 from django.conf import settings
 from django.template.defaultfilters import capfirst, pluralize
+from django.urls import reverse
+from django.utils.cache import get_conditional_response, patch_cache_control, patch_vary_headers
+from django.utils.http import quote_etag
 
-from .models import Bug, Action, Comment
+from .models import Bug, Action, AddAttachment, Comment, WebhookDelivery
 from .forms import FilterForm, PresetFilterForm
-from .mutation import BuggyBugMutator
-from .enums import State, Priority
-from . import webhook
-
-User = get_user_model()
+from .mutation import BuggyBugMutator, BulkActionIncomplete
+from .pagination import KeysetPaginator, InvalidCursor
+from .timeline import build_timeline
+from . import webhook, autocomplete, uploads, sendfile, export, facets
 
 
 class BugListView(LoginRequiredMixin, ListView):
@@ -32,6 +36,14 @@ class BugListView(LoginRequiredMixin, ListView):
         'assigned_to': 'assigned_to__name',
         'state': 'state',
         'priority': 'priority',
+        # Only available when searching, see FilterForm.filter.
+        'relevance': 'rank',
+    }
+    # Sorts by the past values when showing bugs as of a date.
+    AS_OF_ORDER_FIELDS = {
+        'bug': 'as_of_title',
+        'state': 'as_of_state',
+        'priority': 'as_of_priority',
     }
 
     mutator_class = BuggyBugMutator
@@ -39,10 +51,12 @@ class BugListView(LoginRequiredMixin, ListView):
         'project', 'created_by', 'assigned_to'
     ).order_by(
         '-modified_at'
-    ).defer('fulltext')  # We don't use the column, so there's no need to detoast a long string.
+    ).defer('fulltext', 'search_vector')  # We don't use the columns, so there's no need to detoast them.
 
     context_object_name = 'bugs'
     form_class = FilterForm
+    paginator_class = KeysetPaginator
+    page_size = 100
 
     def get_form_kwargs(self):
         return {
@@ -55,8 +69,10 @@ class BugListView(LoginRequiredMixin, ListView):
 
     def get_bulk_action_form_kwargs(self):
         kwargs = {
+            # The whole filtered list: the script keeps the bugs selected on
+            # other pages, and submits them along with the current page's.
             'queryset': self.object_list,
-            'bug_actions': self.get_bug_actions(),
+            'state_actions': self.mutator_class.get_transition_table(),
         }
         if self.request.POST:
             kwargs['data'] = self.request.POST
@@ -77,10 +93,14 @@ class BugListView(LoginRequiredMixin, ListView):
         errors = None
         if bulk_action_form.is_valid():
             try:
-                with transaction.atomic():
-                    for bug in bulk_action_form.cleaned_data['bugs']:
-                        state_machine = self.mutator_class(self.request.user, bug)
-                        state_machine.process_action(bulk_action_form.cleaned_data)
+                self.mutator_class.process_bulk_action(
+                    self.request.user,
+                    bulk_action_form.cleaned_data['bugs'],
+                    bulk_action_form.cleaned_data,
+                )
+            except BulkActionIncomplete as e:
+                messages.warning(self.request, 'Applied to {} of {} bugs.'.format(len(e.actions), e.total))
+                errors = e
             except ValidationError as e:
                 errors = e
         else:
@@ -98,19 +118,70 @@ class BugListView(LoginRequiredMixin, ListView):
 
         return HttpResponseRedirect(self.request.get_full_path())
 
-    def get_bug_actions(self):
-        bug_actions = {}
-        for bug in self.object_list:
-            mutator = self.mutator_class(self.request.user, bug)
-            action_choices = mutator.action_choices(mutator.get_actions())
-            bug_actions[bug.number] = [x[0] for x in action_choices]
-        return bug_actions
+    def get_state_actions(self):
+        return {
+            state.value: sorted(actions)
+            for state, actions in self.mutator_class.get_transition_table().items()
+        }
 
-    def get_sort_links(self):
-        sort_links = {}
+    def get_as_of(self):
+        return self.form.get_as_of() if self.form.is_valid() else None
+
+    def get_paginator(self):
+        order_field, desc = self.sort_type()
+        if self.get_as_of() and order_field in self.AS_OF_ORDER_FIELDS:
+            order_field = self.AS_OF_ORDER_FIELDS[order_field]
+        else:
+            order_field = self.ORDER_FIELDS[order_field]
+        return self.paginator_class(
+            self.object_list,
+            order_field=order_field,
+            desc=desc,
+            page_size=self.page_size,
+        )
+
+    def paginate(self):
+        paginator = self.get_paginator()
+        try:
+            return paginator.get_page(self.request.GET.get('after'))
+        except InvalidCursor:
+            # A stale or mangled link; start over from the first page.
+            return paginator.get_page()
+
+    def get_querydict(self):
         querydict = self.request.GET.copy()
         if '_pjax' in querydict:
             del querydict['_pjax']  # pjax adds this param for cache purposes.
+        if 'after' in querydict:
+            del querydict['after']
+        return querydict
+
+    def get_page_links(self):
+        querydict = self.get_querydict()
+        first_page = '?{}'.format(querydict.urlencode())
+        if self.next_cursor:
+            querydict['after'] = self.next_cursor
+            next_page = '?{}'.format(querydict.urlencode())
+        else:
+            next_page = None
+        return {
+            'first': first_page if 'after' in self.request.GET else None,
+            'next': next_page,
+        }
+
+    def get_export_links(self):
+        querydict = self.get_querydict()
+        for key in ['sort', 'desc']:
+            querydict.pop(key, None)
+        links = {}
+        for format in export.FORMATS:
+            querydict['format'] = format
+            links[format] = '{}?{}'.format(reverse('buggy:export'), querydict.urlencode())
+        return links
+
+    def get_sort_links(self):
+        sort_links = {}
+        querydict = self.get_querydict()
 
         current_sort, desc = self.sort_type()
         for order_field in self.ORDER_FIELDS.keys():
@@ -123,22 +194,35 @@ class BugListView(LoginRequiredMixin, ListView):
         return sort_links
 
     def get_context_data(self, **kwargs):
-        context = super().get_context_data(**kwargs)
+        self.page_bugs, self.next_cursor = self.paginate()
+        Bug.preload_numbers(self.page_bugs)
+        if self.get_as_of():
+            Bug.apply_as_of(self.page_bugs)
+        context = super().get_context_data(object_list=self.page_bugs, **kwargs)
         if 'bulk_action_form' not in kwargs:
             context['bulk_action_form'] = self.get_bulk_action_form()
         context['form'] = self.form
+        if self.form.is_valid():
+            context['facet_counts'] = facets.get_counts(self.form)
+            context['bug_count'] = context['facet_counts']['total']
+        else:
+            context['bug_count'] = 0
+        context['page_links'] = self.get_page_links()
         context['bulk_actions'] = self.mutator_class.get_bulk_actions()
+        context['state_actions'] = self.get_state_actions()
         context['preset_form'] = PresetFilterForm(label_suffix='')
         context['sort_links'] = self.get_sort_links()
+        context['export_links'] = self.get_export_links()
         context['sort_by'], context['sort_desc'] = self.sort_type()
+        context['is_search'] = self.is_search()
+        context['as_of'] = self.get_as_of()
         return context
 
     def get_queryset(self):
         qs = super().get_queryset()
         if self.form.is_valid():
-            qs = self.form.filter(qs)
-            order_field, desc = self.sort_type()
-            return qs.order_by(('-' if desc else '') + self.ORDER_FIELDS[order_field])
+            # Ordering is applied by the paginator.
+            return self.form.filter(qs)
         else:
             return qs.none()
 
@@ -148,10 +232,16 @@ class BugListView(LoginRequiredMixin, ListView):
         else:
             return super().get_template_names()
 
+    def is_search(self):
+        return self.form.is_valid() and bool(self.form.cleaned_data['search'])
+
     def sort_type(self):
         order_field = self.request.GET.get('sort')
-        if order_field not in self.ORDER_FIELDS:
+        if order_field not in self.ORDER_FIELDS or (order_field == 'relevance' and not self.is_search()):
             return ('modified', True)
+        elif order_field == 'relevance':
+            # Best matches first, there's no use for the reverse.
+            return ('relevance', True)
         else:
             return (order_field, bool(self.request.GET.get('desc')))
 
@@ -169,15 +259,11 @@ class BugMutationMixin(LoginRequiredMixin):
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
         context['actions'] = self.state_machine.get_actions()
-        context['buggy_user_names'] = [
-            user.get_short_name().lower() for user in User.objects.filter(is_active=True)
-        ]
-        context['buggy_open_bugs'] = [
-            {
-                'title': bug.title,
-                'number': bug.number,
-            } for bug in Bug.objects.exclude(state=State.CLOSED).defer('fulltext')
-        ]
+        context['buggy_autocomplete_url'] = '{}?v={}'.format(
+            reverse('buggy:autocomplete'), autocomplete.get_version()
+        )
+        if uploads.is_enabled():
+            context['buggy_direct_upload_url'] = reverse('buggy:direct_upload')
         return context
 
     def form_valid(self, form):
@@ -202,7 +288,7 @@ class BugDetailView(BugMutationMixin, FormView):
 
     queryset = Bug.objects.select_related(
         'created_by', 'assigned_to', 'project'
-    )
+    ).defer('fulltext', 'search_vector')
 
     def get(self, request, *args, **kwargs):
         self.object = self.get_object()
@@ -225,7 +311,7 @@ class BugDetailView(BugMutationMixin, FormView):
                 # BBB: This extra query can be replaced with
                 # select_for_update(of=('self',)) as soon as it's supported in
                 # Django.
-                Bug.objects.all().select_for_update().get_by_number(self.kwargs['bug_number'])
+                Bug.objects.all().select_for_update().only('id').get_by_number(self.kwargs['bug_number'])
             return self.queryset.get_by_number(self.kwargs['bug_number'])
         except Bug.DoesNotExist as e:
             raise Http404(*e.args)
@@ -233,6 +319,7 @@ class BugDetailView(BugMutationMixin, FormView):
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
         context['bug'] = self.object
+        context['timeline'] = build_timeline(self.object.actions_preloaded)
         return context
 
     def get_initial(self):
@@ -270,6 +357,91 @@ class MarkdownPreviewView(LoginRequiredMixin, View):
         return HttpResponse(Comment(comment=request.POST.get('preview', '')).html)
 
 
+class AutocompleteDataView(LoginRequiredMixin, View):
+    """
+    The users and open bugs for comment autocompletion. Pages link to it with
+    the current version in the URL, so browsers can keep it until it changes.
+    """
+    def get(self, request):
+        version = autocomplete.get_version()
+        etag = quote_etag(version)
+        response = get_conditional_response(request, etag=etag)
+        if response is None:
+            response = JsonResponse(autocomplete.get_data(version))
+        response['ETag'] = etag
+        if request.GET.get('v') == version:
+            patch_cache_control(response, private=True, max_age=60 * 60 * 24 * 365)
+        else:
+            patch_cache_control(response, private=True, no_cache=True)
+        return response
+
+
+class ExportView(LoginRequiredMixin, View):
+    """
+    Streams the bugs matching the bug list's filters, see buggy.export. Add
+    `history=1` for their actions too.
+    """
+    def get(self, request):
+        form = FilterForm(request.GET)
+        format = request.GET.get('format', 'ndjson')
+        if not form.is_valid() or format not in export.FORMATS:
+            return HttpResponseBadRequest()
+
+        history = bool(request.GET.get('history'))
+        compress = 'gzip' in request.META.get('HTTP_ACCEPT_ENCODING', '')
+        response = StreamingHttpResponse(
+            export.export(
+                form.filter(Bug.objects.all()),
+                format=format,
+                history=history,
+                as_of=bool(form.get_as_of()),
+                compress=compress,
+            ),
+            content_type=export.CONTENT_TYPES[format],
+        )
+        if compress:
+            response['Content-Encoding'] = 'gzip'
+        patch_vary_headers(response, ['Accept-Encoding'])
+        response['Content-Disposition'] = 'attachment; filename="{}.{}"'.format(
+            'actions' if history and format == 'csv' else 'bugs',
+            format,
+        )
+        return response
+
+
+class DirectUploadView(LoginRequiredMixin, View):
+    """
+    A presigned POST for the browser to upload an attachment straight to
+    storage, see buggy.uploads.
+    """
+    def post(self, request):
+        if not uploads.is_enabled():
+            raise Http404
+        return JsonResponse(uploads.create_upload(request.POST.get('filename', '')))
+
+
+class AttachmentView(LoginRequiredMixin, View):
+    """
+    An attachment, or its thumbnail. Only images are shown inline, anything
+    else could run scripts on the site.
+    """
+    thumbnail = False
+
+    def get(self, request, pk, filename=None):
+        attachment = get_object_or_404(AddAttachment.objects.select_related('blob'), pk=pk)
+        blob = attachment.blob
+        etag = blob.sha256 or 'blob-{}'.format(blob.pk)
+        if self.thumbnail:
+            if not blob.thumbnail:
+                raise Http404
+            return sendfile.serve_file(
+                request, blob.thumbnail, blob.thumbnail.name, etag + '-thumbnail', as_attachment=False,
+            )
+        return sendfile.serve_file(
+            request, blob.file, attachment.filename, etag, as_attachment=not attachment.is_image,
+        )
+
+
 class GitCommitWebhookView(View):
     def post(self, request):
         if settings.GIT_COMMIT_WEBHOOK_SECRET is None or webhook.validate_signature(
@@ -277,9 +449,15 @@ class GitCommitWebhookView(View):
             request.body,
             request.META['HTTP_X_HUB_SIGNATURE'],
         ):
+            if request.META.get('HTTP_X_GITHUB_EVENT', 'push') != 'push':
+                # Pings and other events have no commits to process.
+                return HttpResponse('', status=204)
             data = json.loads(request.body.decode('utf-8'))
-            for commit in data['commits']:
-                webhook.process_commit(commit)
-            return HttpResponse('', status=201)
+            if not isinstance(data, dict) or not isinstance(data.get('commits'), list):
+                return HttpResponseBadRequest('Not a push.')
+            # Processed by the process_webhooks command, so that big pushes
+            # don't time out.
+            WebhookDelivery.objects.create(payload=data)
+            return HttpResponse('', status=202)
         else:
             return HttpResponseForbidden('Signature does not match.')
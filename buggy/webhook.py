@@ -1,11 +1,18 @@
 import re
 import hmac
 import hashlib
+import logging
 
+from django.conf import settings
 from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.utils import timezone
 
-from .models import Bug
+from .models import Bug, ProcessedCommit, WebhookDelivery
 from .mutation import BuggyBugMutator
+from .utils import get_backoff
+
+logger = logging.getLogger(__name__)
 
 User = get_user_model()
 
@@ -30,24 +37,54 @@ def get_bugs_from_commit_message(msg):
 
 
 def process_commit(commit):
-    try:
-        user = User.objects.get(email=commit['author']['email'])
-    except User.DoesNotExist:
-        return
-
-    mentions, fixes = get_bugs_from_commit_message(commit['message'])
-    for bug_number in mentions | fixes:
-        try:
-            bug = Bug.objects.get_by_number(bug_number)
-        except Bug.DoesNotExist:
-            pass
-        else:
-            past_comments = (
-                action.comment.comment for action in bug.actions.all() if hasattr(action, 'comment')
-            )
-            if not any(commit['id'] in c for c in past_comments):
+    process_commits([commit])
+
+
+def process_commits(commits):
+    """
+    Comments on, or resolves, the bugs referenced by `commits`. The authors,
+    bugs and already processed commits of the whole push are looked up with
+    one query each, and each bug is locked and read again before it's
+    changed.
+    """
+    users = {
+        user.email: user
+        for user in User.objects.filter(email__in={commit['author']['email'] for commit in commits})
+    }
+    commits = [commit for commit in commits if commit['author']['email'] in users]
+
+    references = {}
+    for commit in commits:
+        references[commit['id']] = get_bugs_from_commit_message(commit['message'])
+    bugs = Bug.objects.defer('fulltext', 'search_vector').get_by_numbers({
+        bug_number
+        for mentions, fixes in references.values()
+        for bug_number in mentions | fixes
+    })
+    processed = set(ProcessedCommit.objects.filter(
+        commit_id__in=references.keys(),
+        bug__in=bugs.values(),
+    ).values_list('commit_id', 'bug'))
+
+    for commit in commits:
+        user = users[commit['author']['email']]
+        mentions, fixes = references[commit['id']]
+        for bug_number in mentions | fixes:
+            bug = bugs.get(bug_number)
+            if bug is None or (commit['id'], bug.pk) in processed:
+                continue
+            with transaction.atomic():
+                # The unique constraint makes concurrent deliveries of the same
+                # commit wait for each other, the second one then finds the row.
+                _, created = ProcessedCommit.objects.get_or_create(commit_id=commit['id'], bug=bug)
+                if not created:
+                    continue
+                processed.add((commit['id'], bug.pk))
+                # Read again and locked, the bug may have changed since the
+                # push was loaded, through the UI for example.
+                bug = Bug.objects.select_for_update().defer('fulltext', 'search_vector').get(pk=bug.pk)
                 mutator = BuggyBugMutator(bug=bug, user=user)
-                actions = {a[0] for a in mutator.action_choices(mutator.get_actions())}
+                actions = mutator.get_transition_table()[bug.state]
 
                 comment = "{} {} the bug in commit `{}`:\n\n{}".format(
                     user.get_short_name(),
@@ -63,3 +100,45 @@ def process_commit(commit):
                     'comment': comment,
                     'action': action,
                 })
+
+
+def process_pending_deliveries(limit=10):
+    """
+    Processes up to `limit` of the pushes received by the webhook, each in its
+    own transaction. Returns the number of pushes processed and failed.
+
+    Deliveries are locked with SKIP LOCKED so that several workers can run at
+    once. A failed delivery is retried later, and commits that were already
+    applied are skipped by process_commits then.
+    """
+    max_attempts = getattr(settings, 'BUGGY_WEBHOOK_MAX_ATTEMPTS', 10)
+    done = failed = 0
+    for i in range(limit):
+        with transaction.atomic():
+            delivery = WebhookDelivery.objects.filter(
+                next_attempt_at__lte=timezone.now(),
+            ).order_by('next_attempt_at').select_for_update(skip_locked=True).first()
+            if delivery is None:
+                break
+            try:
+                with transaction.atomic():
+                    # Only pushes are queued, but anything else has nothing to
+                    # do either.
+                    process_commits(delivery.payload.get('commits', []))
+            except Exception as e:
+                logger.exception('Failed to process webhook delivery %s', delivery.pk)
+                delivery.attempts += 1
+                delivery.last_error = repr(e)
+                if delivery.attempts >= max_attempts:
+                    delivery.next_attempt_at = None
+                else:
+                    delivery.next_attempt_at = timezone.now() + get_backoff(
+                        delivery.attempts,
+                        getattr(settings, 'BUGGY_WEBHOOK_RETRY_DELAY', 60),
+                    )
+                delivery.save(update_fields=['attempts', 'last_error', 'next_attempt_at'])
+                failed += 1
+            else:
+                delivery.delete()
+                done += 1
+    return done, failed
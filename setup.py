@@ -41,6 +41,12 @@ setup(
         'buggy_accounts': [
             'django-authtools>=1.5'
         ],
+        'numpy': [
+            'numpy',
+        ],
+        'direct_uploads': [
+            'boto3',
+        ],
     },
     classifiers=[
         'Development Status :: 3 - Alpha',